@@ -0,0 +1,82 @@
+import re
+import ipaddress
+
+# IPv4 addresses are packed as IPv4-mapped IPv6 (::ffff:a.b.c.d) so both
+# families share one 128-bit key space
+IPV4_MAPPED = 0xFFFF << 32
+MAC_BITS = 48
+
+_HEX = re.compile(r"^[0-9a-f]+$")
+
+
+def ip_to_int(address):
+    """Pack an IPv4/IPv6 address string into a 128-bit integer."""
+    address = ipaddress.ip_address(address.strip())
+    if address.version == 4:
+        return IPV4_MAPPED | int(address)
+    return int(address)
+
+
+def int_to_ip(value):
+    if value >> 32 == 0xFFFF:
+        return str(ipaddress.IPv4Address(value & 0xFFFFFFFF))
+    return str(ipaddress.IPv6Address(value))
+
+
+def ip_range(network):
+    """Return the (first, last) packed addresses of a CIDR prefix or single address."""
+    network = ipaddress.ip_network(network.strip(), strict=False)
+    first, last = int(network.network_address), int(network.broadcast_address)
+    if network.version == 4:
+        return IPV4_MAPPED | first, IPV4_MAPPED | last
+    return first, last
+
+
+def canonical_ip(address):
+    return str(ipaddress.ip_address(address.strip()))
+
+
+def split_ip(value):
+    # High and low 64-bit halves, for uint64 arrays
+    return value >> 64, value & 0xFFFFFFFFFFFFFFFF
+
+
+def mac_digits(mac):
+    # Hex digits of a MAC in any of the usual spellings (aa:bb.., aa-bb.., aabb.ccdd..)
+    digits = re.sub(r"[:\-.\s]", "", mac.strip().lower())
+    if not digits or not _HEX.match(digits) or len(digits) > 12:
+        raise ValueError(f"'{mac}' is not a MAC address or prefix")
+    return digits
+
+
+def mac_to_int(mac):
+    digits = mac_digits(mac)
+    if len(digits) != 12:
+        raise ValueError(f"'{mac}' is not a complete MAC address")
+    return int(digits, 16)
+
+
+def int_to_mac(value):
+    digits = f"{value:012x}"
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def mac_range(prefix):
+    """Return the (first, last) packed MACs starting with prefix, e.g. an OUI like '00:1b:17'."""
+    digits = mac_digits(prefix)
+    free_bits = (12 - len(digits)) * 4
+    first = int(digits, 16) << free_bits
+    return first, first | ((1 << free_bits) - 1)
+
+
+def normalize_mac(mac):
+    return int_to_mac(mac_to_int(mac))
+
+
+def ip_to_bytes(address):
+    # Same encoding as MySQL INET6_ATON(): 4 bytes for IPv4, 16 for IPv6
+    return ipaddress.ip_address(address.strip()).packed
+
+
+def bytes_to_ip(value):
+    return str(ipaddress.ip_address(bytes(value)))
@@ -0,0 +1,106 @@
+import time
+import requests
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from xml.etree import ElementTree as ET
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# CLI status command -> XML API op command. Commands missing here have no usable
+# op form (logs are an async log job, "show session all" is paged) and stay on SSH.
+API_COMMANDS = {
+    "show clock": "<show><clock></clock></show>",
+    "show lacp aggregate-ethernet all": "<show><lacp><aggregate-ethernet>all</aggregate-ethernet></lacp></show>",
+    "show interface all": "<show><interface>all</interface></show>",
+    "show high-availability state": "<show><high-availability><state></state></high-availability></show>",
+    "show system info": "<show><system><info></info></system></show>",
+    "show running resource-monitor hour last 24": "<show><running><resource-monitor><hour><last>24</last></hour></resource-monitor></running></show>",
+    "show running resource-monitor day last 7": "<show><running><resource-monitor><day><last>7</last></day></resource-monitor></running></show>",
+    "show lldp neighbors all": "<show><lldp><neighbors>all</neighbors></lldp></show>",
+    "show arp all": "<show><arp><entry name='all'/></arp></show>",
+    "show routing route": "<show><routing><route></route></routing></show>",
+    "show routing protocol bgp summary": "<show><routing><protocol><bgp><summary></summary></bgp></protocol></routing></show>",
+    "show routing protocol bgp peer": "<show><routing><protocol><bgp><peer></peer></bgp></protocol></routing></show>",
+    "show routing protocol bgp loc-rib": "<show><routing><protocol><bgp><loc-rib></loc-rib></bgp></protocol></routing></show>",
+    "show routing protocol bgp rib-out": "<show><routing><protocol><bgp><rib-out></rib-out></bgp></protocol></routing></show>",
+    "show session all filter count yes": "<show><session><all><filter><count>yes</count></filter></all></session></show>",
+}
+
+
+def split_commands(commands):
+    # Returns (commands with an API form, commands that must go over SSH)
+    api = [command for command in commands if command in API_COMMANDS]
+    ssh = [command for command in commands if command not in API_COMMANDS]
+    return api, ssh
+
+
+def open_api_session(host, user, password, workers, timeout):
+    # One keep-alive session per firewall; the pool is only as wide as the worker count
+    session = requests.Session()
+    session.verify = False
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("https://", adapter)
+
+    response = session.post(f"https://{host}/api/?type=keygen", data={'user': user, 'password': password},
+                            timeout=timeout)
+    response.raise_for_status()
+    key = ET.fromstring(response.text).find('.//key')
+    if key is None:
+        session.close()
+        raise RuntimeError(f"API key generation failed for {host}")
+    session.headers.update({'X-PAN-KEY': key.text})
+    return session
+
+
+def fetch_api_command(session, host, command, timeout):
+    response = session.get(f"https://{host}/api/", params={'type': 'op', 'cmd': API_COMMANDS[command]},
+                           timeout=timeout)
+    response.raise_for_status()
+    if 'status="success"' not in response.text[:200]:
+        raise RuntimeError(f"API returned an error for '{command}': {response.text[:200]}")
+    return response.text
+
+
+def capture_api_commands(host, user, password, commands, context, store, workers=4, timeout=300, progress=None,
+                         report=None):
+    """Fetch the API-capable commands concurrently and store each response as XML.
+
+    Returns ({command: stored path}, [commands that failed]) so the caller can
+    fall back to SSH for anything the API could not deliver.
+    """
+    captured = {}
+    failed = []
+    connect_start = time.monotonic()
+    try:
+        session = open_api_session(host, user, password, workers, timeout)
+    except Exception:
+        return captured, list(commands)
+    finally:
+        if report:
+            report.add_time(host, "*", "connect", time.monotonic() - connect_start)
+
+    def fetch(command):
+        if progress:
+            progress(host, f"api {command}")
+        start = time.monotonic()
+        output = fetch_api_command(session, host, command, timeout)
+        if report:
+            # One HTTP round trip covers both sending the request and waiting for the result
+            report.add_time(host, command, "wait", time.monotonic() - start)
+            report.record(host, command, bytes=len(output), transport="api")
+        return command, output
+
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch, command) for command in commands]
+        for command, future in zip(commands, futures):
+            try:
+                _, output = future.result()
+            except Exception:
+                failed.append(command)
+                continue
+            write_start = time.monotonic()
+            captured[command] = store(host, command, output, context, extension="xml")
+            if report:
+                report.add_time(host, command, "write", time.monotonic() - write_start)
+    return captured, failed
@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+import os
+import sys
+import time
+import logging
+import re
+import argparse
+import threading
+from datetime import datetime
+import numpy as np
+from sqlalchemy import select
+from address_utils import ip_to_int, int_to_ip, ip_range, split_ip, mac_to_int, int_to_mac, mac_range
+from schema import ARPEntry, Device
+
+SNAPSHOT_PATH = os.path.join("output", "arp_index.npz")
+DEFAULT_LIMIT = 100
+
+# Queries read as a MAC prefix without --mac: colon/hyphen separated octets, or
+# Cisco-style dotted groups. '10.1' or a bare '101' is never taken for an OUI.
+MAC_QUERY_RE = re.compile(r"^([0-9a-f]{1,2}([:-][0-9a-f]{0,2})+|[0-9a-f]{4}(\.[0-9a-f]{0,4}){1,2}|[0-9a-f]{12})$", re.I)
+
+
+class ArpIndex:
+    """Fleet-wide MAC/IP index of arp_entries held in memory.
+
+    Every (device, IP, MAC) entry is a row of parallel NumPy arrays: packed IP
+    (two uint64 halves), packed MAC, device id, last seen (epoch seconds) and
+    online flag. Two sort orders, by IP and by MAC, turn exact, CIDR and OUI
+    queries into a pair of binary searches. Polls update a dict of entries and
+    the arrays are rebuilt on the next query.
+    """
+
+    def __init__(self):
+        # (device_id, packed ip, packed mac) -> (last seen, online); None while only arrays are loaded
+        self.entries = {}
+        self.device_keys = {}
+        self.hostnames = {}
+        self.dirty = True
+        self.built_at = 0.0
+        self._set_arrays(*(np.array([], dtype=dtype) for dtype in
+                           (np.int32, np.uint64, np.uint64, np.uint64, np.int64, bool)))
+
+    def _set_arrays(self, device, ip_hi, ip_lo, mac, seen, online):
+        self.device, self.ip_hi, self.ip_lo, self.mac, self.seen, self.online = device, ip_hi, ip_lo, mac, seen, online
+        self.ip_order = np.lexsort((ip_lo, ip_hi))
+        self.ip_hi_sorted = ip_hi[self.ip_order]
+        self.ip_lo_sorted = ip_lo[self.ip_order]
+        self.mac_order = np.argsort(mac, kind="stable")
+        self.mac_sorted = mac[self.mac_order]
+
+    def __len__(self):
+        return len(self.entries) if self.entries is not None else len(self.device)
+
+    def _ensure_entries(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        self.device_keys = {}
+        for device_id, hi, lo, mac, seen, online in zip(self.device.tolist(), self.ip_hi.tolist(), self.ip_lo.tolist(),
+                                                        self.mac.tolist(), self.seen.tolist(), self.online.tolist()):
+            ip = (hi << 64) | lo
+            self.entries[(device_id, ip, mac)] = (seen, online)
+            self.device_keys.setdefault(device_id, set()).add((ip, mac))
+
+    def add(self, device_id, ip_address, mac_address, last_seen, online):
+        self._ensure_entries()
+        key = (ip_to_int(ip_address), mac_to_int(mac_address))
+        self.entries[(device_id,) + key] = (int(last_seen.timestamp()), online)
+        self.device_keys.setdefault(device_id, set()).add(key)
+        self.dirty = True
+
+    def apply_poll(self, device_id, hostname, entries, now=None):
+        """Fold one device's ARP poll in, the same way reconcile_device does in MySQL.
+
+        Polled entries are online and last seen now; the device's other
+        entries go offline and keep their last-seen time.
+        """
+        self._ensure_entries()
+        now = int((now or datetime.now()).timestamp())
+        self.hostnames[device_id] = hostname
+        seen = set()
+        for entry in entries:
+            try:
+                seen.add((ip_to_int(entry['ip_address']), mac_to_int(entry['mac_address'])))
+            except ValueError as e:
+                logging.debug(f"Skipping ARP entry on {hostname}: {e}")
+        for key in self.device_keys.get(device_id, set()) - seen:
+            last_seen, online = self.entries[(device_id,) + key]
+            if online:
+                self.entries[(device_id,) + key] = (last_seen, False)
+        for key in seen:
+            self.entries[(device_id,) + key] = (now, True)
+        self.device_keys.setdefault(device_id, set()).update(seen)
+        self.dirty = True
+
+    def freeze(self):
+        """Rebuild the arrays from the entries if anything changed."""
+        if not self.dirty or self.entries is None:
+            return
+        start = time.monotonic()
+        count = len(self.entries)
+        keys = self.entries.keys()
+        values = self.entries.values()
+        self._set_arrays(
+            np.fromiter((device_id for device_id, _, _ in keys), np.int32, count),
+            np.fromiter((split_ip(ip)[0] for _, ip, _ in keys), np.uint64, count),
+            np.fromiter((split_ip(ip)[1] for _, ip, _ in keys), np.uint64, count),
+            np.fromiter((mac for _, _, mac in keys), np.uint64, count),
+            np.fromiter((seen for seen, _ in values), np.int64, count),
+            np.fromiter((online for _, online in values), bool, count),
+        )
+        self.dirty = False
+        self.built_at = time.time()
+        logging.info(f"Built ARP index of {count} entries in {time.monotonic() - start:.2f}s")
+
+    def _ip_bound(self, value, side):
+        # Lexicographic search over (hi, lo): narrow to the run of equal hi, then search lo within it
+        hi, lo = (np.uint64(half) for half in split_ip(value))
+        start = np.searchsorted(self.ip_hi_sorted, hi, "left")
+        end = np.searchsorted(self.ip_hi_sorted, hi, "right")
+        return start + np.searchsorted(self.ip_lo_sorted[start:end], lo, side)
+
+    def ip_rows(self, first, last):
+        self.freeze()
+        return self.ip_order[self._ip_bound(first, "left"):self._ip_bound(last, "right")]
+
+    def mac_rows(self, first, last):
+        self.freeze()
+        return self.mac_order[np.searchsorted(self.mac_sorted, np.uint64(first), "left"):
+                              np.searchsorted(self.mac_sorted, np.uint64(last), "right")]
+
+    def rows_for(self, query, kind=None):
+        """Row numbers matching an IP, CIDR prefix, MAC or MAC prefix (OUI).
+
+        kind is "ip", "mac" or None to guess; a guessed MAC prefix must carry a
+        MAC separator, so a partial IP is an error rather than an OUI search.
+        """
+        query = query.strip()
+        if kind != "mac":
+            try:
+                return self.ip_rows(*ip_range(query))
+            except ValueError:
+                if kind == "ip":
+                    raise ValueError(f"'{query}' is not an IP address or CIDR prefix")
+        if kind == "mac" or MAC_QUERY_RE.match(query):
+            try:
+                return self.mac_rows(*mac_range(query))
+            except ValueError:
+                raise ValueError(f"'{query}' is not a MAC address or MAC prefix")
+        raise ValueError(f"'{query}' is not an IP address, prefix or MAC address; use a CIDR prefix "
+                         f"(e.g. 10.1.0.0/16) for a partial IP, or --mac for a MAC prefix without separators")
+
+    def lookup(self, query, limit=DEFAULT_LIMIT, online_only=False, kind=None):
+        """Entries matching query, most recently seen first."""
+        rows = self.rows_for(query, kind)
+        if online_only:
+            rows = rows[self.online[rows]]
+        if len(rows) > limit:
+            # Only the newest `limit` rows need ordering
+            rows = rows[np.argpartition(-self.seen[rows], limit - 1)[:limit]]
+        rows = rows[np.argsort(-self.seen[rows], kind="stable")]
+        return [self.describe(row) for row in rows.tolist()]
+
+    def device_entries(self, hostname, online_only=False):
+        """All entries of one firewall, most recently seen first."""
+        self.freeze()
+        device_ids = [device_id for device_id, name in self.hostnames.items() if name == hostname]
+        rows = np.nonzero(np.isin(self.device, device_ids) & (self.online | (not online_only)))[0]
+        rows = rows[np.argsort(-self.seen[rows], kind="stable")]
+        return [self.describe(row) for row in rows.tolist()]
+
+    def describe(self, row):
+        device_id = int(self.device[row])
+        return {
+            'hostname': self.hostnames.get(device_id, str(device_id)),
+            'device_id': device_id,
+            'ip_address': int_to_ip((int(self.ip_hi[row]) << 64) | int(self.ip_lo[row])),
+            'mac_address': int_to_mac(int(self.mac[row])),
+            'last_seen': datetime.fromtimestamp(int(self.seen[row])),
+            'status': 'online' if self.online[row] else 'offline',
+        }
+
+    def save(self, path=SNAPSHOT_PATH):
+        """Write the arrays to an .npz snapshot, replacing the old one atomically."""
+        self.freeze()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        host_ids = sorted(self.hostnames)
+        with open(path + ".tmp", "wb") as snapshot:
+            np.savez(snapshot, device=self.device, ip_hi=self.ip_hi, ip_lo=self.ip_lo, mac=self.mac,
+                     seen=self.seen, online=self.online, host_ids=np.array(host_ids, dtype=np.int32),
+                     host_names=np.array([self.hostnames[device_id] for device_id in host_ids], dtype=str))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path=SNAPSHOT_PATH):
+        index = cls()
+        with np.load(path) as snapshot:
+            index._set_arrays(snapshot["device"], snapshot["ip_hi"], snapshot["ip_lo"], snapshot["mac"],
+                              snapshot["seen"], snapshot["online"])
+            index.hostnames = dict(zip(snapshot["host_ids"].tolist(), snapshot["host_names"].tolist()))
+        # The entries dict is only rebuilt if this copy starts taking polls
+        index.entries = None
+        index.dirty = False
+        index.built_at = os.path.getmtime(path)
+        return index
+
+    @classmethod
+    def from_database(cls, engine):
+        index = cls()
+        with engine.connect() as conn:
+            index.hostnames = dict(conn.execute(select(Device.id, Device.hostname)).all())
+            rows = conn.execution_options(stream_results=True).execute(select(
+                ARPEntry.device_id, ARPEntry.ip_address, ARPEntry.mac_address, ARPEntry.timestamp, ARPEntry.status))
+            for device_id, ip_address, mac_address, timestamp, status in rows:
+                try:
+                    index.add(device_id, ip_address, mac_address, timestamp, status == 'online')
+                except ValueError as e:
+                    logging.debug(f"Skipping arp_entries row of device {device_id}: {e}")
+        index.freeze()
+        return index
+
+
+_current = None
+_current_mtime = None
+_current_lock = threading.Lock()
+
+
+def current(path=SNAPSHOT_PATH):
+    """Shared read-only index from the poller's snapshot, reloaded when the snapshot changes.
+
+    Returns None if the poller has not written a snapshot yet.
+    """
+    global _current, _current_mtime
+    with _current_lock:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return _current
+        if mtime != _current_mtime:
+            _current = ArpIndex.load(path)
+            _current_mtime = mtime
+        return _current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find which firewalls saw a MAC or IP address.")
+    parser.add_argument('query', nargs='*', help="IP, CIDR prefix, MAC or MAC prefix (e.g. an OUI like 00:1b:17)")
+    parser.add_argument('-n', '--limit', type=int, default=DEFAULT_LIMIT, help="Maximum entries per query")
+    parser.add_argument('--online', action='store_true', help="Only entries that are currently online")
+    parser.add_argument('--mac', action='store_true', help="Treat every query as a MAC or MAC prefix (e.g. 001b17)")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the snapshot from arp_entries in MySQL")
+    parser.add_argument('--snapshot', default=SNAPSHOT_PATH, help="Index snapshot file")
+    args = parser.parse_args()
+
+    if args.rebuild or not os.path.exists(args.snapshot):
+        from db_connect import create_db_engine
+        start = time.monotonic()
+        index = ArpIndex.from_database(create_db_engine())
+        index.save(args.snapshot)
+        print(f"Indexed {len(index)} ARP entries from MySQL in {time.monotonic() - start:.1f}s", file=sys.stderr)
+    else:
+        index = ArpIndex.load(args.snapshot)
+        print(f"ARP index of {len(index)} entries from {datetime.fromtimestamp(index.built_at):%Y-%m-%d %H:%M:%S}",
+              file=sys.stderr)
+
+    for query in args.query:
+        start = time.perf_counter()
+        try:
+            results = index.lookup(query, args.limit, args.online, "mac" if args.mac else None)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            continue
+        elapsed = (time.perf_counter() - start) * 1e6
+        print(f"{query}: {len(results)} entries in {elapsed:.0f} µs")
+        for result in results:
+            print(f"  {result['hostname']:<20} {result['ip_address']:<40} {result['mac_address']}  "
+                  f"{result['last_seen']:%Y-%m-%d %H:%M:%S}  {result['status']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,214 @@
+import os
+import sys
+import argparse
+import json
 import time
+import logging
+import requests
+import urllib3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from xml.etree import ElementTree as ET
+from sqlalchemy import tuple_, update
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-from schema import ARPEntry, ARPHistory, Device, setup_database
-from db_connect import create_db_engine
-
-def get_arp_table(device):
-    # Placeholder function to simulate ARP table retrieval
-    # Replace with actual API call to get ARP table from the device
-    return [
-        {'ip_address': '192.168.1.1', 'mac_address': '00:11:22:33:44:55'},
-        # Add more entries as needed
+from schema import ARPEntry, ARPHistory, Device, setup_database, compact_arp_keys
+from address_utils import canonical_ip, normalize_mac
+from db_connect import create_db_engine, log_statement_stats, bulk_load
+from spool import Spool, Forwarder, SPOOL_PATH
+from arp_index import ArpIndex, SNAPSHOT_PATH
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Rows per multi-row statement
+BATCH_SIZE = 1000
+POLL_INTERVAL = 600
+FETCH_WORKERS = 16
+FETCH_TIMEOUT = 120
+ARP_COMMAND = "<show><arp><entry name='all'/></arp></show>"
+
+def get_arp_table(device, api_key, timeout=FETCH_TIMEOUT):
+    """Fetch a device's ARP table over the XML API.
+
+    The response is parsed as it streams in, so a hub firewall's table is never
+    held as one document. Returns a list of entries, or None if the poll failed.
+    """
+    host = device.mgmt_ip or device.hostname
+    try:
+        with requests.get(f"https://{host}/api/", params={'type': 'op', 'cmd': ARP_COMMAND},
+                          headers={'X-PAN-KEY': api_key}, verify=False, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            entries = []
+            for event, elem in ET.iterparse(response.raw, events=("start", "end")):
+                if event == "start":
+                    if elem.tag == "response" and elem.get("status") != "success":
+                        raise RuntimeError(f"API returned status {elem.get('status')}")
+                    continue
+                if elem.tag != "entry":
+                    continue
+                ip_address = (elem.findtext("ip") or "").strip()
+                mac_address = (elem.findtext("mac") or "").strip().lower()
+                status = (elem.findtext("status") or "").strip()
+                elem.clear()
+                # Incomplete entries have no MAC yet
+                if ip_address and mac_address and "incomplete" not in mac_address and status != "i":
+                    entries.append({'ip_address': ip_address, 'mac_address': mac_address})
+            return entries
+    except Exception as e:
+        # Includes socket/urllib3 errors raised while streaming; one device never stops the cycle
+        logging.error(f"ARP poll of {device.hostname} ({host}) failed: {e}")
+        return None
+
+def chunks(items, size=BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def arp_keys(entries, compact=False):
+    keys = set()
+    for entry in entries:
+        if not compact:
+            keys.add((entry['ip_address'], entry['mac_address']))
+            continue
+        # Packed columns read back in canonical form, so polls are compared in the same form
+        try:
+            keys.add((canonical_ip(entry['ip_address']), normalize_mac(entry['mac_address'])))
+        except ValueError as e:
+            logging.warning(f"Skipping unparseable ARP entry {entry}: {e}")
+    return keys
+
+def reconcile_device(session, device_id, current_arp_entries, now=None):
+    """Bring one device's arp_entries in line with a fresh poll.
+
+    The device's rows are loaded once and compared in memory; changes go out as
+    bulk statements in the caller's transaction. Returns (online, offline)
+    counts of status changes.
+    """
+    now = now or datetime.now()
+    existing = {
+        (ip_address, mac_address): status
+        for ip_address, mac_address, status in session.query(
+            ARPEntry.ip_address, ARPEntry.mac_address, ARPEntry.status
+        ).filter(ARPEntry.device_id == device_id)
+    }
+    seen = arp_keys(current_arp_entries, compact_arp_keys(session.get_bind()))
+
+    # New entries and entries that were offline come (back) online; only
+    # entries missing from this poll go offline
+    came_online = [key for key in seen if existing.get(key) != 'online']
+    went_offline = [key for key in existing.keys() - seen if existing[key] != 'offline']
+
+    # Every seen entry gets its last-seen timestamp refreshed; hub-sized tables
+    # go through the bulk loader
+    bulk_load(session.connection(), ARPEntry.__table__, (
+        {'device_id': device_id, 'ip_address': ip_address, 'mac_address': mac_address,
+         'timestamp': now, 'status': 'online'}
+        for ip_address, mac_address in seen
+    ), mode='merge', update_columns=['timestamp', 'status'])
+
+    for batch in chunks(went_offline):
+        session.execute(
+            update(ARPEntry.__table__)
+            .where(ARPEntry.device_id == device_id)
+            .where(tuple_(ARPEntry.ip_address, ARPEntry.mac_address).in_(batch))
+            .values(status='offline')
+        )
+
+    history = [
+        {'device_id': device_id, 'ip_address': ip_address, 'mac_address': mac_address,
+         'timestamp': now, 'status': status}
+        for keys, status in ((came_online, 'online'), (went_offline, 'offline'))
+        for ip_address, mac_address in keys
     ]
+    if history:
+        bulk_load(session.connection(), ARPHistory.__table__, history)
+    return len(came_online), len(went_offline)
 
-def update_arp_entries():
-    engine = create_db_engine()
+def forward_arp_polls(session, payloads):
+    # Spool handler: reconcile spooled polls in order, within the forwarder's transaction
+    for payload in payloads:
+        reconcile_device(session, payload['device_id'], payload['entries'],
+                         datetime.fromisoformat(payload['polled_at']))
+
+SPOOL_HANDLERS = {'arp_poll': forward_arp_polls}
+
+# Last device list read from MySQL, so spooled polling continues while it is down;
+# also kept next to the spool so the poller can start without MySQL
+DEVICE_CACHE = os.path.join(os.path.dirname(SPOOL_PATH), "devices.json")
+KnownDevice = namedtuple("KnownDevice", ["id", "hostname", "mgmt_ip"])
+_known_devices = []
+
+def save_known_devices(devices, path=DEVICE_CACHE):
+    with open(path + ".tmp", "w") as cache:
+        json.dump([list(device) for device in devices], cache)
+    os.replace(path + ".tmp", path)
+
+def load_known_devices(path=DEVICE_CACHE):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as cache:
+        return [KnownDevice(*device) for device in json.load(cache)]
+
+def update_arp_entries(engine=None, api_key=None, workers=FETCH_WORKERS, spool=None, index=None):
+    engine = engine or create_db_engine()
+    if api_key is None:
+        # Imported lazily: the Panorama helpers pull in the dashboard dependencies
+        from pan_functions import read_firewall_api_key
+        api_key = read_firewall_api_key()
     Session = sessionmaker(bind=engine)
     session = Session()
 
+    global _known_devices
     try:
-        devices = session.query(Device).all()
-        for device in devices:
-            current_arp_entries = get_arp_table(device)
-            for entry in current_arp_entries:
-                arp_entry = session.query(ARPEntry).filter_by(
-                    device_id=device.id,
-                    ip_address=entry['ip_address'],
-                    mac_address=entry['mac_address']
-                ).first()
-
-                if arp_entry:
-                    # Update existing entry
-                    if arp_entry.status != 'online':
-                        arp_entry.status = 'online'
-                        # Log the status change in history
-                        history_entry = ARPHistory(
-                            device_id=device.id,
-                            ip_address=entry['ip_address'],
-                            mac_address=entry['mac_address'],
-                            timestamp=datetime.now(),
-                            status='online'
-                        )
-                        session.add(history_entry)
-                    arp_entry.timestamp = datetime.now()
-                else:
-                    # Add new entry
-                    new_arp_entry = ARPEntry(
-                        device_id=device.id,
-                        ip_address=entry['ip_address'],
-                        mac_address=entry['mac_address'],
-                        timestamp=datetime.now(),
-                        status='online'
-                    )
-                    session.add(new_arp_entry)
-                    # Log the new entry in history
-                    history_entry = ARPHistory(
-                        device_id=device.id,
-                        ip_address=entry['ip_address'],
-                        mac_address=entry['mac_address'],
-                        timestamp=datetime.now(),
-                        status='online'
-                    )
-                    session.add(history_entry)
-
-            # Mark entries not seen in the current poll as offline
-            offline_entries = session.query(ARPEntry).filter(
-                ARPEntry.device_id == device.id,
-                ARPEntry.timestamp < datetime.now()
-            ).all()
-            for offline_entry in offline_entries:
-                if offline_entry.status != 'offline':
-                    offline_entry.status = 'offline'
-                    # Log the status change in history
-                    history_entry = ARPHistory(
-                        device_id=offline_entry.device_id,
-                        ip_address=offline_entry.ip_address,
-                        mac_address=offline_entry.mac_address,
-                        timestamp=datetime.now(),
-                        status='offline'
-                    )
-                    session.add(history_entry)
-
-        session.commit()
+        try:
+            devices = [KnownDevice(*device) for device in
+                       session.query(Device.id, Device.hostname, Device.mgmt_ip).all()]
+            session.commit()
+            _known_devices = devices
+            if spool:
+                save_known_devices(devices)
+        except SQLAlchemyError:
+            if spool and not _known_devices:
+                _known_devices = load_known_devices()
+            if not (spool and _known_devices):
+                raise
+            session.rollback()
+            devices = _known_devices
+            print("Device list unavailable, polling the last known devices into the spool")
+        # Fetches run on a bounded pool; this thread is the database writer and
+        # reconciles each table as it arrives while the next ones are in flight
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(get_arp_table, device, api_key): device for device in devices}
+            for future in as_completed(futures):
+                device = futures[future]
+                try:
+                    current_arp_entries = future.result()
+                except Exception as e:
+                    logging.error(f"ARP poll of {device.hostname} failed: {e}")
+                    current_arp_entries = None
+                if current_arp_entries is None:
+                    # A failed poll must not flap the device's entries offline
+                    continue
+                polled_at = datetime.now()
+                if index is not None:
+                    index.apply_poll(device.id, device.hostname, current_arp_entries, polled_at)
+                if spool:
+                    # Local disk write; the forwarder reconciles it when MySQL keeps up
+                    spool.put('arp_poll', {'device_id': device.id, 'hostname': device.hostname,
+                                           'entries': current_arp_entries, 'polled_at': polled_at})
+                    continue
+                try:
+                    # One transaction per device
+                    online, offline = reconcile_device(session, device.id, current_arp_entries, polled_at)
+                    session.commit()
+                except SQLAlchemyError as e:
+                    print(f"An error occurred for {device.hostname}: {e}")
+                    session.rollback()
+                    continue
+                if online or offline:
+                    print(f"{device.hostname}: {online} online, {offline} offline")
     except SQLAlchemyError as e:
         print(f"An error occurred: {e}")
         session.rollback()
@@ -89,7 +216,54 @@ def update_arp_entries():
         session.close()
 
 if __name__ == "__main__":
-    setup_database()
+    parser = argparse.ArgumentParser(description="Poll the firewalls' ARP tables into MySQL and the MAC/IP index.")
+    parser.add_argument('--allow-panorama-key', action='store_true',
+                        help="Use the Panorama API key if the firewall key file is missing")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    # Imported lazily: the Panorama helpers pull in the dashboard dependencies
+    from pan_functions import read_firewall_api_key
+    try:
+        # Read once at startup, so a missing key stops the poller instead of failing every cycle
+        api_key = read_firewall_api_key(args.allow_panorama_key)
+    except FileNotFoundError as e:
+        sys.exit(f"{e} Create it, or pass --allow-panorama-key to use the Panorama key.")
+    engine = create_db_engine()
+    # Polls go to a local spool so a slow or unavailable database never stalls collection
+    spool = Spool()
+    try:
+        setup_database(engine=engine)
+    except SQLAlchemyError as e:
+        # Tables already exist in any deployment that has run before; polls spool until MySQL is back
+        print(f"MySQL unavailable at startup, spooling polls: {e}")
+    forwarder = Forwarder(spool, engine, SPOOL_HANDLERS)
+    forwarder.start()
+    # In-memory MAC/IP index, published as a snapshot for the dashboard and arp_index.py.
+    # Without MySQL it continues from the last snapshot; with neither, it is only
+    # saved once a full index could be built, so a good snapshot is never replaced
+    # by a partial one.
+    index, index_complete = ArpIndex(), False
     while True:
-        update_arp_entries()
-        time.sleep(600)  # Poll every 10 minutes
\ No newline at end of file
+        cycle_start = time.monotonic()
+        if not index_complete:
+            try:
+                index, index_complete = ArpIndex.from_database(engine), True
+            except SQLAlchemyError as e:
+                if os.path.exists(SNAPSHOT_PATH) and not len(index):
+                    print(f"Could not load the ARP index from MySQL, continuing from the last snapshot: {e}")
+                    index, index_complete = ArpIndex.load(SNAPSHOT_PATH), True
+                else:
+                    print(f"Could not load the ARP index from MySQL, snapshot not updated: {e}")
+        update_arp_entries(engine, api_key, spool=spool, index=index)
+        if index_complete:
+            index.save()
+        # Where this cycle's database time went; the counts restart every cycle
+        log_statement_stats(5, reset=True)
+        depth, age = spool.depth()
+        if depth:
+            print(f"Spool depth {depth} (oldest {age:.0f}s)")
+        elapsed = time.monotonic() - cycle_start
+        if elapsed > POLL_INTERVAL:
+            print(f"ARP poll cycle took {elapsed:.0f}s, longer than the {POLL_INTERVAL}s interval", file=sys.stderr)
+        # Poll every 10 minutes, measured from the start of the cycle
+        time.sleep(max(0, POLL_INTERVAL - elapsed))
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from xml.etree import ElementTree as ET
+from sqlalchemy import delete, insert, select
+from capture_diff import parse_capture, XML_PARSERS, parse_xml_flat
+from capture_index import parse_capture_name, KNOWN_COMMANDS
+from db_connect import create_db_engine, bulk_load
+from schema import CaptureFile, CaptureRecord
+
+ROOTS = ("output", "logs")
+# Volatile outputs with nothing worth querying as records
+SKIP_COMMANDS = {"show clock", "show log system receive_time in last-24-hrs"}
+RESOURCE_MONITOR_PREFIX = "show running resource-monitor"
+MAX_TEXT = 255
+PROGRESS_INTERVAL = 10
+# Files handed to the pool at a time, so parsed results never pile up ahead of the writer
+POOL_BATCH = 2000
+
+
+def scan(roots=ROOTS, known=None, hosts=None, since=None):
+    """Yield capture files under <root>/<host>/ that are new or changed since they were imported."""
+    known = known or {}
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        for host_entry in os.scandir(root):
+            if not host_entry.is_dir() or (hosts and host_entry.name not in hosts):
+                continue
+            for file_entry in os.scandir(host_entry.path):
+                if not file_entry.is_file() or file_entry.name.endswith(".json"):
+                    continue
+                stat = file_entry.stat()
+                previous = known.get(file_entry.path)
+                if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns:
+                    continue
+                parsed = parse_capture_name(file_entry.name)
+                if parsed:
+                    command, context, captured_at, error = parsed
+                    if error:
+                        continue
+                else:
+                    # logs/<host>/<command>.txt from multi_palo_api_exec is rewritten in place on every run
+                    sanitized = os.path.splitext(file_entry.name)[0]
+                    command = KNOWN_COMMANDS.get(sanitized, sanitized.replace("_", " "))
+                    context = None
+                    captured_at = datetime.fromtimestamp(stat.st_mtime)
+                if command in SKIP_COMMANDS or (since and captured_at < since):
+                    continue
+                yield {"host": host_entry.name, "command": command, "context": context, "captured_at": captured_at,
+                       "path": file_entry.path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, tuple):
+        if value and all(isinstance(item, tuple) and len(item) == 2 for item in value):
+            return ", ".join(f"{name}={item}" for name, item in value)
+        return " | ".join(_text(item) or "" for item in value)
+    return str(value)[:MAX_TEXT]
+
+
+def read_api_log(path):
+    # multi_palo_api_exec writes a "CMD: <url>" line followed by the raw API response
+    with open(path, "r", errors="replace") as log_file:
+        content = log_file.read()
+    if content.startswith("CMD:"):
+        content = content.split("\n", 1)[1] if "\n" in content else ""
+    root = ET.fromstring(content.strip())
+    if root.get("status") != "success":
+        raise ValueError(f"API response status {root.get('status')}")
+    result = root.find("result")
+    return result if result is not None else root
+
+
+def parse_file(candidate):
+    """Worker: parse one file into capture records and, for resource-monitor XML, history samples."""
+    command, path = candidate["command"], candidate["path"]
+    try:
+        if candidate["context"] is None:
+            result = read_api_log(path)
+        elif path.endswith(".xml"):
+            result = ET.parse(path).getroot()
+            result = result.find("result") if result.find("result") is not None else result
+        else:
+            result = None
+
+        if command.startswith(RESOURCE_MONITOR_PREFIX):
+            if result is None:
+                return {"records": [], "samples": {}, "error": "text resource-monitor output is not imported"}
+            # Imported lazily: the collector pulls in the HTTP client
+            from resource_monitor import RESOLUTIONS, parse_resource_monitor, sample_anchor, sample_rows
+            samples = {}
+            for period, series in parse_resource_monitor(result).items():
+                if period not in RESOLUTIONS:
+                    continue
+                seconds = RESOLUTIONS[period]["seconds"]
+                # Captures taken just after a period boundary cannot be placed reliably
+                anchor = sample_anchor(candidate["captured_at"], candidate["captured_at"], seconds)
+                if anchor is not None:
+                    samples[period] = sample_rows(candidate["host"], series, seconds, anchor)
+            return {"records": [], "samples": samples, "error": None}
+
+        if result is not None:
+            records = XML_PARSERS.get(command, parse_xml_flat)(result)
+        else:
+            records = parse_capture(command, path)
+        return {"records": [(_text(key), _text(value)) for key, value in records.items()], "samples": {},
+                "error": None}
+    except Exception as e:
+        # Any parser failure is recorded as the file's error, so the file is not retried until it changes
+        return {"records": [], "samples": {}, "error": f"{type(e).__name__}: {e}"[:MAX_TEXT]}
+
+
+def store(engine, candidate, parsed, previous_id=None):
+    with engine.begin() as conn:
+        if previous_id is not None:
+            # A rewritten file replaces what was imported from it before
+            conn.execute(delete(CaptureRecord.__table__).where(CaptureRecord.capture_id == previous_id))
+            conn.execute(delete(CaptureFile.__table__).where(CaptureFile.id == previous_id))
+        capture_id = conn.execute(insert(CaptureFile.__table__).values(
+            records=len(parsed["records"]) + sum(len(rows) for rows in parsed["samples"].values()),
+            error=parsed["error"], imported_at=datetime.now(), **candidate)).inserted_primary_key[0]
+        bulk_load(conn, CaptureRecord.__table__, ({"capture_id": capture_id, "record_key": key, "value": value}
+                                                   for key, value in parsed["records"]), mode="ignore")
+        if parsed["samples"]:
+            from resource_monitor import RESOLUTIONS
+            for period, rows in parsed["samples"].items():
+                bulk_load(conn, RESOLUTIONS[period]["model"].__table__, rows, mode="ignore")
+
+
+def import_files(engine, roots=ROOTS, workers=None, hosts=None, since=None):
+    """Parse new and changed files on a process pool and store them; returns (files, records)."""
+    with engine.connect() as conn:
+        known = {path: (size, mtime_ns, capture_id) for capture_id, path, size, mtime_ns in conn.execute(
+            select(CaptureFile.id, CaptureFile.path, CaptureFile.size, CaptureFile.mtime_ns))}
+    candidates = list(scan(roots, known, hosts, since))
+    print(f"{len(candidates)} new or changed files to import ({len(known)} already imported)")
+
+    start = last_report = time.monotonic()
+    files = records = failed = 0
+    # Parsing is CPU-bound and runs in the pool; this process is the only database writer
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for offset in range(0, len(candidates), POOL_BATCH):
+            batch = candidates[offset:offset + POOL_BATCH]
+            for candidate, parsed in zip(batch, executor.map(parse_file, batch, chunksize=16)):
+                previous = known.get(candidate["path"])
+                store(engine, candidate, parsed, previous[2] if previous else None)
+                files += 1
+                records += len(parsed["records"]) + sum(len(rows) for rows in parsed["samples"].values())
+                failed += parsed["error"] is not None
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    rate = files / (last_report - start)
+                    print(f"  {files}/{len(candidates)} files, {records} records, {failed} unparsed "
+                          f"({rate:.0f} files/s, {(len(candidates) - files) / rate:.0f}s left)")
+    print(f"Imported {files} files, {records} records, {failed} unparsed in {time.monotonic() - start:.0f}s")
+    return files, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import existing capture and API log files into the database.")
+    parser.add_argument('--roots', nargs='+', default=list(ROOTS), help="Directories holding <host>/ subdirectories")
+    parser.add_argument('--hosts', nargs='*', help="Only these hosts")
+    parser.add_argument('--since', help="Only files captured on or after this date (YYYY-MM-DD)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Parser processes (default: CPU count)")
+    args = parser.parse_args()
+
+    since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
+    try:
+        import_files(create_db_engine(), args.roots, args.workers, args.hosts, since)
+    except KeyboardInterrupt:
+        # Every stored file is committed on its own, so a re-run picks up where this stopped
+        print("Interrupted", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+import os
+import gzip
+import re
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree as ET
+from colorama import Fore, Style
+
+# Loss tolerated before a count-style comparison is flagged as a failure
+SESSION_COUNT_TOLERANCE = 0.25
+ARP_LOSS_TOLERANCE = 0.05
+
+IP_RE = re.compile(r"^\d{1,3}(?:\.\d{1,3}){3}$|^[0-9a-fA-F:]*:[0-9a-fA-F:]+$")
+MAC_RE = re.compile(r"^[0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){5}$")
+FLAG_RE = re.compile(r"^[A-Z?~][a-z0-9]?$")
+SESSION_COUNT_RE = re.compile(r"Number of sessions that match filter:\s*(\d+)")
+
+# Keys in "key: value" outputs that change on every run and are never compared
+VOLATILE_KEYS = ("uptime", "time", "duration", "date", "last", "counter", "age")
+
+
+def open_capture(path):
+    # Streamed captures are gzip-compressed text
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", errors="replace")
+    return open(path, "r", errors="replace")
+
+
+def read_lines(path):
+    with open_capture(path) as capture:
+        for line in capture:
+            yield line.rstrip("\n")
+
+
+def parse_arp(lines):
+    # Records keyed by (ip, mac, interface); value is the entry status
+    records = {}
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) < 3 or not IP_RE.match(tokens[1]) or not MAC_RE.match(tokens[2]):
+            continue
+        status = tokens[4] if len(tokens) > 4 else ""
+        records[(tokens[1], tokens[2].lower(), tokens[0])] = status
+    return records
+
+
+def parse_routes(lines):
+    # Records keyed by (virtual router, prefix, nexthop); age is ignored
+    records = {}
+    vr = "default"
+    for line in lines:
+        if line.startswith("VIRTUAL ROUTER:"):
+            vr = line.split(":", 1)[1].split()[0]
+            continue
+        tokens = line.split()
+        if len(tokens) < 2 or "/" not in tokens[0] or not (tokens[0][0].isdigit() or ":" in tokens[0]):
+            continue
+        rest = tokens[2:]
+        metric = rest.pop(0) if rest and rest[0].isdigit() else ""
+        flags = []
+        while rest and FLAG_RE.match(rest[0]):
+            flags.append(rest.pop(0))
+        if rest and rest[0].isdigit():
+            rest.pop(0)
+        interface = rest.pop(0) if rest else ""
+        records[(vr, tokens[0], tokens[1])] = (metric, " ".join(flags), interface)
+    return records
+
+
+def parse_bgp_rib(lines):
+    # loc-rib / rib-out rows keyed by (virtual router, prefix, nexthop); value is the peer
+    records = {}
+    vr = "default"
+    for line in lines:
+        if line.startswith("VIRTUAL ROUTER:"):
+            vr = line.split(":", 1)[1].split()[0]
+            continue
+        tokens = line.split()
+        if len(tokens) < 2:
+            continue
+        prefix = tokens[0].lstrip("*>")
+        if "/" not in prefix or not (prefix[0].isdigit() or ":" in prefix):
+            continue
+        records[(vr, prefix, tokens[1])] = tokens[2] if len(tokens) > 2 else ""
+    return records
+
+
+BGP_PEER_FIELDS = ("virtual router", "peer group", "peer state", "peer router id",
+                   "remote as", "peer address", "local address")
+
+
+def parse_bgp_peers(lines):
+    # Records keyed by peer name; value is the tuple of stable peer attributes
+    peers = {}
+    current = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("Peer:"):
+            current = stripped.split(":", 1)[1].split()[0]
+            peers[current] = {}
+            continue
+        if current is None or ":" not in stripped:
+            continue
+        key, value = stripped.split(":", 1)
+        key = key.strip().lower()
+        if key in BGP_PEER_FIELDS:
+            peers[current][key] = value.strip()
+    return {peer: tuple(sorted(fields.items())) for peer, fields in peers.items()}
+
+
+def parse_interfaces(lines):
+    # Records keyed by (section, name) for the hardware and logical interface tables
+    records = {}
+    section = None
+    for line in lines:
+        lowered = line.lower()
+        if "hardware interfaces" in lowered:
+            section = "hardware"
+            continue
+        if "logical interfaces" in lowered:
+            section = "logical"
+            continue
+        tokens = line.split()
+        if section is None or len(tokens) < 2 or not tokens[1].isdigit():
+            continue
+        records[(section, tokens[0])] = tuple(tokens[1:])
+    return records
+
+
+def parse_session_count(lines):
+    for line in lines:
+        match = SESSION_COUNT_RE.search(line)
+        if match:
+            return {"count": int(match.group(1))}
+    return {}
+
+
+def parse_session_table(lines):
+    # "show session all" is only compared by volume; each session row starts with its ID
+    count = 0
+    for line in lines:
+        tokens = line.split(None, 1)
+        if tokens and tokens[0].isdigit():
+            count += 1
+    return {"count": count}
+
+
+def parse_key_values(lines):
+    # Generic "key: value" parser; section headers (lines ending in ':') prefix their keys
+    records = {}
+    section = ""
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or ":" not in stripped:
+            continue
+        key, value = stripped.split(":", 1)
+        key = key.strip().lower()
+        value = value.strip()
+        if not value:
+            section = key
+            continue
+        if any(volatile in key for volatile in VOLATILE_KEYS):
+            continue
+        records[f"{section}/{key}" if section else key] = value
+    return records
+
+
+def parse_lines(lines):
+    # Fallback for commands without a structured parser: the set of normalized lines
+    return {" ".join(line.split()): None for line in lines if line.strip()}
+
+
+# command -> (parser, comparison mode)
+COMMAND_PARSERS = {
+    "show arp all": (parse_arp, "arp"),
+    "show routing route": (parse_routes, "strict"),
+    "show routing protocol bgp loc-rib": (parse_bgp_rib, "strict"),
+    "show routing protocol bgp rib-out": (parse_bgp_rib, "strict"),
+    "show routing protocol bgp peer": (parse_bgp_peers, "strict"),
+    "show routing protocol bgp summary": (parse_lines, "strict"),
+    "show interface all": (parse_interfaces, "strict"),
+    "show lacp aggregate-ethernet all": (parse_lines, "strict"),
+    "show lldp neighbors all": (parse_lines, "strict"),
+    "show high-availability state": (parse_key_values, "strict"),
+    "show system info": (parse_key_values, "strict"),
+    "show session all filter count yes": (parse_session_count, "count"),
+    "show session all": (parse_session_table, "count"),
+}
+
+# Captured for reference only; their contents are expected to differ between runs
+INFO_COMMANDS = (
+    "show clock",
+    "show log system receive_time in last-24-hrs",
+    "show running resource-monitor hour last 24",
+    "show running resource-monitor day last 7",
+)
+
+
+def read_xml_result(path):
+    # XML API captures are stored whole; the diff only needs the <result> element
+    root = ET.parse(path).getroot()
+    result = root.find('result')
+    return result if result is not None else root
+
+
+def _text(element, tag, default=""):
+    return (element.findtext(tag) or default).strip()
+
+
+def parse_xml_arp(result):
+    records = {}
+    for entry in result.iter('entry'):
+        ip, mac = _text(entry, 'ip'), _text(entry, 'mac').lower()
+        if ip and mac:
+            records[(ip, mac, _text(entry, 'interface'))] = _text(entry, 'status')
+    return records
+
+
+def parse_xml_routes(result):
+    records = {}
+    for entry in result.iter('entry'):
+        destination = _text(entry, 'destination')
+        if destination:
+            key = (_text(entry, 'virtual-router', 'default'), destination, _text(entry, 'nexthop'))
+            records[key] = (_text(entry, 'metric'), " ".join(_text(entry, 'flags').split()),
+                            _text(entry, 'interface'))
+    return records
+
+
+def parse_xml_bgp_rib(result):
+    records = {}
+    for vr_entry in result.findall('entry'):
+        vr = _text(vr_entry, 'vr', 'default')
+        for member in vr_entry.iter():
+            prefix = _text(member, 'prefix')
+            if prefix:
+                records[(vr, prefix, _text(member, 'nexthop'))] = _text(member, 'received-from') or _text(member, 'peer')
+    return records
+
+
+# XML tag -> field name used by the text parser, so both formats yield the same records
+XML_BGP_PEER_FIELDS = {"peer-group": "peer group", "status": "peer state", "peer-router-id": "peer router id",
+                       "remote-as": "remote as", "peer-address": "peer address", "local-address": "local address"}
+
+
+def parse_xml_bgp_peers(result):
+    records = {}
+    for entry in result.findall('entry'):
+        fields = {"virtual router": entry.get('vr', 'default')}
+        for tag, name in XML_BGP_PEER_FIELDS.items():
+            if entry.find(tag) is not None:
+                fields[name] = _text(entry, tag)
+        records[entry.get('peer', _text(entry, 'peer'))] = tuple(sorted(fields.items()))
+    return records
+
+
+def parse_xml_interfaces(result):
+    records = {}
+    for section, tag, fields in (("hardware", 'hw', ('state', 'speed', 'duplex', 'mac')),
+                                 ("logical", 'ifnet', ('zone', 'fwd', 'ip', 'tag', 'vsys'))):
+        for entry in result.findall(f'{tag}/entry'):
+            records[(section, _text(entry, 'name'))] = tuple(_text(entry, field) for field in fields)
+    return records
+
+
+def parse_xml_session_count(result):
+    count = result.findtext('.//member-count')
+    return {"count": int(count)} if count and count.strip().isdigit() else {}
+
+
+def parse_xml_flat(result, path=""):
+    # Generic fallback: every leaf keyed by its path, with list entries keyed by name
+    records = {}
+    for index, child in enumerate(result):
+        name = child.get('name') or (str(index) if child.tag in ('entry', 'member') else "")
+        tag = f"{path}/{child.tag}" + (f"[{name}]" if name else "")
+        if len(child):
+            records.update(parse_xml_flat(child, tag))
+        elif not any(volatile in child.tag for volatile in VOLATILE_KEYS):
+            records[tag] = (child.text or "").strip()
+    return records
+
+
+XML_PARSERS = {
+    "show arp all": parse_xml_arp,
+    "show routing route": parse_xml_routes,
+    "show routing protocol bgp loc-rib": parse_xml_bgp_rib,
+    "show routing protocol bgp rib-out": parse_xml_bgp_rib,
+    "show routing protocol bgp peer": parse_xml_bgp_peers,
+    "show interface all": parse_xml_interfaces,
+    "show session all filter count yes": parse_xml_session_count,
+}
+
+
+def parse_capture(command, path):
+    if path.endswith(".xml"):
+        return XML_PARSERS.get(command, parse_xml_flat)(read_xml_result(path))
+    parser, _ = COMMAND_PARSERS.get(command, (parse_lines, "strict"))
+    return parser(read_lines(path))
+
+
+def diff_records(pre, post):
+    # Hash-based set operations on the record keys rather than a line diff
+    added = post.keys() - pre.keys()
+    removed = pre.keys() - post.keys()
+    changed = [key for key in pre.keys() & post.keys() if pre[key] != post[key]]
+    return added, removed, changed
+
+
+def compare_outputs(pre_file, post_file, command=None):
+    """Compare a pre and post capture of one command and return a result dict.
+
+    The result has 'command', 'status' ("pass", "fail" or "info"), counts of
+    added/removed/changed records and a sample of the differing keys.
+    """
+    if command is None:
+        command = os.path.basename(post_file).rsplit("-post-", 1)[0].replace("_", " ")
+    result = {"command": command, "status": "pass", "pre": 0, "post": 0,
+              "added": 0, "removed": 0, "changed": 0, "details": []}
+
+    if command in INFO_COMMANDS:
+        result["status"] = "info"
+        return result
+
+    _, mode = COMMAND_PARSERS.get(command, (parse_lines, "strict"))
+    pre = parse_capture(command, pre_file)
+    post = parse_capture(command, post_file)
+    result["pre"], result["post"] = len(pre), len(post)
+
+    if mode == "count":
+        pre_count, post_count = pre.get("count", 0), post.get("count", 0)
+        result["pre"], result["post"] = pre_count, post_count
+        if pre_count and post_count < pre_count * (1 - SESSION_COUNT_TOLERANCE):
+            result["status"] = "fail"
+            result["details"].append(f"session count dropped from {pre_count} to {post_count}")
+        return result
+
+    if pre_file.endswith(".xml") != post_file.endswith(".xml"):
+        if command not in XML_PARSERS:
+            result["status"] = "info"
+            result["details"].append("pre and post captures differ in format; not comparable")
+            return result
+        # Text and XML captures agree on record keys but not always on values
+        pre = dict.fromkeys(pre)
+        post = dict.fromkeys(post)
+        result["details"].append("pre and post captures differ in format; comparing keys only")
+
+    added, removed, changed = diff_records(pre, post)
+    result["added"], result["removed"], result["changed"] = len(added), len(removed), len(changed)
+    result["details"] += ([f"- {key}" for key in sorted(removed, key=str)[:10]] +
+                          [f"+ {key}" for key in sorted(added, key=str)[:10]] +
+                          [f"~ {key}: {pre[key]} -> {post[key]}" for key in sorted(changed, key=str)[:10]])
+
+    if mode == "arp":
+        # ARP entries age out on their own; only flag a real loss of neighbours
+        if pre and len(removed) > len(pre) * ARP_LOSS_TOLERANCE:
+            result["status"] = "fail"
+    elif removed or changed:
+        result["status"] = "fail"
+    return result
+
+
+def _compare_pair(pair):
+    command, pre_file, post_file = pair
+    try:
+        return compare_outputs(pre_file, post_file, command)
+    except Exception as e:
+        return {"command": command, "status": "fail", "pre": 0, "post": 0,
+                "added": 0, "removed": 0, "changed": 0, "details": [f"comparison error: {e}"]}
+
+
+def compare_captures(pairs, max_workers=None):
+    # pairs: iterable of (command, pre_file, post_file); commands are compared in parallel
+    pairs = list(pairs)
+    if not pairs:
+        return []
+    with ProcessPoolExecutor(max_workers=max_workers or min(len(pairs), os.cpu_count() or 1)) as executor:
+        return list(executor.map(_compare_pair, pairs))
+
+
+def print_comparison_summary(host, results, verbose=False):
+    colors = {"pass": Fore.GREEN, "fail": Fore.RED, "info": Fore.CYAN}
+    print(f"\nPre/post comparison for {Fore.CYAN}{host}{Style.RESET_ALL}:")
+    for result in results:
+        color = colors.get(result["status"], Fore.YELLOW)
+        print(f"  {color}{result['status'].upper():<5}{Style.RESET_ALL} {result['command']:<45} "
+              f"pre={result['pre']} post={result['post']} "
+              f"+{result['added']} -{result['removed']} ~{result['changed']}")
+        if verbose or result["status"] == "fail":
+            for detail in result["details"]:
+                print(f"        {detail}")
+    failed = sum(1 for result in results if result["status"] == "fail")
+    if failed:
+        print(f"{Fore.RED}{failed} of {len(results)} checks failed for {host}{Style.RESET_ALL}")
+    else:
+        print(f"{Fore.GREEN}All {len(results)} checks passed for {host}{Style.RESET_ALL}")
+    return failed == 0
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+import os
+import re
+import sys
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timedelta
+from capture_diff import COMMAND_PARSERS, INFO_COMMANDS
+
+CAPTURE_ROOT = "output"
+INDEX_PATH = os.path.join(CAPTURE_ROOT, "captures.db")
+
+# Matches the names store_output/capture_path generate:
+#   <command with _>-<context>-<%m-%d-%y-%H-%M-%S>[-ERROR].<ext>
+CAPTURE_NAME_RE = re.compile(
+    r"^(?P<command>.+)-(?P<context>pre|post)-(?P<timestamp>\d\d-\d\d-\d\d-\d\d-\d\d-\d\d)(?P<error>-ERROR)?\.(?P<ext>.+)$")
+
+# Sanitizing a command replaces spaces with '_', which is lossy for commands like
+# "receive_time"; known commands are mapped back exactly
+KNOWN_COMMANDS = {command.replace(" ", "_"): command for command in list(COMMAND_PARSERS) + list(INFO_COMMANDS)}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    host TEXT NOT NULL,
+    context TEXT NOT NULL,
+    command TEXT NOT NULL,
+    captured_at TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER,
+    duration REAL,
+    error INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_captures_lookup ON captures (host, context, command, captured_at);
+CREATE INDEX IF NOT EXISTS ix_captures_age ON captures (captured_at);
+"""
+
+_prepared = set()
+_prepared_lock = threading.Lock()
+
+
+def connect(index_path=INDEX_PATH):
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(index_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # The schema is applied once per process, not on every record_capture
+    with _prepared_lock:
+        if index_path not in _prepared:
+            # WAL lets the parallel capture threads record while lookups run
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            _prepared.add(index_path)
+    return conn
+
+
+def parse_capture_name(file_name):
+    """Split a capture file name into (command, context, datetime, error) or return None."""
+    match = CAPTURE_NAME_RE.match(file_name)
+    if not match:
+        return None
+    timestamp = datetime.strptime(match.group("timestamp"), "%m-%d-%y-%H-%M-%S")
+    sanitized = match.group("command")
+    command = KNOWN_COMMANDS.get(sanitized, sanitized.replace("_", " "))
+    return command, match.group("context"), timestamp, bool(match.group("error"))
+
+
+def record_capture(host, command, context, path, size=None, duration=None, error=False, captured_at=None,
+                   index_path=INDEX_PATH):
+    captured_at = captured_at or datetime.now()
+    if size is None and os.path.exists(path):
+        size = os.path.getsize(path)
+    with connect(index_path) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO captures (host, context, command, captured_at, path, size, duration, error) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (host, context, command, captured_at.isoformat(sep=" "), path, size, duration, int(error)))
+    conn.close()
+
+
+def latest_capture(host, command, context="pre", index_path=INDEX_PATH):
+    # Served by ix_captures_lookup: one index seek, newest row first
+    with connect(index_path) as conn:
+        row = conn.execute(
+            "SELECT * FROM captures WHERE host = ? AND context = ? AND command = ? AND error = 0 "
+            "ORDER BY captured_at DESC LIMIT 1", (host, context, command)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def latest_captures(host, commands, context="pre", index_path=INDEX_PATH, root=CAPTURE_ROOT):
+    """Return {command: newest successful capture record} for the given commands.
+
+    A host with no captures of this context in the index (e.g. pre captures
+    taken before the index existed) has its output/<host>/ directory indexed first.
+    """
+    records = {}
+    with connect(index_path) as conn:
+        if not conn.execute("SELECT 1 FROM captures WHERE host = ? AND context = ? LIMIT 1",
+                            (host, context)).fetchone():
+            _index_host(conn, host, os.path.join(root, host))
+        for command in commands:
+            row = conn.execute(
+                "SELECT * FROM captures WHERE host = ? AND context = ? AND command = ? AND error = 0 "
+                "ORDER BY captured_at DESC LIMIT 1", (host, context, command)).fetchone()
+            if row:
+                records[command] = dict(row)
+    conn.close()
+    return records
+
+
+def latest_for_command(command, hosts=None, index_path=INDEX_PATH):
+    """Return the newest successful capture of command for every host (pre or post)."""
+    with connect(index_path) as conn:
+        rows = conn.execute(
+            "SELECT c.* FROM captures c JOIN ("
+            "  SELECT host, MAX(captured_at) AS captured_at FROM captures"
+            "  WHERE command = ? AND error = 0 GROUP BY host) newest"
+            " ON c.host = newest.host AND c.captured_at = newest.captured_at"
+            " WHERE c.command = ? AND c.error = 0", (command, command)).fetchall()
+    conn.close()
+    records = {row["host"]: dict(row) for row in rows if not hosts or row["host"] in hosts}
+    return list(records.values())
+
+
+def prune(max_age_days, delete_files=True, index_path=INDEX_PATH):
+    cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(sep=" ")
+    with connect(index_path) as conn:
+        paths = [row["path"] for row in conn.execute("SELECT path FROM captures WHERE captured_at < ?", (cutoff,))]
+        conn.execute("DELETE FROM captures WHERE captured_at < ?", (cutoff,))
+    conn.close()
+    if delete_files:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return len(paths)
+
+
+def _index_host(conn, host, host_dir):
+    if not os.path.isdir(host_dir):
+        return 0
+    count = 0
+    for file_entry in os.scandir(host_dir):
+        parsed = parse_capture_name(file_entry.name)
+        if not parsed or not file_entry.is_file():
+            continue
+        command, context, captured_at, error = parsed
+        conn.execute(
+            "INSERT OR IGNORE INTO captures (host, context, command, captured_at, path, size, error) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (host, context, command, captured_at.isoformat(sep=" "), file_entry.path,
+             file_entry.stat().st_size, int(error)))
+        count += 1
+    return count
+
+
+def rebuild(root=CAPTURE_ROOT, index_path=INDEX_PATH):
+    # One-off scan to index captures written before the manifest existed
+    count = 0
+    with connect(index_path) as conn:
+        for host_entry in os.scandir(root):
+            if host_entry.is_dir():
+                count += _index_host(conn, host_entry.name, host_entry.path)
+    conn.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the pre/post capture index.")
+    parser.add_argument('--rebuild', action='store_true', help="Index existing files under output/")
+    parser.add_argument('--prune', type=int, metavar='DAYS', help="Drop captures older than DAYS")
+    parser.add_argument('--keep-files', action='store_true', help="With --prune, keep the files on disk")
+    parser.add_argument('--latest', nargs=2, metavar=('HOST', 'COMMAND'), help="Show the latest pre capture")
+    args = parser.parse_args()
+
+    if not (args.rebuild or args.prune or args.latest):
+        parser.print_help()
+        sys.exit(1)
+    if args.rebuild:
+        print(f"Indexed {rebuild()} capture files")
+    if args.prune:
+        print(f"Pruned {prune(args.prune, delete_files=not args.keep_files)} captures")
+    if args.latest:
+        print(latest_capture(*args.latest))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+REPORT_DIR = os.path.join("output", "reports")
+
+# Phases a command's time is split into; not every capture path has every phase
+PHASES = ("connect", "setup", "send", "wait", "write")
+
+
+class CaptureRun:
+    """Per-command, per-phase timings and sizes for one capture run.
+
+    Shared by the capture threads; every entry is keyed by (host, command),
+    with host-level phases such as connect recorded under command "*".
+    """
+
+    def __init__(self, tool, context):
+        self.lock = threading.Lock()
+        self.started = datetime.now()
+        self.report = {"tool": tool, "context": context, "started": self.started.isoformat(sep=" "),
+                       "commands": []}
+        self.entries = {}
+
+    def _entry(self, host, command):
+        key = (host, command)
+        if key not in self.entries:
+            self.entries[key] = {"host": host, "command": command, "phases": {}, "bytes": None,
+                                 "transport": None, "status": "ok"}
+            self.report["commands"].append(self.entries[key])
+        return self.entries[key]
+
+    def add_time(self, host, command, phase, seconds):
+        with self.lock:
+            phases = self._entry(host, command)["phases"]
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, host, command, phase):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_time(host, command, phase, time.monotonic() - start)
+
+    def record(self, host, command, **fields):
+        with self.lock:
+            self._entry(host, command).update(fields)
+
+    def save(self, report_dir=REPORT_DIR):
+        os.makedirs(report_dir, exist_ok=True)
+        path = os.path.join(report_dir, f"{self.report['tool']}-{self.report['context']}-"
+                                        f"{self.started.strftime('%m-%d-%y-%H-%M-%S')}.json")
+        with self.lock:
+            self.report["finished"] = datetime.now().isoformat(sep=" ")
+            for entry in self.report["commands"]:
+                entry["total"] = round(sum(entry["phases"].values()), 4)
+            with open(path, "w") as report_file:
+                json.dump(self.report, report_file, indent=2)
+        return path
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile; enough for tuning timeouts from a few hundred samples
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(reports, top=10):
+    entries = [entry for report in reports for entry in report["commands"] if entry["command"] != "*"]
+    host_entries = [entry for report in reports for entry in report["commands"] if entry["command"] == "*"]
+    if not entries:
+        print("No command timings in the given reports.")
+        return
+
+    print(f"Slowest {top} commands:")
+    for entry in sorted(entries, key=lambda e: e.get("total", 0.0), reverse=True)[:top]:
+        phases = " ".join(f"{name}={seconds:.2f}" for name, seconds in entry["phases"].items())
+        print(f"  {entry.get('total', 0.0):8.2f}s  {entry['host']:<20} {entry['command']:<45} "
+              f"{entry.get('bytes') or 0:>12} bytes  {phases}")
+
+    by_command = {}
+    for entry in entries:
+        by_command.setdefault(entry["command"], []).append(entry)
+    print(f"\n{'command':<45} {'hosts':>5} {'p50':>8} {'p95':>8} {'max':>8} {'p95 bytes':>12}")
+    for command, group in sorted(by_command.items(), key=lambda item: -percentile([e.get("total", 0.0) for e in item[1]], 95)):
+        totals = [entry.get("total", 0.0) for entry in group]
+        sizes = [entry.get("bytes") or 0 for entry in group]
+        print(f"{command:<45} {len(group):>5} {percentile(totals, 50):8.2f} {percentile(totals, 95):8.2f} "
+              f"{max(totals):8.2f} {percentile(sizes, 95):>12}")
+
+    print(f"\n{'phase':<10} {'p50':>8} {'p95':>8}")
+    for phase in PHASES:
+        samples = [entry["phases"][phase] for entry in entries + host_entries if phase in entry["phases"]]
+        if samples:
+            print(f"{phase:<10} {percentile(samples, 50):8.2f} {percentile(samples, 95):8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize capture run reports.")
+    parser.add_argument('reports', nargs='*', help="Report files (default: the newest in output/reports)")
+    parser.add_argument('-n', '--top', type=int, default=10, help="Number of slowest commands to list")
+    args = parser.parse_args()
+
+    paths = args.reports
+    if not paths:
+        if not os.path.isdir(REPORT_DIR):
+            print(f"No reports found in {REPORT_DIR}")
+            sys.exit(1)
+        candidates = [os.path.join(REPORT_DIR, name) for name in os.listdir(REPORT_DIR) if name.endswith(".json")]
+        if not candidates:
+            print(f"No reports found in {REPORT_DIR}")
+            sys.exit(1)
+        paths = [max(candidates, key=os.path.getmtime)]
+
+    reports = []
+    for path in paths:
+        with open(path, "r") as report_file:
+            reports.append(json.load(report_file))
+    summarize(reports, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,48 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, insert, delete, text, LargeBinary, BINARY, VARBINARY
+from sqlalchemy.dialects import mysql
+from sqlalchemy.types import TypeDecorator
+from datetime import date, datetime
+from itertools import chain, islice
 import os
+import re
+import time
+import random
+import bisect
+import logging
+import tempfile
+import threading
+
+# Pool sizing for the pollers' thread pools plus the dashboard; pre-ping and
+# recycle keep MySQL's wait_timeout from handing out dead connections
+POOL_SETTINGS = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 30,
+    'pool_recycle': 1800,
+    'pool_pre_ping': True,
+    'query_cache_size': 1200,
+}
+
+SLOW_QUERY_SECONDS = 0.5
+# Fraction of slow statements written to the slow-query log
+SLOW_QUERY_SAMPLE = 0.2
+SLOW_QUERY_LOG = '/tmp/slow_queries.log'
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Loads of at least this many rows go through LOAD DATA LOCAL INFILE; smaller
+# ones are multi-row INSERTs of BULK_INSERT_BATCH rows
+BULK_LOAD_THRESHOLD = 5000
+BULK_INSERT_BATCH = 1000
+BULK_LOAD_MODES = ('append', 'ignore', 'merge', 'swap')
+# The only directory LOAD DATA LOCAL may read from; a server cannot request any other client file
+BULK_LOAD_DIR = os.path.join(tempfile.gettempdir(), f"bulk_load_{os.getuid()}")
+
+_engine = None
+_engine_lock = threading.Lock()
+# Server local_infile setting per engine URL
+_local_infile = {}
 
 def get_db_credentials():
     # Use the absolute path for the credentials directory
@@ -13,8 +56,254 @@ def get_db_credentials():
     else:
         raise FileNotFoundError("DB credentials file 'dbcreds' not found.")
 
+class StatementStats:
+    """Per-statement latency histograms, keyed by the statement text with literals collapsed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = {}
+
+    @staticmethod
+    def fingerprint(statement):
+        statement = re.sub(r"\s+", " ", statement).strip()
+        # Multi-row VALUES lists differ only in length
+        statement = re.sub(r"(\(%s(?:, %s)*\))(?:, \(%s(?:, %s)*\))+", r"\1, ...", statement)
+        return statement[:200]
+
+    def record(self, statement, seconds):
+        key = self.fingerprint(statement)
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)
+        with self.lock:
+            entry = self.statements.get(key)
+            if entry is None:
+                entry = self.statements[key] = {'count': 0, 'total': 0.0, 'max': 0.0,
+                                                'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['histogram'][bucket] += 1
+
+    def top(self, limit=10, reset=False):
+        # With reset, the statistics restart from zero in the same step, so no statement is lost
+        with self.lock:
+            items = [(key, dict(entry, histogram=list(entry['histogram']))) for key, entry in self.statements.items()]
+            if reset:
+                self.statements = {}
+        return sorted(items, key=lambda item: item[1]['total'], reverse=True)[:limit]
+
+    def percentile_ms(self, histogram, pct):
+        # Upper bound of the bucket holding the percentile
+        target = sum(histogram) * pct / 100.0
+        running = 0
+        for index, count in enumerate(histogram):
+            running += count
+            if running >= target and count:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else float('inf')
+        return 0
+
+statement_stats = StatementStats()
+
+def _slow_query_logger():
+    logger = logging.getLogger('slow_query')
+    if not logger.handlers:
+        handler = logging.FileHandler(SLOW_QUERY_LOG)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        statement_stats.record(statement, elapsed)
+        if elapsed >= SLOW_QUERY_SECONDS and random.random() < SLOW_QUERY_SAMPLE:
+            rows = len(parameters) if executemany else 1
+            _slow_query_logger().info(f"{elapsed:.3f}s rows={rows} {StatementStats.fingerprint(statement)} "
+                                      f"params={str(parameters)[:300]}")
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # Keep the start-time stack balanced when a statement fails
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
+
+def detect_arp_encoding(engine):
+    # schema.ArpIP/ArpMAC store packed keys once migrate_arp_keys.py has converted
+    # arp_entries. The live column type is read on the engine's first successful
+    # connection (MySQL may be down when the engine is created) and kept on its
+    # dialect; a missing table is created as text, so that counts as text.
+    def read_encoding(dbapi_connection, connection_record):
+        if hasattr(engine.dialect, 'compact_arp_keys'):
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT DATA_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+                           "AND TABLE_NAME = 'arp_entries' AND COLUMN_NAME = 'ip_address'")
+            row = cursor.fetchone()
+            data_type = row[0].decode() if row and isinstance(row[0], (bytes, bytearray)) else row and row[0]
+            engine.dialect.compact_arp_keys = (data_type or '').lower() == 'varbinary'
+        except Exception as e:
+            logging.warning(f"Could not read the ARP key encoding, retrying on the next connection: {e}")
+        finally:
+            cursor.close()
+            # End the read's implicit transaction before the pool hands the connection out
+            dbapi_connection.rollback()
+
+    event.listen(engine, "connect", read_encoding)
+
 def create_db_engine():
-    db_host, db_user, db_password, db_name = get_db_credentials()
-    connection_string = f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}"
-    engine = create_engine(connection_string, echo=True)
-    return engine
\ No newline at end of file
+    """Return the process-wide engine, creating it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            db_host, db_user, db_password, db_name = get_db_credentials()
+            connection_string = f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}"
+            os.makedirs(BULK_LOAD_DIR, mode=0o700, exist_ok=True)
+            # allow_local_infile_in_path (mysql-connector >= 8.0.22) scopes LOCAL INFILE to bulk_load's files
+            _engine = create_engine(connection_string, echo=False,
+                                    connect_args={'allow_local_infile_in_path': BULK_LOAD_DIR},
+                                    **POOL_SETTINGS)
+            instrument_engine(_engine)
+            detect_arp_encoding(_engine)
+        return _engine
+
+def log_statement_stats(limit=10, logger=logging, reset=False):
+    for statement, entry in statement_stats.top(limit, reset):
+        logger.info(f"{entry['count']:>7} x  total {entry['total']:8.2f}s  "
+                    f"p50 <={statement_stats.percentile_ms(entry['histogram'], 50)}ms  "
+                    f"p95 <={statement_stats.percentile_ms(entry['histogram'], 95)}ms  "
+                    f"max {entry['max'] * 1000:.0f}ms  {statement}")
+
+def _tsv_field(value, binary=False):
+    # MySQL's default LOAD DATA format: tab-separated, backslash-escaped, \N for NULL
+    if value is None:
+        return '\\N'
+    if binary:
+        return value.hex()
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+            .replace('\r', '\\r').replace('\0', '\\0'))
+
+def _is_binary(column_type, dialect):
+    # A TypeDecorator's dialect impl, which can depend on the database (see schema.ArpIP)
+    column_type = column_type.dialect_impl(dialect)
+    return isinstance(getattr(column_type, 'impl', column_type), (LargeBinary, BINARY, VARBINARY))
+
+def _write_tsv(tsv, table, columns, rows, dialect):
+    # Values go through the columns' TypeDecorators first, as an INSERT would send them
+    decorators = [table.c[column].type if isinstance(table.c[column].type, TypeDecorator) else None
+                  for column in columns]
+    binary = [_is_binary(table.c[column].type, dialect) for column in columns]
+    count = 0
+    for row in rows:
+        values = [row.get(column) for column in columns]
+        fields = []
+        for value, decorator, is_binary in zip(values, decorators, binary):
+            if decorator is not None:
+                value = decorator.process_bind_param(value, dialect)
+            fields.append(_tsv_field(value, is_binary))
+        tsv.write('\t'.join(fields) + '\n')
+        count += 1
+    return count
+
+def local_infile_enabled(conn):
+    key = str(conn.engine.url)
+    if key not in _local_infile:
+        _local_infile[key] = conn.dialect.name == 'mysql' and bool(
+            conn.execute(text("SELECT @@GLOBAL.local_infile")).scalar())
+        if not _local_infile[key]:
+            logging.warning("LOAD DATA LOCAL INFILE is unavailable (local_infile is off); bulk loads use INSERTs")
+    return _local_infile[key]
+
+def _insert_rows(conn, table, rows, mode, update_columns):
+    if mode == 'swap':
+        conn.execute(delete(table))
+    if mode == 'merge':
+        statement = mysql.insert(table)
+        statement = statement.on_duplicate_key_update({column: statement.inserted[column] for column in update_columns})
+    else:
+        statement = insert(table).prefix_with('IGNORE') if mode == 'ignore' else insert(table)
+    count = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, BULK_INSERT_BATCH))
+        if not batch:
+            return count
+        conn.execute(statement, batch)
+        count += len(batch)
+
+def bulk_load(conn, table, rows, mode='append', update_columns=None, threshold=None):
+    """Load rows (dicts keyed by column name) into a table through the server's bulk loader.
+
+    Rows are streamed to a temporary TSV file and loaded with LOAD DATA LOCAL
+    INFILE into a staging table, which is then applied in one statement:
+      append  INSERT ... SELECT from the staging table
+      ignore  INSERT IGNORE ... SELECT, skipping rows whose key already exists
+      merge   INSERT ... SELECT ... ON DUPLICATE KEY UPDATE update_columns
+      swap    the staging table is a copy of the table and replaces it by RENAME;
+              DDL commits the transaction, and only for tables nothing references
+    Below threshold rows (or without local_infile) the same modes run as
+    multi-row INSERTs in the caller's transaction. Returns the row count.
+    """
+    if mode not in BULK_LOAD_MODES:
+        raise ValueError(f"Unknown bulk load mode '{mode}'")
+    if mode == 'merge' and not update_columns:
+        raise ValueError("merge needs update_columns")
+    threshold = BULK_LOAD_THRESHOLD if threshold is None else threshold
+    rows = iter(rows)
+    head = list(islice(rows, threshold))
+    if len(head) < threshold or not local_infile_enabled(conn):
+        return _insert_rows(conn, table, chain(head, rows), mode, update_columns)
+
+    columns = list(head[0])
+    stage = f"{table.name}_stage"
+    start = time.monotonic()
+    os.makedirs(BULK_LOAD_DIR, mode=0o700, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', prefix=f"{table.name}_", suffix='.tsv', encoding='utf-8',
+                                     newline='\n', dir=BULK_LOAD_DIR) as tsv:
+        count = _write_tsv(tsv, table, columns, chain(head, rows), conn.dialect)
+        tsv.flush()
+
+        if mode == 'swap':
+            conn.execute(text(f"DROP TABLE IF EXISTS {stage}"))
+            conn.execute(text(f"CREATE TABLE {stage} LIKE {table.name}"))
+        else:
+            # Only the loaded columns, so defaults and AUTO_INCREMENT apply on the target
+            conn.execute(text(f"DROP TEMPORARY TABLE IF EXISTS {stage}"))
+            conn.execute(text(f"CREATE TEMPORARY TABLE {stage} SELECT {', '.join(columns)} FROM {table.name} LIMIT 0"))
+
+        # Binary columns travel as hex and are decoded on the way in
+        binary = {column for column in columns if _is_binary(table.c[column].type, conn.dialect)}
+        targets = [f"@{column}" if column in binary else column for column in columns]
+        unhex = [f"{column} = UNHEX(@{column})" for column in columns if column in binary]
+        path = tsv.name.replace('\\', '\\\\').replace("'", "\\'")
+        conn.exec_driver_sql(
+            f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {stage} CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({', '.join(targets)})" + (f" SET {', '.join(unhex)}" if unhex else ""))
+
+    column_list = ', '.join(columns)
+    if mode == 'swap':
+        conn.execute(text(f"RENAME TABLE {table.name} TO {table.name}_old, {stage} TO {table.name}"))
+        conn.execute(text(f"DROP TABLE {table.name}_old"))
+    else:
+        statement = f"INSERT {'IGNORE ' if mode == 'ignore' else ''}INTO {table.name} ({column_list}) " \
+                    f"SELECT {column_list} FROM {stage}"
+        if mode == 'merge':
+            statement += " ON DUPLICATE KEY UPDATE " + ', '.join(
+                f"{column} = VALUES({column})" for column in update_columns)
+        conn.execute(text(statement))
+        conn.execute(text(f"DROP TEMPORARY TABLE {stage}"))
+    logging.info(f"Bulk loaded {count} rows into {table.name} ({mode}) in {time.monotonic() - start:.2f}s")
+    return count
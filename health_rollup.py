@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+import time
+import logging
+import argparse
+from datetime import datetime, date, timedelta
+from sqlalchemy import text
+from db_connect import create_db_engine
+from schema import HEALTH_METRICS
+
+RAW = {"table": "firewall_health", "column": "timestamp", "retention_days": 3, "partition": "day"}
+
+# Rollup tiers, finest first. Every tier is computed from the raw table so its
+# p95 is exact; lookback re-aggregates recent buckets to pick up late rows, and
+# backfill_days is the span of one rollup() call when history is backfilled.
+TIERS = {
+    "1m": {"table": "health_rollup_1m", "seconds": 60, "retention_days": 7, "partition": "day",
+           "bucket": "FROM_UNIXTIME(UNIX_TIMESTAMP(timestamp) DIV 60 * 60)", "lookback": timedelta(minutes=15),
+           "backfill_days": 1},
+    "1h": {"table": "health_rollup_1h", "seconds": 3600, "retention_days": 180, "partition": "month",
+           "bucket": "FROM_UNIXTIME(UNIX_TIMESTAMP(timestamp) DIV 3600 * 3600)", "lookback": timedelta(hours=2),
+           "backfill_days": 7},
+    "1d": {"table": "health_rollup_1d", "seconds": 86400, "retention_days": 1825, "partition": "month",
+           "bucket": "TIMESTAMP(DATE(timestamp))", "lookback": timedelta(days=2), "backfill_days": 31},
+}
+# Raw partitions are only dropped once these tiers hold all of their rows
+COVERING_TIERS = ("1h", "1d")
+
+PARTITIONS_AHEAD = 3
+# A query is served from the coarsest tier that still gives at least this many points
+MIN_POINTS = 100
+
+
+def to_days(day):
+    # MySQL TO_DAYS() of a date
+    return day.toordinal() + 365
+
+
+def from_days(days):
+    return date.fromordinal(days - 365)
+
+
+def next_boundary(day, unit):
+    if unit == "day":
+        return day + timedelta(days=1)
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def floor_time(moment, seconds):
+    if seconds == 86400:
+        return datetime.combine(moment.date(), datetime.min.time())
+    return datetime.fromtimestamp(int(moment.timestamp()) // seconds * seconds)
+
+
+def partition_bounds(conn, table):
+    """Return {partition name: TO_DAYS upper bound or None for MAXVALUE}."""
+    rows = conn.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL"),
+        {"table": table})
+    return {name: None if bound == "MAXVALUE" else int(bound) for name, bound in rows}
+
+
+def partition_clauses(day, target, unit):
+    # PARTITION clauses from day's partition up to the one holding target
+    if unit == "month":
+        day = day.replace(day=1)
+    partitions = []
+    while day <= target:
+        boundary = next_boundary(day, unit)
+        partitions.append(f"PARTITION p{day:%Y%m%d} VALUES LESS THAN ({to_days(boundary)})")
+        day = boundary
+    return partitions
+
+
+def ensure_partitions(conn, table, unit, ahead=PARTITIONS_AHEAD, today=None):
+    """Split the catch-all pmax partition so there are partitions up to `ahead` units past today."""
+    bounds = partition_bounds(conn, table)
+    if "pmax" not in bounds:
+        logging.warning(f"{table} is not partitioned; run health_rollup.py --migrate")
+        return 0
+    today = today or date.today()
+    upper = max((bound for bound in bounds.values() if bound), default=None)
+    target = today
+    for _ in range(ahead):
+        target = next_boundary(target, unit)
+    partitions = partition_clauses(from_days(upper) if upper else today, target, unit)
+    if partitions:
+        # pmax stays empty in steady state, so reorganizing it is cheap
+        conn.execute(text(f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO "
+                          f"({', '.join(partitions)}, PARTITION pmax VALUES LESS THAN MAXVALUE)"))
+    return len(partitions)
+
+
+def drop_expired(conn, table, retention_days, today=None, covered=None):
+    """Drop partitions wholly older than retention_days; returns their names.
+
+    covered(conn, start, end) can veto a partition: start is the previous
+    partition's bound (None for the first), end its own bound, as datetimes.
+    """
+    # Retention is a metadata-only DROP PARTITION instead of a DELETE scan
+    cutoff = to_days((today or date.today()) - timedelta(days=retention_days))
+    expired = []
+    lower = None
+    for name, bound in sorted(partition_bounds(conn, table).items(), key=lambda item: item[1] or float("inf")):
+        if not bound or bound > cutoff:
+            break
+        end = datetime.combine(from_days(bound), datetime.min.time())
+        if covered and not covered(conn, lower, end):
+            logging.warning(f"{table}: keeping expired partition {name}, its rows are not all rolled up; "
+                            f"run health_rollup.py --backfill")
+        else:
+            expired.append(name)
+        lower = end
+    if expired:
+        conn.execute(text(f"ALTER TABLE {table} DROP PARTITION {', '.join(expired)}"))
+    return expired
+
+
+def rolled_up(conn, start, end, now=None):
+    """True when every raw metric value in [start, end) is counted in each of the COVERING_TIERS.
+
+    A tier whose retention has already passed end is not expected to hold the range.
+    """
+    now = now or datetime.now()
+    where = "timestamp < :end" + (" AND timestamp >= :start" if start else "")
+    bucket_where = "bucket < :end" + (" AND bucket >= :start" if start else "")
+    values = conn.execute(text(
+        f"SELECT {' + '.join(f'COUNT({metric})' for metric in HEALTH_METRICS)} FROM {RAW['table']} WHERE {where}"),
+        {"start": start, "end": end}).scalar() or 0
+    for tier in COVERING_TIERS:
+        if end <= now - timedelta(days=TIERS[tier]["retention_days"]):
+            continue
+        samples = conn.execute(text(f"SELECT COALESCE(SUM(samples), 0) FROM {TIERS[tier]['table']} "
+                                    f"WHERE {bucket_where}"), {"start": start, "end": end}).scalar()
+        if samples < values:
+            return False
+    return True
+
+
+def maintain_partitions(engine):
+    with engine.begin() as conn:
+        for spec in [RAW] + list(TIERS.values()):
+            added = ensure_partitions(conn, spec["table"], spec["partition"])
+            # Raw rows only go once the long-lived tiers have them
+            dropped = drop_expired(conn, spec["table"], spec["retention_days"],
+                                   covered=rolled_up if spec is RAW else None)
+            if added or dropped:
+                logging.info(f"{spec['table']}: added {added} partitions, dropped {len(dropped)}")
+
+
+def rollup(engine, tier, start, end):
+    """Aggregate raw rows in [start, end) into the tier's buckets; safe to re-run."""
+    spec = TIERS[tier]
+    bucket = spec["bucket"]
+    with engine.begin() as conn:
+        for metric in HEALTH_METRICS:
+            # p95 is nearest-rank: the smallest value whose cumulative share is >= 95%
+            conn.execute(text(
+                f"INSERT INTO {spec['table']} "
+                f"(hostname, metric, bucket, samples, min_value, avg_value, max_value, p95_value) "
+                f"SELECT hostname, :metric, bucket, COUNT(*), MIN(v), AVG(v), MAX(v), "
+                f"MIN(CASE WHEN cd >= 0.95 THEN v END) FROM ("
+                f"  SELECT hostname, {bucket} AS bucket, {metric} AS v, "
+                f"  CUME_DIST() OVER (PARTITION BY hostname, {bucket} ORDER BY {metric}) AS cd "
+                f"  FROM {RAW['table']} WHERE timestamp >= :start AND timestamp < :end AND {metric} IS NOT NULL"
+                f") ranked GROUP BY hostname, bucket "
+                f"ON DUPLICATE KEY UPDATE samples = VALUES(samples), min_value = VALUES(min_value), "
+                f"avg_value = VALUES(avg_value), max_value = VALUES(max_value), p95_value = VALUES(p95_value)"),
+                {"metric": metric, "start": start, "end": end})
+
+
+def run_rollups(engine, tiers=tuple(TIERS), now=None):
+    now = now or datetime.now()
+    for tier in tiers:
+        spec = TIERS[tier]
+        # Only complete buckets
+        end = floor_time(now, spec["seconds"])
+        start = floor_time(end - spec["lookback"], spec["seconds"])
+        started = time.monotonic()
+        rollup(engine, tier, start, end)
+        logging.info(f"Rolled up {tier} for {start} - {end} in {time.monotonic() - started:.2f}s")
+
+
+def choose_tier(start, end, min_points=MIN_POINTS, now=None):
+    """Pick the coarsest tier that still covers start and resolves the window into min_points buckets."""
+    now = now or datetime.now()
+    window = (end - start).total_seconds()
+    for tier in reversed(list(TIERS)):
+        spec = TIERS[tier]
+        if start >= now - timedelta(days=spec["retention_days"]) and window / spec["seconds"] >= min_points:
+            return tier
+    if start >= now - timedelta(days=RAW["retention_days"]):
+        return "raw"
+    # Older than raw retention and too short for any tier's resolution: take the finest that still has it
+    for tier in TIERS:
+        if start >= now - timedelta(days=TIERS[tier]["retention_days"]):
+            return tier
+    return "1d"
+
+
+def query_health(hostname, metric, start, end, min_points=MIN_POINTS, engine=None):
+    """Return (tier, rows) for one host's metric; rows are dicts with bucket/min/avg/max/p95."""
+    if metric not in HEALTH_METRICS:
+        raise ValueError(f"Unknown health metric '{metric}'")
+    engine = engine or create_db_engine()
+    tier = choose_tier(start, end, min_points)
+    if tier == "raw":
+        sql = (f"SELECT timestamp AS bucket, 1 AS samples, {metric} AS min_value, {metric} AS avg_value, "
+               f"{metric} AS max_value, {metric} AS p95_value FROM {RAW['table']} "
+               f"WHERE hostname = :hostname AND timestamp >= :start AND timestamp < :end ORDER BY timestamp")
+    else:
+        sql = (f"SELECT bucket, samples, min_value, avg_value, max_value, p95_value FROM {TIERS[tier]['table']} "
+               f"WHERE hostname = :hostname AND metric = :metric AND bucket >= :start AND bucket < :end "
+               f"ORDER BY bucket")
+    with engine.connect() as conn:
+        rows = conn.execute(text(sql), {"hostname": hostname, "metric": metric, "start": start, "end": end})
+        return tier, [dict(row._mapping) for row in rows]
+
+
+def backfill(engine, start, now=None):
+    """Roll up raw history from start into every tier, in chunks, within each tier's retention."""
+    now = now or datetime.now()
+    for tier, spec in TIERS.items():
+        chunk_start = max(floor_time(start, 86400), floor_time(now - timedelta(days=spec["retention_days"]), 86400))
+        end = floor_time(now, spec["seconds"])
+        while chunk_start < end:
+            chunk_end = min(chunk_start + timedelta(days=spec["backfill_days"]), end)
+            rollup(engine, tier, chunk_start, chunk_end)
+            logging.info(f"Backfilled {tier} for {chunk_start} - {chunk_end}")
+            chunk_start = chunk_end
+
+
+def migrate(engine, today=None):
+    """Convert an existing unpartitioned firewall_health to the partitioned layout and roll up its history.
+
+    Months before the raw retention get one partition each, later days one per
+    day, all in the single PARTITION BY rebuild, so years of history stay far
+    below MySQL's partition limit and the table is copied once. The history is
+    then backfilled into every tier before retention can drop any of it.
+    """
+    today = today or date.today()
+    with engine.begin() as conn:
+        for (constraint,) in conn.execute(text(
+                "SELECT CONSTRAINT_NAME FROM information_schema.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = DATABASE() "
+                "AND TABLE_NAME = :table AND REFERENCED_TABLE_NAME IS NOT NULL"), {"table": RAW["table"]}).fetchall():
+            conn.execute(text(f"ALTER TABLE {RAW['table']} DROP FOREIGN KEY {constraint}"))
+        oldest = conn.execute(text(f"SELECT MIN(timestamp) FROM {RAW['table']}")).scalar()
+        if "pmax" not in partition_bounds(conn, RAW["table"]):
+            conn.execute(text(f"ALTER TABLE {RAW['table']} DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp), "
+                              f"ADD INDEX ix_firewall_health_hostname_timestamp (hostname, timestamp)"))
+            days_from = (today - timedelta(days=RAW["retention_days"])).replace(day=1)
+            partitions = []
+            if oldest and oldest.date() < days_from:
+                partitions += partition_clauses(oldest.date(), days_from - timedelta(days=1), "month")
+            target = today
+            for _ in range(PARTITIONS_AHEAD):
+                target = next_boundary(target, RAW["partition"])
+            partitions += partition_clauses(days_from, target, RAW["partition"])
+            conn.execute(text(f"ALTER TABLE {RAW['table']} PARTITION BY RANGE (TO_DAYS(timestamp)) "
+                              f"({', '.join(partitions)}, PARTITION pmax VALUES LESS THAN MAXVALUE)"))
+    if oldest:
+        backfill(engine, oldest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain firewall health rollups and partitions.")
+    parser.add_argument('--loop', action='store_true', help="Run continuously: 1m every minute, 1h hourly, 1d daily")
+    parser.add_argument('--migrate', action='store_true',
+                        help="Partition an existing firewall_health table and roll up its history")
+    parser.add_argument('--backfill', type=float, metavar='DAYS', help="Roll up the last DAYS of raw rows again")
+    parser.add_argument('--query', nargs=3, metavar=('HOST', 'METRIC', 'DAYS'), help="Print a host's metric")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    engine = create_db_engine()
+    if args.migrate:
+        migrate(engine)
+    if args.backfill:
+        backfill(engine, datetime.now() - timedelta(days=args.backfill))
+    if args.query:
+        hostname, metric, days = args.query
+        end = datetime.now()
+        tier, rows = query_health(hostname, metric, end - timedelta(days=float(days)), end, engine=engine)
+        print(f"{hostname} {metric} from the {tier} tier, {len(rows)} points")
+        for row in rows:
+            print(f"{row['bucket']}  min {row['min_value']}  avg {row['avg_value']}  max {row['max_value']}  "
+                  f"p95 {row['p95_value']}")
+        return
+
+    maintain_partitions(engine)
+    run_rollups(engine)
+    last = datetime.now()
+    while args.loop:
+        time.sleep(60 - time.time() % 60)
+        now = datetime.now()
+        tiers = ["1m"]
+        if now.hour != last.hour:
+            tiers.append("1h")
+        if now.date() != last.date():
+            tiers.append("1d")
+            maintain_partitions(engine)
+        try:
+            run_rollups(engine, tiers, now)
+        except Exception as e:
+            logging.error(f"Rollup failed: {e}")
+        last = now
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+import sys
+import json
+import time
+import hashlib
+import argparse
+from datetime import datetime
+from sqlalchemy import inspect, select, text, update
+from sqlalchemy.dialects.mysql import insert
+from db_connect import create_db_engine
+from schema import Device
+
+PANORAMA_INSTANCES = ['A46PANORAMA', 'L17PANORAMA']
+BATCH_SIZE = 1000
+
+# Panorama inventory key -> devices column
+SYNC_FIELDS = {
+    'hostname': 'hostname',
+    'mgmt_ip': 'mgmt_ip',
+    'serial': 'serial_number',
+    'mac_address': 'mac_address',
+    'model': 'model',
+    'sw_version': 'sw_version',
+}
+
+# bu and lifecycle are NOT NULL but not known to Panorama; new devices get these
+# and they are never overwritten by a sync
+DEFAULT_BU = 'retail'
+DEFAULT_LIFECYCLE = 'prod'
+
+# Refuse to mark more than this share of active devices removed in one sync;
+# a short inventory usually means a failed Panorama query, not a decommission
+MAX_REMOVED_SHARE = 0.2
+
+# get_pan_devices reports missing fields as 'N/A'; nullable columns store NULL
+# instead, so consumers can use `device.mgmt_ip or device.hostname`
+MISSING = (None, '', 'N/A')
+
+
+def content_hash(row):
+    return hashlib.sha1("|".join(str(row[column]) for column in SYNC_FIELDS.values()).encode()).hexdigest()
+
+
+def to_rows(inventory):
+    rows = {}
+    for device in inventory:
+        row = {}
+        for key, column in SYNC_FIELDS.items():
+            value = device.get(key)
+            if value in MISSING:
+                value = None if Device.__table__.c[column].nullable else 'N/A'
+            row[column] = value
+        if row['hostname'] == 'N/A':
+            continue
+        row['content_hash'] = content_hash(row)
+        rows[row['hostname']] = row
+    return rows
+
+
+def ensure_columns(engine):
+    # Tables created before content_hash/removed_at existed get them added in place
+    columns = {column['name']: column for column in inspect(engine).get_columns(Device.__tablename__)}
+    with engine.begin() as conn:
+        if 'content_hash' not in columns:
+            conn.execute(text("ALTER TABLE devices ADD COLUMN content_hash VARCHAR(40)"))
+        if 'removed_at' not in columns:
+            conn.execute(text("ALTER TABLE devices ADD COLUMN removed_at DATETIME"))
+        if not columns['mgmt_ip']['nullable']:
+            conn.execute(text("ALTER TABLE devices MODIFY mgmt_ip VARCHAR(40) NULL"))
+        # Rows synced while missing values were stored as the text 'N/A'
+        conn.execute(text("UPDATE devices SET mgmt_ip = NULL WHERE mgmt_ip = 'N/A'"))
+
+
+def sync_devices(inventory, engine=None, force=False, now=None):
+    """Upsert the Panorama inventory into devices in one transaction.
+
+    Only rows whose content hash changed (or that come back after removal) are
+    written; devices missing from the inventory get removed_at set. Returns a
+    dict of counts.
+    """
+    engine = engine or create_db_engine()
+    now = now or datetime.now()
+    rows = to_rows(inventory)
+    devices = Device.__table__
+
+    with engine.begin() as conn:
+        existing = {hostname: (row_hash, removed_at) for hostname, row_hash, removed_at in conn.execute(
+            select(devices.c.hostname, devices.c.content_hash, devices.c.removed_at))}
+
+        changed = [row for hostname, row in rows.items()
+                   if hostname not in existing or existing[hostname][0] != row['content_hash']
+                   or existing[hostname][1] is not None]
+        removed = [hostname for hostname, (_, removed_at) in existing.items()
+                   if hostname not in rows and removed_at is None]
+        active = sum(1 for _, removed_at in existing.values() if removed_at is None)
+        if removed and not force and len(removed) > MAX_REMOVED_SHARE * max(active, 1):
+            raise RuntimeError(f"Inventory would remove {len(removed)} of {active} active devices; "
+                               f"rerun with --force if that is expected")
+
+        upsert = insert(devices)
+        upsert = upsert.on_duplicate_key_update(
+            removed_at=None, **{column: upsert.inserted[column] for column in list(SYNC_FIELDS.values())[1:] + ['content_hash']})
+        for start in range(0, len(changed), BATCH_SIZE):
+            conn.execute(upsert, [dict(row, bu=DEFAULT_BU, lifecycle=DEFAULT_LIFECYCLE, ha=False, removed_at=None)
+                                  for row in changed[start:start + BATCH_SIZE]])
+
+        for start in range(0, len(removed), BATCH_SIZE):
+            conn.execute(update(devices).where(devices.c.hostname.in_(removed[start:start + BATCH_SIZE]))
+                         .values(removed_at=now))
+
+    return {
+        'inventory': len(rows),
+        'inserted': sum(1 for row in changed if row['hostname'] not in existing),
+        'updated': sum(1 for row in changed if row['hostname'] in existing),
+        'unchanged': len(rows) - len(changed),
+        'removed': len(removed),
+    }
+
+
+def load_inventory(json_path=None):
+    if json_path:
+        with open(json_path, 'r') as json_file:
+            return json.load(json_file)
+    # Imported lazily: the Panorama helpers pull in the dashboard dependencies
+    from pan_functions import get_active_pan, get_pan_devices
+    active_pan = get_active_pan(PANORAMA_INSTANCES)
+    if not active_pan:
+        raise RuntimeError("No active Panorama instance found")
+    return get_pan_devices(active_pan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the Panorama connected-devices inventory into devices.")
+    parser.add_argument('-j', '--json', help="Read the inventory from a get_pan_devices JSON file instead of Panorama")
+    parser.add_argument('--force', action='store_true', help="Allow marking a large share of devices removed")
+    args = parser.parse_args()
+
+    engine = create_db_engine()
+    ensure_columns(engine)
+    start = time.monotonic()
+    try:
+        inventory = load_inventory(args.json)
+        counts = sync_devices(inventory, engine, force=args.force)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    print(f"Synced {counts['inventory']} devices in {time.monotonic() - start:.2f}s: {counts['inserted']} new, "
+          f"{counts['updated']} updated, {counts['unchanged']} unchanged, {counts['removed']} removed")
+
+
+if __name__ == "__main__":
+    main()
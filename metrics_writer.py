@@ -0,0 +1,208 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+import mysql.connector
+from mysql.connector import pooling
+from schema import FirewallHealth
+
+# Every firewall_health column except the autoincrement id, in table order
+HEALTH_COLUMNS = [column.name for column in FirewallHealth.__table__.columns if column.name != "id"]
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 5.0
+MAX_PENDING = 20000
+RETRY_DELAY = 2.0
+STATS_INTERVAL = 60.0
+# How long close() (and so interpreter exit) waits for the buffered rows
+CLOSE_TIMEOUT = 30.0
+# How often an idle writer checks whether it is being closed
+STOP_POLL = 0.5
+
+_STOP = object()
+
+
+class MetricsWriter:
+    """Buffers firewall_health rows from any number of collector threads and
+    writes them with multi-row executemany from one background thread.
+
+    A batch is flushed when it reaches batch_size rows or flush_interval
+    seconds after its first row. The buffer is bounded: when the database falls
+    behind, write() blocks (or raises queue.Full after its timeout) instead of
+    letting memory grow.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING, pool_size=2,
+                 table="firewall_health", columns=HEALTH_COLUMNS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.columns = list(columns)
+        self.insert_query = (f"INSERT INTO {table} ({', '.join(self.columns)}) "
+                             f"VALUES ({', '.join(['%s'] * len(self.columns))})")
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.counters = {"rows": 0, "flushes": 0, "failed_flushes": 0, "flush_seconds": 0.0,
+                         "last_flush_seconds": 0.0, "max_flush_seconds": 0.0, "blocked_seconds": 0.0, "dropped_rows": 0}
+        self.started = time.monotonic()
+        self.last_stats = self.started
+
+        # Same credentials file as the rest of pan_functions; imported lazily since
+        # pan_functions pulls in the dashboard dependencies and imports this module
+        from pan_functions import get_db_credentials
+        db_host, db_user, db_password, db_name = get_db_credentials()
+        self.pool = pooling.MySQLConnectionPool(pool_name=f"metrics_{id(self)}", pool_size=pool_size,
+                                                host=db_host, user=db_user, password=db_password, database=db_name)
+        self.closing = False
+        self.thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        self.thread.start()
+        # The thread is a daemon so it never blocks exit; this flushes what is buffered first
+        atexit.register(self.close)
+
+    def write(self, row, timeout=None):
+        """Queue one row (a dict keyed by column name); blocks while the buffer is full."""
+        if self.closing:
+            raise RuntimeError("MetricsWriter is closed")
+        if row.get("timestamp") is None:
+            row = dict(row, timestamp=datetime.now())
+        values = tuple(row.get(column) for column in self.columns)
+        try:
+            self.pending.put_nowait(values)
+        except queue.Full:
+            # Backpressure: the collector waits for the writer to catch up
+            start = time.monotonic()
+            self.pending.put(values, timeout=timeout)
+            with self.lock:
+                self.counters["blocked_seconds"] += time.monotonic() - start
+
+    def _next_batch(self):
+        # close() cannot always queue _STOP (the queue may be full), so an idle
+        # writer also stops once it sees closing
+        while True:
+            try:
+                first = self.pending.get(timeout=STOP_POLL)
+                break
+            except queue.Empty:
+                if self.closing:
+                    return [], True
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _flush(self, batch):
+        # Retries until the rows are written or the writer is closed; the
+        # bounded queue keeps collectors from outrunning a stalled database
+        while True:
+            start = time.monotonic()
+            try:
+                connection = self.pool.get_connection()
+                try:
+                    cursor = connection.cursor()
+                    cursor.executemany(self.insert_query, batch)
+                    connection.commit()
+                    cursor.close()
+                finally:
+                    connection.close()
+            except mysql.connector.Error as e:
+                with self.lock:
+                    self.counters["failed_flushes"] += 1
+                    if self.closing:
+                        self.counters["dropped_rows"] += len(batch)
+                if self.closing:
+                    logging.error(f"Dropping {len(batch)} health rows, database unavailable at shutdown: {e}")
+                    return
+                logging.warning(f"Health metrics flush of {len(batch)} rows failed, retrying: {e}")
+                time.sleep(RETRY_DELAY)
+                continue
+            elapsed = time.monotonic() - start
+            with self.lock:
+                self.counters["rows"] += len(batch)
+                self.counters["flushes"] += 1
+                self.counters["flush_seconds"] += elapsed
+                self.counters["last_flush_seconds"] = elapsed
+                self.counters["max_flush_seconds"] = max(self.counters["max_flush_seconds"], elapsed)
+            logging.debug(f"Flushed {len(batch)} health rows in {elapsed:.3f}s")
+            return
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._flush(batch)
+            if time.monotonic() - self.last_stats >= STATS_INTERVAL:
+                self.last_stats = time.monotonic()
+                logging.info(f"Metrics writer: {self.stats()}")
+        # Drain anything queued after the stop marker
+        leftover = []
+        while True:
+            try:
+                item = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.batch_size):
+            self._flush(leftover[start:start + self.batch_size])
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        flushes = stats["flushes"]
+        stats["pending"] = self.pending.qsize()
+        stats["avg_flush_seconds"] = stats["flush_seconds"] / flushes if flushes else 0.0
+        # Insert rate while flushing, and overall rate since the writer started
+        stats["rows_per_second"] = stats["rows"] / stats["flush_seconds"] if stats["flush_seconds"] else 0.0
+        stats["rows_per_second_overall"] = stats["rows"] / max(time.monotonic() - self.started, 1e-9)
+        return {key: round(value, 4) if isinstance(value, float) else value for key, value in stats.items()}
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        if self.closing:
+            return
+        self.closing = True
+        try:
+            # Wakes an idle writer at once; a full queue must not block the close
+            self.pending.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        atexit.unregister(self.close)
+        if self.thread.is_alive():
+            with self.lock:
+                dropped = self.counters["dropped_rows"]
+            logging.error(f"Metrics writer did not finish within {timeout}s; dropping {self.pending.qsize()} "
+                          f"queued health rows ({dropped} already dropped)")
+        logging.info(f"Metrics writer closed: {self.stats()}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+_shared_writer = None
+_shared_lock = threading.Lock()
+
+
+def get_metrics_writer():
+    # One writer per process, shared by every collector
+    global _shared_writer
+    with _shared_lock:
+        if _shared_writer is None:
+            _shared_writer = MetricsWriter()
+        return _shared_writer
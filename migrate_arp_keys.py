@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+import time
+import argparse
+from sqlalchemy import MetaData, String, inspect, text
+from sqlalchemy.schema import CreateTable
+from db_connect import create_db_engine
+from schema import Base, PackedIP, PackedMAC
+
+# Convert arp_entries and arp_history from text IP/MAC columns to the packed
+# encoding (VARBINARY(16) / BIGINT). Stop arp_poller.py first and restart it,
+# and the dashboard, afterwards; schema.py reads the encoding from the tables.
+
+TABLES = ("arp_entries", "arp_history")
+COPY_CHUNK = 100000
+
+# INET6_ATON() is the same encoding PackedIP uses; MACs lose their separators and are read as hex.
+# CONV() reads non-hex text as 0, so MACs that are not 12 hex digits are skipped and counted instead.
+MAC_DIGITS = "REPLACE(REPLACE(REPLACE(mac_address, ':', ''), '-', ''), '.', '')"
+MAC_VALID = f"{MAC_DIGITS} REGEXP '^[0-9A-Fa-f]{{12}}$'"
+
+
+def packed_select(table, columns_before):
+    return (f"SELECT {columns_before}INET6_ATON(ip_address), CONV({MAC_DIGITS}, 16, 10), timestamp, status "
+            f"FROM {table} WHERE INET6_ATON(ip_address) IS NOT NULL AND {MAC_VALID}")
+
+
+def compact_ddl(engine, table_name, new_name):
+    # DDL of the table as declared in schema.py, with packed address columns
+    metadata = MetaData()
+    Base.metadata.tables["devices"].to_metadata(metadata)
+    table = Base.metadata.tables[table_name].to_metadata(metadata, name=new_name)
+    table.c.ip_address.type = PackedIP()
+    table.c.mac_address.type = PackedMAC()
+    return str(CreateTable(table).compile(dialect=engine.dialect))
+
+
+def table_bytes(conn, table):
+    conn.execute(text(f"ANALYZE TABLE {table}"))
+    return conn.execute(text(
+        "SELECT DATA_LENGTH, INDEX_LENGTH FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"), {"table": table}).one()
+
+
+def copy_entries(conn):
+    conn.execute(text(
+        "INSERT INTO arp_entries_compact (device_id, ip_address, mac_address, timestamp, status) "
+        + packed_select("arp_entries", "device_id, ")
+        # Spellings that were distinct as text can collapse to one key; keep the latest
+        + " ON DUPLICATE KEY UPDATE status = IF(VALUES(timestamp) >= timestamp, VALUES(status), status), "
+          "timestamp = GREATEST(timestamp, VALUES(timestamp))"))
+
+
+def copy_history(engine):
+    # Copied in id ranges so no single statement holds locks on the whole table
+    with engine.connect() as conn:
+        low, high = conn.execute(text("SELECT MIN(id), MAX(id) FROM arp_history")).one()
+    if low is None:
+        return
+    for start in range(low, high + 1, COPY_CHUNK):
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO arp_history_compact (id, device_id, ip_address, mac_address, timestamp, status) "
+                + packed_select("arp_history", "id, device_id, ")
+                + " AND id >= :start AND id < :end"), {"start": start, "end": start + COPY_CHUNK})
+        print(f"arp_history: copied ids up to {min(start + COPY_CHUNK - 1, high)} of {high}")
+
+
+def migrate(engine, drop_old=False):
+    columns = {column["name"]: column["type"] for column in inspect(engine).get_columns("arp_entries")}
+    if not isinstance(columns["ip_address"], String):
+        print("arp_entries already uses packed addresses")
+        return
+
+    with engine.begin() as conn:
+        before = {table: table_bytes(conn, table) for table in TABLES}
+        for table in TABLES:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}_compact"))
+            conn.execute(text(compact_ddl(engine, table, f"{table}_compact")))
+
+    start = time.monotonic()
+    with engine.begin() as conn:
+        copy_entries(conn)
+    copy_history(engine)
+
+    with engine.begin() as conn:
+        for table in TABLES:
+            copied = conn.execute(text(f"SELECT COUNT(*) FROM {table}_compact")).scalar()
+            total = conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            bad_macs = conn.execute(text(f"SELECT COUNT(*) FROM {table} WHERE NOT ({MAC_VALID})")).scalar()
+            if bad_macs:
+                print(f"{table}: {bad_macs} rows with a MAC that is not 12 hex digits were not copied, e.g. "
+                      + ", ".join(conn.execute(text(f"SELECT DISTINCT mac_address FROM {table} "
+                                                    f"WHERE NOT ({MAC_VALID}) LIMIT 5")).scalars()))
+            if copied + bad_macs != total:
+                print(f"{table}: {total - copied - bad_macs} rows had an unparseable IP or duplicate key "
+                      f"and were not copied")
+        conn.execute(text("RENAME TABLE " + ", ".join(
+            f"{table} TO {table}_text, {table}_compact TO {table}" for table in TABLES)))
+        after = {table: table_bytes(conn, table) for table in TABLES}
+        if drop_old:
+            conn.execute(text("DROP TABLE " + ", ".join(f"{table}_text" for table in TABLES)))
+
+    print(f"Migrated in {time.monotonic() - start:.0f}s")
+    for table in TABLES:
+        print(f"{table}: data {before[table][0] >> 20} -> {after[table][0] >> 20} MiB, "
+              f"indexes {before[table][1] >> 20} -> {after[table][1] >> 20} MiB")
+    if not drop_old:
+        print("The text tables were kept as arp_entries_text and arp_history_text")
+    print("Restart arp_poller.py and the dashboard to use the packed tables")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the ARP tables to packed IP/MAC columns.")
+    parser.add_argument('--drop-old', action='store_true', help="Drop the text tables after the swap")
+    args = parser.parse_args()
+    migrate(create_db_engine(), args.drop_old)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ import os
 from palo_api_metrics import query_firewall_data, get_pan_connected_devices
 from icmplib import ping
 import pandas as pd
+import arp_index
 
 @st.cache_data
 def load_devices():
@@ -134,9 +135,12 @@ def main():
                     time.sleep(30)
 
                 with st.expander("ARP Table"):
-                    st.write("Loading ARP table data...")
-                    # Implement logic to read and display ARP table data
-                    time.sleep(30)
+                    # From the ARP poller's index snapshot rather than a live poll
+                    index = arp_index.current()
+                    if index is None:
+                        st.write("No ARP index snapshot yet.")
+                    else:
+                        st.dataframe(index.device_entries(hostname), use_container_width=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+import os
+import sys
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from capture_diff import open_capture
+from capture_index import parse_capture_name
+
+SEARCH_PATH = os.path.join("output", "search.db")
+SEARCH_ROOTS = ("output", "logs")
+
+# Full session tables are too large and too short-lived to be worth indexing
+SKIP_COMMANDS = {"show session all"}
+BATCH_LINES = 5000
+
+# A line's rowid is (document id << 32) | line number, so a document's lines are
+# one rowid range and can be dropped without scanning the FTS table
+LINE_BITS = 32
+
+# Locked-database retries for the writer before a capture is reported as not indexed
+WRITE_RETRIES = 5
+RETRY_DELAY = 2
+
+# The default unicode61 separators split IPs and MACs into their parts, so
+# to_match_query searches them as phrases: "10.1.1.1" matches "10.1.1.1/24"
+# and "error" matches "error:". Version 1 kept '.:/-_' inside tokens.
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    host TEXT NOT NULL,
+    command TEXT NOT NULL,
+    context TEXT,
+    captured_at TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_documents_host ON documents (host, command, captured_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5(text);
+"""
+
+_prepared = set()
+_prepared_lock = threading.Lock()
+_writers = {}
+
+
+def connect(search_path=SEARCH_PATH):
+    os.makedirs(os.path.dirname(search_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(search_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # The schema is checked once per process, not on every connection
+    with _prepared_lock:
+        if search_path not in _prepared:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents'").fetchone():
+                    logging.warning(f"{search_path} uses an old tokenizer and is being cleared; run --rebuild")
+                conn.executescript("DROP TABLE IF EXISTS lines; DROP TABLE IF EXISTS documents;")
+            conn.executescript(SCHEMA)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            _prepared.add(search_path)
+    return conn
+
+
+def _delete_document(conn, path):
+    row = conn.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()
+    if row:
+        first = row["id"] << LINE_BITS
+        conn.execute("DELETE FROM lines WHERE rowid >= ? AND rowid < ?", (first, first + (1 << LINE_BITS)))
+        conn.execute("DELETE FROM documents WHERE id = ?", (row["id"],))
+
+
+def _index_document(conn, host, command, context, captured_at, path):
+    mtime_ns = os.stat(path).st_mtime_ns
+    _delete_document(conn, path)
+    document_id = conn.execute(
+        "INSERT INTO documents (host, command, context, captured_at, path, mtime_ns) VALUES (?, ?, ?, ?, ?, ?)",
+        (host, command, context, captured_at.isoformat(sep=" "), path, mtime_ns)).lastrowid
+    base = document_id << LINE_BITS
+    batch = []
+    count = 0
+    with open_capture(path) as capture:
+        for line_no, line in enumerate(capture, 1):
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            batch.append((base | line_no, line))
+            if len(batch) >= BATCH_LINES:
+                conn.executemany("INSERT INTO lines (rowid, text) VALUES (?, ?)", batch)
+                count += len(batch)
+                batch = []
+    if batch:
+        conn.executemany("INSERT INTO lines (rowid, text) VALUES (?, ?)", batch)
+        count += len(batch)
+    return count
+
+
+class IndexWriter(threading.Thread):
+    """The only writer to a search index in this process; captures from any thread are queued to it.
+
+    SQLite allows one writer at a time, so capture threads never contend for the
+    lock; a capture that still cannot be written is logged as an error.
+    """
+
+    def __init__(self, search_path=SEARCH_PATH):
+        super().__init__(name="search-index-writer", daemon=True)
+        self.search_path = search_path
+        self.queue = queue.Queue()
+
+    def run(self):
+        conn = connect(self.search_path)
+        while True:
+            item = self.queue.get()
+            try:
+                self._write(conn, item)
+            finally:
+                self.queue.task_done()
+
+    def _write(self, conn, item):
+        path = item[-1]
+        for attempt in range(1, WRITE_RETRIES + 1):
+            try:
+                with conn:
+                    _index_document(conn, *item)
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == WRITE_RETRIES:
+                    logging.error(f"Could not index {path} after {attempt} attempts: {e}")
+                    return
+                time.sleep(RETRY_DELAY)
+            except Exception as e:
+                logging.error(f"Could not index {path}: {e}")
+                return
+
+
+def _writer(search_path):
+    with _prepared_lock:
+        writer = _writers.get(search_path)
+        if writer is None:
+            writer = _writers[search_path] = IndexWriter(search_path)
+            writer.start()
+    return writer
+
+
+def flush_index():
+    """Wait until every queued capture has been written; runs at exit so none is lost."""
+    for writer in list(_writers.values()):
+        writer.queue.join()
+
+
+atexit.register(flush_index)
+
+
+def index_capture(host, command, context, path, captured_at=None, search_path=SEARCH_PATH):
+    """Queue one capture file for the search index; called as each capture is written.
+
+    Indexing happens on the writer thread, so it never slows or fails a capture.
+    """
+    if command in SKIP_COMMANDS:
+        return
+    _writer(search_path).queue.put((host, command, context, captured_at or datetime.now(), path))
+
+
+def rebuild(roots=SEARCH_ROOTS, search_path=SEARCH_PATH):
+    # Index files written before the search index existed, and re-index files
+    # rewritten since (logs/ files are overwritten in place on every run)
+    conn = connect(search_path)
+    known = {row["path"]: row["mtime_ns"] for row in conn.execute("SELECT path, mtime_ns FROM documents")}
+    files = 0
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        for host_entry in os.scandir(root):
+            if not host_entry.is_dir():
+                continue
+            for file_entry in os.scandir(host_entry.path):
+                if not file_entry.is_file() or file_entry.name.endswith(".json"):
+                    continue
+                if known.get(file_entry.path) == file_entry.stat().st_mtime_ns:
+                    continue
+                parsed = parse_capture_name(file_entry.name)
+                if parsed:
+                    command, context, captured_at, error = parsed
+                    if error:
+                        continue
+                else:
+                    # logs/<host>/<command>.txt from multi_palo_api_exec carries no timestamp
+                    command = os.path.splitext(file_entry.name)[0].replace("_", " ")
+                    context = None
+                    captured_at = datetime.fromtimestamp(file_entry.stat().st_mtime)
+                if command in SKIP_COMMANDS:
+                    continue
+                try:
+                    with conn:
+                        _index_document(conn, host_entry.name, command, context, captured_at, file_entry.path)
+                except (sqlite3.Error, OSError, UnicodeDecodeError) as e:
+                    logging.warning(f"Could not index {file_entry.path}: {e}")
+                    continue
+                files += 1
+    conn.close()
+    return files
+
+
+def prune(max_age_days, search_path=SEARCH_PATH):
+    cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(sep=" ")
+    conn = connect(search_path)
+    with conn:
+        paths = [row["path"] for row in conn.execute("SELECT path FROM documents WHERE captured_at < ?", (cutoff,))]
+        for path in paths:
+            _delete_document(conn, path)
+    conn.close()
+    return len(paths)
+
+
+def to_match_query(terms):
+    # Quote every term so IPs and MACs are matched as phrases of their parts and
+    # not read as FTS5 column filters or operators; a trailing '*' stays
+    # outside the quotes as a prefix search
+    quoted = []
+    for term in terms:
+        prefix = term.endswith("*")
+        quoted.append('"' + term.rstrip("*").replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(quoted)
+
+
+def search(match, host=None, command=None, context=None, since=None, limit=200, search_path=SEARCH_PATH):
+    sql = ("SELECT d.host, d.command, d.context, d.captured_at, d.path, l.rowid & ? AS line_no, l.text "
+           "FROM lines l JOIN documents d ON d.id = (l.rowid >> ?) WHERE lines MATCH ?")
+    params = [(1 << LINE_BITS) - 1, LINE_BITS, match]
+    for column, value in (("host", host), ("command", command), ("context", context)):
+        if value:
+            sql += f" AND d.{column} = ?"
+            params.append(value)
+    if since:
+        sql += " AND d.captured_at >= ?"
+        params.append(since)
+    sql += " ORDER BY d.captured_at DESC, line_no LIMIT ?"
+    params.append(limit)
+    conn = connect(search_path)
+    rows = [dict(row) for row in conn.execute(sql, params)]
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search captured command outputs across the fleet.")
+    parser.add_argument('terms', nargs='*', help="Terms to find (an IP, MAC, or words of an error)")
+    parser.add_argument('--host', help="Only this host")
+    parser.add_argument('--command', help="Only this command")
+    parser.add_argument('-c', '--context', choices=["pre", "post"], help="Only pre or post captures")
+    parser.add_argument('--days', type=int, help="Only captures from the last DAYS days")
+    parser.add_argument('-n', '--limit', type=int, default=200, help="Maximum lines to return")
+    parser.add_argument('--raw', action='store_true', help="Pass the terms to FTS5 unquoted (AND/OR/NEAR, prefix*)")
+    parser.add_argument('--hosts-only', action='store_true', help="Only list the matching hosts")
+    parser.add_argument('--rebuild', action='store_true', help="Index existing files under output/ and logs/")
+    parser.add_argument('--prune', type=int, metavar='DAYS', help="Drop indexed captures older than DAYS")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        print(f"Indexed {rebuild()} files")
+    if args.prune:
+        print(f"Pruned {prune(args.prune)} files from the search index")
+    if not args.terms:
+        if not (args.rebuild or args.prune):
+            parser.print_help()
+            sys.exit(1)
+        return
+
+    match = " ".join(args.terms) if args.raw else to_match_query(args.terms)
+    since = (datetime.now() - timedelta(days=args.days)).isoformat(sep=" ") if args.days else None
+    start = time.monotonic()
+    try:
+        rows = search(match, args.host, args.command, args.context, since, args.limit)
+    except sqlite3.OperationalError as e:
+        print(f"Bad query: {e}")
+        sys.exit(1)
+    elapsed = time.monotonic() - start
+
+    if args.hosts_only:
+        hosts = {}
+        for row in rows:
+            hosts.setdefault(row["host"], set()).add(row["command"])
+        for host, commands in sorted(hosts.items()):
+            print(f"{host:<20} {', '.join(sorted(commands))}")
+    else:
+        for row in rows:
+            print(f"{row['host']:<20} {row['captured_at'][:19]} {row['command']:<40} {row['line_no']:>7}: {row['text']}")
+    print(f"{len(rows)} matching lines in {elapsed:.3f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
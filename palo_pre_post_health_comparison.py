@@ -1,9 +1,14 @@
 #!/usr/bin/python3
 import os
 import sys
-import paramiko
 from datetime import datetime, timedelta
 from colorama import init, Fore, Style
+from capture_diff import compare_captures, print_comparison_summary
+from capture_index import record_capture, latest_captures
+from output_search import index_capture
+from ssh_session import PanSSHSession, CommandTimeout
+from capture_report import CaptureRun
+from stream_capture import STREAM_COMMANDS, STREAM_MAX_BYTES, CaptureLimitExceeded
 
 # Predefined status commands
 STATUS_COMMANDS = [
@@ -39,39 +44,76 @@ def read_creds():
         print(f"{Fore.RED}Error: {e}{Style.RESET_ALL}")
         sys.exit(1)
 
-def execute_ssh_command(host, user, password, key_file, command):
+def execute_ssh_commands(host, user, password, key_file, commands, context, verbose=False,
+                         max_bytes=STREAM_MAX_BYTES, report=None):
+    # One transport and one shell for the whole capture; pager/scripting mode are set on open
+    captured = {}
+    report = report or CaptureRun("palo_pre_post", context)
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        if key_file:
-            client.connect(host, username=user, key_filename=key_file)
-        else:
-            client.connect(host, username=user, password=password)
-        
-        # Disable interactive paging
-        client.exec_command("set cli pager off")
-        
-        stdin, stdout, stderr = client.exec_command(command)
-        output = stdout.read().decode()
-        client.close()
-        return output
+        with PanSSHSession(host, user, password, key_file) as session:
+            for phase, seconds in session.timings.items():
+                report.add_time(host, "*", phase, seconds)
+            for command in commands:
+                if command in STREAM_COMMANDS:
+                    # Large outputs go straight from the channel into a compressed file
+                    path = capture_path(host, command, context, extension="txt.gz")
+                    stats = {}
+                    try:
+                        received, latency = session.stream(command, path, max_bytes=max_bytes, stats=stats)
+                    except (CaptureLimitExceeded, CommandTimeout) as e:
+                        report.record(host, command, status="truncated", transport="ssh-stream")
+                        log_error(host, command, f"{e}, partial output in {path}")
+                        print(f"{Fore.RED}{e}{Style.RESET_ALL}")
+                        continue
+                    report.add_time(host, command, "wait", latency - stats.get("write", 0.0))
+                    report.add_time(host, command, "write", stats.get("write", 0.0))
+                    report.record(host, command, bytes=received, transport="ssh-stream")
+                    print(f"  {command:<45} {latency:7.2f}s {received:>10} bytes (streamed)")
+                    record_capture(host, command, context, path, duration=latency)
+                    index_capture(host, command, context, path)
+                    captured[command] = path
+                    continue
+                try:
+                    output, latency = session.run(command)
+                except CommandTimeout as e:
+                    report.record(host, command, status="timeout", transport="ssh")
+                    print(f"{Fore.RED}{e} ('{command}'){Style.RESET_ALL}")
+                    continue
+                report.add_time(host, command, "wait", latency)
+                report.record(host, command, bytes=len(output), transport="ssh")
+                # Per-command latency over the shared session
+                print(f"  {command:<45} {latency:7.2f}s {len(output):>10} bytes")
+                with report.phase(host, command, "write"):
+                    captured[command] = store_output(host, command, output, context, duration=latency)
     except Exception as e:
-        error_message = f"Error executing command on {host}: {e}"
-        log_error(host, command, error_message)
-        print(f"{Fore.RED}Error executing command '{command}' on {host}: {e}{Style.RESET_ALL}")
-        return None
-
-def store_output(host, command, output, context, error=False):
+        report.record(host, "*", status="error", error=str(e))
+        error_message = f"Error executing commands on {host}: {e}"
+        log_error(host, "multiple commands", error_message)
+        print(f"{Fore.RED}Error executing commands on {host}: {e}{Style.RESET_ALL}")
+
+    for command in commands:
+        if command not in captured:
+            error_message = f"Failed to execute command: {command}"
+            error_file_path = store_output(host, command, error_message, context, error=True)
+            log_error(host, command, error_file_path)
+    return captured
+
+def capture_path(host, command, context, error=False, extension="txt"):
     timestamp = datetime.now().strftime("%m-%d-%y-%H-%M-%S")
     logs_dir = "output"
     host_dir = os.path.join(logs_dir, host)
     os.makedirs(host_dir, exist_ok=True)
     sanitized_cmd = command.replace(" ", "_")
     suffix = "-ERROR" if error else ""
-    log_file_path = os.path.join(host_dir, f"{sanitized_cmd}-{context}-{timestamp}{suffix}.txt")
+    return os.path.join(host_dir, f"{sanitized_cmd}-{context}-{timestamp}{suffix}.{extension}")
+
+def store_output(host, command, output, context, error=False, extension="txt", duration=None):
+    log_file_path = capture_path(host, command, context, error, extension)
     with open(log_file_path, "w") as log_file:
         log_file.write(output)
+    record_capture(host, command, context, log_file_path, duration=duration, error=error)
+    if not error:
+        index_capture(host, command, context, log_file_path)
     return log_file_path
 
 def log_error(host, command, error_message):
@@ -80,25 +122,15 @@ def log_error(host, command, error_message):
     with open(error_log_path, "a") as error_log:
         error_log.write(f"{timestamp} | {host} | {command} | {error_message}\n")
 
-def find_recent_pre_files(host):
-    host_dir = os.path.join("output", host)
-    if not os.path.exists(host_dir):
-        return []
-
-    pre_files = [f for f in os.listdir(host_dir) if "-pre-" in f]
-    pre_files.sort(key=lambda x: os.path.getmtime(os.path.join(host_dir, x)), reverse=True)
-    return pre_files
-
-def compare_outputs(pre_file, post_file):
-    # Implement custom comparison logic for each command
-    # Return "pass" or "fail" with detailed comparison results
-    pass
+def find_recent_pre_files(host, commands):
+    # Newest successful pre capture per command, from the capture index
+    return latest_captures(host, commands, context="pre")
 
 def main():
     init(autoreset=True)  # Initialize colorama
 
     if len(sys.argv) < 4 or "-c" not in sys.argv:
-        print(f"Syntax: {sys.argv[0]} [-v] [-k keyfile] -c context hostname\n\n")
+        print(f"Syntax: {sys.argv[0]} [-v] [-k keyfile] [-m max_mb] -c context hostname\n\n")
         sys.exit(1)
 
     verbose = "-v" in sys.argv
@@ -110,6 +142,15 @@ def main():
             sys.exit(1)
         key_file = sys.argv[key_index]
 
+    # Byte limit for each streamed capture
+    max_bytes = STREAM_MAX_BYTES
+    if "-m" in sys.argv:
+        max_index = sys.argv.index("-m") + 1
+        if max_index >= len(sys.argv) or not sys.argv[max_index].isdigit():
+            print("Error: A size in MB must follow the -m option.")
+            sys.exit(1)
+        max_bytes = int(sys.argv[max_index]) * 1024 * 1024
+
     context_index = sys.argv.index("-c") + 1
     if context_index >= len(sys.argv) - 1:
         print("Error: Context and hostname must follow the -c option.")
@@ -124,42 +165,36 @@ def main():
 
     user, password = read_creds() if not key_file else (None, None)
 
+    report = CaptureRun("palo_pre_post", context)
+
     if context == "pre":
-        for command in STATUS_COMMANDS:
-            output = execute_ssh_command(fwname, user, password, key_file, command)
-            if output:
-                store_output(fwname, command, output, context)
-            else:
-                error_message = f"Failed to execute command: {command}"
-                error_file_path = store_output(fwname, command, error_message, context, error=True)
-                log_error(fwname, command, error_file_path)
+        execute_ssh_commands(fwname, user, password, key_file, STATUS_COMMANDS, context, verbose, max_bytes, report)
+        print(f"Timing report written to {report.save()}")
 
     elif context == "post":
-        pre_files = find_recent_pre_files(fwname)
+        pre_files = find_recent_pre_files(fwname, STATUS_COMMANDS)
         if not pre_files:
             print(f"{Fore.YELLOW}Warning: No pre-change files found for {fwname}.{Style.RESET_ALL}")
             sys.exit(1)
 
         # Check the age of the most recent pre file
-        most_recent_pre_file = pre_files[0]
-        pre_file_path = os.path.join("output", fwname, most_recent_pre_file)
-        pre_file_time = datetime.fromtimestamp(os.path.getmtime(pre_file_path))
+        pre_file_time = datetime.fromisoformat(max(record["captured_at"] for record in pre_files.values()))
         if datetime.now() - pre_file_time > timedelta(hours=24):
             print(f"{Fore.YELLOW}Warning: The most recent pre-change file for {fwname} is more than 24 hours old.{Style.RESET_ALL}")
 
-        for command in STATUS_COMMANDS:
-            output = execute_ssh_command(fwname, user, password, key_file, command)
-            if output:
-                post_file_path = store_output(fwname, command, output, context)
-                # Compare with the most recent pre file
-                pre_file = next((f for f in pre_files if command.replace(" ", "_") in f), None)
-                if pre_file:
-                    pre_file_path = os.path.join("output", fwname, pre_file)
-                    compare_outputs(pre_file_path, post_file_path)
-            else:
-                error_message = f"Failed to execute command: {command}"
-                error_file_path = store_output(fwname, command, error_message, context, error=True)
-                log_error(fwname, command, error_file_path)
+        post_files = execute_ssh_commands(fwname, user, password, key_file, STATUS_COMMANDS, context, verbose,
+                                          max_bytes, report)
+        print(f"Timing report written to {report.save()}")
+
+        pairs = []
+        for command, post_file_path in post_files.items():
+            # Compare with the most recent pre capture of the same command
+            if command in pre_files:
+                pairs.append((command, pre_files[command]["path"], post_file_path))
+
+        results = compare_captures(pairs)
+        if not print_comparison_summary(fwname, results, verbose):
+            sys.exit(2)
 
 if __name__ == "__main__":
     main()
@@ -5,7 +5,15 @@ import urllib3
 import os                                     
                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                    
 import time
+import logging
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+from timeseries_buffer import TimeSeriesBuffer, downsample
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -122,16 +130,10 @@ def extract_info(info):
 
         # Parse CPU usage
         cpu_line = next(line for line in resource_info if line.startswith("%Cpu"))
-        with open("logs/cpu_debug.log", "a") as log_file:  # Log to file
-            log_file.write(f"CPU Line: {cpu_line}\n")
         cpu_values = cpu_line.split()
         cpu_idle = float(cpu_values[7].replace("id,", ""))  # Ensure correct index
-        with open("logs/cpu_debug.log", "a") as log_file:  # Log to file
-            log_file.write(f"Parsed CPU Values: {cpu_values}\n")
-            log_file.write(f"CPU Idle: {cpu_idle}\n")
         data['CPU Usage'] = 100 - cpu_idle
-        with open("logs/cpu_debug.log", "a") as log_file:  # Log to file
-            log_file.write(f"CPU Usage: {data['CPU Usage']}\n")
+        logging.debug(f"CPU line: {cpu_line} -> usage {data['CPU Usage']}")
 
         # Parse memory usage
         mem_line = next(line for line in resource_info if line.startswith("MiB Mem"))
@@ -153,6 +155,121 @@ def extract_info(info):
 
     return data
 
+# Polled by the background collector; history covers the longest timespan option
+PANORAMAS = {"LAK": "l17panorama", "ATL": "a46panorama"}
+REFRESH_INTERVAL = 30
+HISTORY_SECONDS = 7 * 24 * 60 * 60
+TIMESPAN_OPTIONS = {
+    "1 hour": 60 * 60,
+    "12 hours": 12 * 60 * 60,
+    "24 hours": 24 * 60 * 60,
+    "7 days": 7 * 24 * 60 * 60
+}
+
+# One resource query per poll, without the raw-XML log writes of get_system_info
+def get_resource_info(hostname, api_key):
+    response = requests.get(f"https://{hostname}/api/",
+                            params={'type': 'op', 'cmd': "<show><system><resources></resources></system></show>"},
+                            headers={'X-PAN-KEY': api_key}, verify=False, timeout=30)
+    if response.status_code == 200:
+        return ET.fromstring(response.text)
+    return None
+
+# Numeric series kept per host in the ring buffers; the full extract_info dict is only kept for the latest poll
+METRICS = ['load_1', 'load_5', 'load_15', 'cpu', 'mem_total', 'mem_used']
+# About the pixel width of a chart column; longer windows are downsampled to this before plotting
+CHART_POINTS = 600
+
+def metric_values(data):
+    memory = data['Memory']
+    return [*data['Load Averages'], data['CPU Usage'], memory['Total'], memory['Used']]
+
+class Collector(threading.Thread):
+    """Polls the Panoramas on a fixed schedule, independent of how many pages are open."""
+
+    def __init__(self, hosts, api_key, store, interval=REFRESH_INTERVAL):
+        super().__init__(name="palostream-collector", daemon=True)
+        self.hosts = hosts
+        self.api_key = api_key
+        self.store = store
+        self.interval = interval
+        self.latest = {}
+        # Last poll error per host, cleared when that host polls successfully again
+        self.errors = {}
+        self.stopping = threading.Event()
+
+    def poll_once(self):
+        for label, hostname in self.hosts.items():
+            try:
+                resource_info = get_resource_info(hostname, self.api_key)
+                if resource_info is None:
+                    raise RuntimeError(f"no resource data from {hostname}")
+                data = extract_info({'resource_info': resource_info})
+                self.store.append(label, time.time(), metric_values(data))
+                self.latest[label] = data
+                self.errors.pop(label, None)
+            except Exception as e:
+                self.errors[label] = str(e)
+                logging.warning(f"Resource poll of {hostname} failed: {e}")
+
+    def run(self):
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            self.poll_once()
+            self.stopping.wait(max(0, self.interval - (time.monotonic() - started)))
+
+@st.cache_resource
+def get_collector(api_key):
+    # Created once per server process and shared by every session and rerun
+    collector = Collector(PANORAMAS, api_key, TimeSeriesBuffer(METRICS, HISTORY_SECONDS // REFRESH_INTERVAL))
+    collector.start()
+    return collector
+
+def memory_figure(times, used, total):
+    fig, ax = plt.subplots(figsize=(5, 3))
+    ax.fill_between(times, used, label='Used', color='red', alpha=0.5)
+    ax.fill_between(times, total, used, label='Free', color='green', alpha=0.5)
+    ax.set_ylim(0, np.nanmax(total))
+    ax.legend()
+    fig.autofmt_xdate()
+    return fig
+
+def chart_frame(times, values, columns):
+    # LTTB keeps each series' peaks while capping the points sent to the browser
+    times, values = downsample(times, values, CHART_POINTS)
+    return pd.DataFrame(values, index=[datetime.fromtimestamp(timestamp) for timestamp in times],
+                        columns=columns)
+
+@st.fragment(run_every=REFRESH_INTERVAL)
+def render_charts(collector, timespan_seconds):
+    # Only this fragment reruns on the timer; it reads the shared store and never calls the API
+    columns = st.columns(len(PANORAMAS))
+    for column, label in zip(columns, PANORAMAS):
+        times, values = collector.store.window(label, timespan_seconds, now=time.time())
+        with column:
+            # One read: the collector thread may clear the entry at any time
+            error = collector.errors.get(label)
+            if error:
+                st.caption(f"Last {label} poll failed: {error}")
+            if not len(times):
+                st.info(f"Waiting for the first {label} poll...")
+                continue
+
+            st.subheader(f"{label} Load Averages")
+            st.line_chart(chart_frame(times, values[:, 0:3], ['1 min', '5 min', '15 min']))
+
+            st.subheader(f"{label} CPU Usage")
+            st.line_chart(chart_frame(times, values[:, 3], ['CPU Usage']))
+
+            st.subheader(f"{label} Memory Usage")
+            memory = chart_frame(times, values[:, 4:6], ['Total', 'Used'])
+            fig = memory_figure(memory.index, memory['Used'], memory['Total'])
+            st.pyplot(fig)
+            # Figures are not garbage collected while pyplot tracks them
+            plt.close(fig)
+
+    st.table([collector.latest.get(label, {}) for label in PANORAMAS])
+
 # Streamlit app
 def main():
     st.set_page_config(layout="wide")  # Set layout to wide for better alignment
@@ -167,143 +284,10 @@ def main():
     else: #print error message that the key file is missing and stop execution
             st.error("Error: 'PAN_API_KEY' file not found. Please create this file and add your API key in it.")
             return
-    
-    # Get system info for both Panorama instances
-    lak_info = get_system_info('l17panorama', api_key)
-    atl_info = get_system_info('a46panorama', api_key)
-
-    if lak_info and atl_info:
-        # Select refresh interval
-        refresh_interval = 30
-
-        # Select timespan for graphs
-        timespan_options = {
-            "1 hour": 60 * 60,
-            "12 hours": 12 * 60 * 60,
-            "24 hours": 24 * 60 * 60,
-            "7 days": 7 * 24 * 60 * 60
-        }
-        timespan = st.selectbox("Select timespan for graphs:", list(timespan_options.keys()), index=0)
-        timespan_seconds = timespan_options[timespan]
-
-        # Initialize lists to store historical data
-        lak_load_history = []
-        atl_load_history = []
-        lak_cpu_history = []
-        atl_cpu_history = []
-        lak_memory_history = []
-        atl_memory_history = []
-
-        # Organize graphs into columns
-        col1, col2 = st.columns(2)
-
-        with col1:
-            st.subheader("LAK Load Averages")
-            lak_load_chart_placeholder = st.empty()
-
-            st.subheader("LAK CPU Usage")
-            lak_cpu_chart_placeholder = st.empty()
-
-            st.subheader("LAK Memory Usage")
-            lak_memory_chart_placeholder = st.empty()
-
-        with col2:
-            st.subheader("ATL Load Averages")
-            atl_load_chart_placeholder = st.empty()
-
-            st.subheader("ATL CPU Usage")
-            atl_cpu_chart_placeholder = st.empty()
-
-            st.subheader("ATL Memory Usage")
-            atl_memory_chart_placeholder = st.empty()
-
-        # Create placeholder for the table
-        table_placeholder = st.empty()
-
-        # Set up dynamic updates for resource info
-        while True:
-            # Re-query resource info
-            lak_resource_info = get_system_info('l17panorama', api_key)['resource_info']
-            atl_resource_info = get_system_info('a46panorama', api_key)['resource_info']
-
-            # Extract and display updated resource info
-            lak_resource_data = extract_info({'resource_info': lak_resource_info})
-            atl_resource_data = extract_info({'resource_info': atl_resource_info})
-
-            # Append new data to history
-            lak_load_history.append(lak_resource_data['Load Averages'])
-            atl_load_history.append(atl_resource_data['Load Averages'])
-            lak_cpu_history.append(lak_resource_data['CPU Usage'])
-            atl_cpu_history.append(atl_resource_data['CPU Usage'])
-            lak_memory_history.append(lak_resource_data['Memory'])
-            atl_memory_history.append(atl_resource_data['Memory'])
-
-            # Trim history to match the selected timespan
-            max_points = timespan_seconds // refresh_interval
-            lak_load_history = lak_load_history[-max_points:]
-            atl_load_history = atl_load_history[-max_points:]
-            lak_cpu_history = lak_cpu_history[-max_points:]
-            atl_cpu_history = atl_cpu_history[-max_points:]
-            lak_memory_history = lak_memory_history[-max_points:]
-            atl_memory_history = atl_memory_history[-max_points:]
-
-            # Update load average graph for LAK
-            lak_load_chart_placeholder.line_chart({
-                '1 min': [load[0] for load in lak_load_history],
-                '5 min': [load[1] for load in lak_load_history],
-                '15 min': [load[2] for load in lak_load_history]
-            })
-
-            # Update CPU usage graph for LAK
-            lak_cpu_chart_placeholder.line_chart(lak_cpu_history)
-
-            # Update memory usage graph for LAK
-            fig_lak_mem, ax_lak_mem = plt.subplots(figsize=(5, 3))
-            ax_lak_mem.fill_between(range(len(lak_memory_history)),
-                                    [mem['Used'] for mem in lak_memory_history],
-                                    label='Used', color='red', alpha=0.5)
-            ax_lak_mem.fill_between(range(len(lak_memory_history)),
-                                    [mem['Total'] for mem in lak_memory_history],
-                                    [mem['Used'] for mem in lak_memory_history],
-                                    label='Free', color='green', alpha=0.5)
-            ax_lak_mem.set_ylim(0, max(mem['Total'] for mem in lak_memory_history))
-            ax_lak_mem.legend()
-            lak_memory_chart_placeholder.pyplot(fig_lak_mem)
-
-            # Update load average graph for ATL
-            atl_load_chart_placeholder.line_chart({
-                '1 min': [load[0] for load in atl_load_history],
-                '5 min': [load[1] for load in atl_load_history],
-                '15 min': [load[2] for load in atl_load_history]
-            })
-
-            # Update CPU usage graph for ATL
-            atl_cpu_chart_placeholder.line_chart(atl_cpu_history)
-
-            # Update memory usage graph for ATL
-            fig_atl_mem, ax_atl_mem = plt.subplots(figsize=(5, 3))
-            ax_atl_mem.fill_between(range(len(atl_memory_history)),
-                                    [mem['Used'] for mem in atl_memory_history],
-                                    label='Used', color='red', alpha=0.5)
-            ax_atl_mem.fill_between(range(len(atl_memory_history)),
-                                    [mem['Total'] for mem in atl_memory_history],
-                                    [mem['Used'] for mem in atl_memory_history],
-                                    label='Free', color='green', alpha=0.5)
-            ax_atl_mem.set_ylim(0, max(mem['Total'] for mem in atl_memory_history))
-            ax_atl_mem.legend()
-            atl_memory_chart_placeholder.pyplot(fig_atl_mem)
-
-            # Update the table with new data
-            table_placeholder.table([lak_resource_data, atl_resource_data])
-
-            # Wait for the selected interval before updating
-            time.sleep(refresh_interval)
-    else:
-        st.error("Failed to retrieve system information.")
+
+    collector = get_collector(api_key)
+    timespan = st.selectbox("Select timespan for graphs:", list(TIMESPAN_OPTIONS.keys()), index=0)
+    render_charts(collector, TIMESPAN_OPTIONS[timespan])
 
 if __name__ == "__main__":
     main()
-
-
-
-
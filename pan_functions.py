@@ -64,6 +64,27 @@ def read_pan_api_key():
     else:
         raise FileNotFoundError(f"Panorama API key file '{pankey_path}' not found.")
 
+def read_firewall_api_key(allow_panorama_key=False):
+    """
+    Function to read the API key used for direct firewall queries (ARP, resource monitor).
+
+    The key belongs to a read-only operational admin pushed to the firewalls by
+    a Panorama template, so a leaked copy cannot change configuration or reach
+    Panorama. The Panorama key is only sent to the firewalls in its place when
+    allow_panorama_key is set explicitly.
+
+    :param allow_panorama_key: Fall back to the Panorama API key if the firewall key file is missing.
+    :return: The API key as a string.
+    :raises FileNotFoundError: If the firewall API key file is not found and no fallback is allowed.
+    """
+    fwkey_path = os.path.join('/home/netmonitor/.cred', 'fwkey')
+    if os.path.exists(fwkey_path):
+        return read_file(fwkey_path)
+    if not allow_panorama_key:
+        raise FileNotFoundError(f"Firewall API key file '{fwkey_path}' not found.")
+    logging.warning(f"Firewall API key file '{fwkey_path}' not found; sending the Panorama API key to firewalls")
+    return read_pan_api_key()
+
 def send_api_query(hostname, api_key, query_type, command):
     """
     Centralized function to handle API queries.
@@ -131,7 +152,7 @@ def get_pan_connected_devices(active_panorama):
 
     return devices_data
 
-def parse_system_resources(response_text, hostname, live_db):
+def parse_system_resources(response_text, hostname, live_db, writer=None):
     # Extract the relevant lines from the response
     lines = response_text.splitlines()
     try:
@@ -167,31 +188,24 @@ def parse_system_resources(response_text, hostname, live_db):
         logging.error(f"Failed to parse memory usage: {e}")
         return
 
-    # Prepare data for insertion
-    data = (hostname, uptime, one_min_load, cpu_usage, mem_used, mem_free)
-    insert_query = """
-    INSERT INTO system_resources (hostname, updated, bu, retail_store_id, last_boot, one_min_load, cpu_usage, mem_used, mem_free)
-    VALUES (%s, %s, %s, %s, %s, %s)
-    """
+    # Prepare a firewall_health row; uptime and load have no column there
+    row = {
+        'hostname': hostname,
+        'timestamp': datetime.now(),
+        'cpu_usage': cpu_usage,
+        'memory_used': mem_used,
+        'memory_free': mem_free,
+    }
+    logging.debug(f"{hostname}: uptime {uptime}, 1 minute load {one_min_load}")
 
     if live_db:
-        # Insert data into MySQL database
-        db_host, db_user, db_password, db_name = get_db_credentials()
-        connection = mysql.connector.connect(
-            host=db_host,
-            user=db_user,
-            password=db_password,
-            database=db_name
-        )
-        cursor = connection.cursor()
-        cursor.execute(insert_query, data)
-        connection.commit()
-        cursor.close()
-        connection.close()
-        logging.debug(f"Inserted system resources data for {hostname} into the database")
+        # Buffered and written in batches by the shared metrics writer
+        from metrics_writer import get_metrics_writer
+        (writer or get_metrics_writer()).write(row)
+        logging.debug(f"Queued system resources data for {hostname}")
     else:
-        # Print the SQL query for debugging
-        logging.debug(f"SQL Query: {insert_query % data}")
+        logging.debug(f"Health row: {row}")
+    return row
 
 def get_active_pan(panorama_instances):
     # Open a file for writing debug information
@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from datetime import datetime, date, timedelta
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from sqlalchemy import bindparam, text
+from db_connect import create_db_engine
+from health_rollup import RAW
+from schema import ARPHistory
+
+ARCHIVE_ROOT = "archive"
+STATE_FILE = "_archived.json"
+CHUNK_ROWS = 200000
+ROWS_PER_GROUP = 65536
+PURGE_CHUNK = 10000
+
+# Columns stored dictionary-encoded: few distinct values repeated on every row.
+# hostname is also a partition key, so files carry it only in their path.
+DICTIONARY_COLUMNS = ["hostname", "mac_address", "ip_address", "status"]
+
+# keep_days is how long rows stay in MySQL after archiving. firewall_health
+# is left to health_rollup's partition retention, so only days still inside
+# source_retention_days are archived; arp_history rows are deleted here, by
+# id, once they are in the archive and older than keep_days.
+TABLES = {
+    "firewall_health": {
+        "query": "SELECT * FROM firewall_health WHERE timestamp >= :start AND timestamp < :end "
+                 "ORDER BY hostname, timestamp",
+        "count": "SELECT COUNT(*) FROM firewall_health WHERE timestamp >= :start AND timestamp < :end",
+        "source_retention_days": RAW["retention_days"],
+        "keep_days": None,
+    },
+    "arp_history": {
+        "query": "SELECT h.id, d.hostname, h.ip_address, h.mac_address, h.timestamp, h.status "
+                 "FROM arp_history h JOIN devices d ON d.id = h.device_id "
+                 "WHERE h.timestamp >= :start AND h.timestamp < :end ORDER BY d.hostname, h.timestamp",
+        "count": "SELECT COUNT(*) FROM arp_history WHERE timestamp >= :start AND timestamp < :end",
+        "id_column": "id",
+        # Typed so packed addresses (see migrate_arp_keys.py) come back as strings
+        "types": {"ip_address": ARPHistory.__table__.c.ip_address.type,
+                  "mac_address": ARPHistory.__table__.c.mac_address.type},
+        "keep_days": 30,
+    },
+}
+
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string()), ("hostname", pa.string())]), flavor="hive")
+# Reads bring hostname back dictionary-encoded, one dictionary across all partitions
+READ_PARTITIONING = ds.partitioning(pa.schema([("date", pa.string()), ("hostname", pa.dictionary(pa.int32(), pa.string()))]),
+                                    flavor="hive", dictionaries="infer")
+
+
+def table_dir(table, root=ARCHIVE_ROOT):
+    return os.path.join(root, table)
+
+
+def load_state(table, root=ARCHIVE_ROOT):
+    # {day: {"rows": rows in the archive, "purged": whether its MySQL rows were deleted}}
+    path = os.path.join(table_dir(table, root), STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as state_file:
+        state = json.load(state_file)
+    if isinstance(state, list):
+        # First format: a list of archived days, none purged by id yet
+        state = {day: {"rows": None, "purged": False} for day in state}
+    return state
+
+
+def save_state(table, state, root=ARCHIVE_ROOT):
+    path = os.path.join(table_dir(table, root), STATE_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as state_file:
+        json.dump(state, state_file, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def day_bounds(day):
+    start = datetime.combine(day, datetime.min.time())
+    return {"start": start, "end": start + timedelta(days=1)}
+
+
+def count_rows(engine, table, day):
+    with engine.connect() as conn:
+        return conn.execute(text(TABLES[table]["count"]), day_bounds(day)).scalar()
+
+
+def archive_day(engine, table, day, root=ARCHIVE_ROOT, append=False):
+    """Write one closed day of a table to archive/<table>/date=<day>/hostname=<host>/.
+
+    Rows are read in chunks ordered by hostname, so each chunk adds at most a
+    file per host. A rewrite replaces the day's directory once the first chunk
+    arrives; with append the rows are added as extra files instead, for rows
+    that reached MySQL after the day was purged. Returns (rows, archived ids),
+    ids being empty for tables without an id_column.
+    """
+    day_dir = os.path.join(table_dir(table, root), f"date={day.isoformat()}")
+    prefix = f"late-{int(time.time())}" if append else "part"
+    statement = text(TABLES[table]["query"])
+    if "types" in TABLES[table]:
+        statement = statement.columns(**TABLES[table]["types"])
+    id_column = TABLES[table].get("id_column")
+    rows = 0
+    ids = []
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        for chunk_number, frame in enumerate(pd.read_sql(statement, conn, params=day_bounds(day),
+                                                         chunksize=CHUNK_ROWS)):
+            if chunk_number == 0 and not append and os.path.isdir(day_dir):
+                shutil.rmtree(day_dir)
+            if id_column:
+                ids.extend(frame[id_column].tolist())
+            frame["timestamp"] = pd.to_datetime(frame["timestamp"])
+            frame["date"] = day.isoformat()
+            arrow_table = pa.Table.from_pandas(frame, preserve_index=False)
+            for column in DICTIONARY_COLUMNS:
+                if column in arrow_table.column_names and column != "hostname":
+                    index = arrow_table.schema.get_field_index(column)
+                    arrow_table = arrow_table.set_column(index, column, arrow_table.column(column).dictionary_encode())
+            ds.write_dataset(
+                arrow_table, table_dir(table, root), format="parquet", partitioning=PARTITIONING,
+                basename_template=f"{prefix}-{chunk_number:05d}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                file_options=ds.ParquetFileFormat().make_write_options(compression="zstd", use_dictionary=True),
+                max_rows_per_group=ROWS_PER_GROUP, min_rows_per_group=min(ROWS_PER_GROUP, 1024))
+            rows += len(frame)
+    return rows, ids
+
+
+def purge_archived(engine, table, state, keep_days, root=ARCHIVE_ROOT, today=None):
+    """Delete archived rows older than keep_days from MySQL.
+
+    Each day is archived again just before its purge, so rows that arrived
+    after the first archive (spool replays keep their original timestamp) are
+    written too, and only the ids in that archive run are deleted. Purged days
+    are checked on later runs and any late rows are appended, then deleted.
+    """
+    cutoff = (today or date.today()) - timedelta(days=keep_days)
+    deleted = 0
+    for day_text in sorted(state):
+        day = date.fromisoformat(day_text)
+        entry = state[day_text]
+        if day >= cutoff or (entry["purged"] and not count_rows(engine, table, day)):
+            continue
+        rows, ids = archive_day(engine, table, day, root, append=entry["purged"])
+        for offset in range(0, len(ids), PURGE_CHUNK):
+            # Small chunks keep lock times short for the live inserts
+            with engine.begin() as conn:
+                deleted += conn.execute(
+                    text(f"DELETE FROM {table} WHERE {TABLES[table]['id_column']} IN :ids")
+                    .bindparams(bindparam("ids", expanding=True)), {"ids": ids[offset:offset + PURGE_CHUNK]}).rowcount
+        if entry["purged"] or not rows:
+            entry["rows"] = (entry["rows"] or 0) + rows
+        else:
+            entry["rows"] = rows
+        entry["purged"] = True
+        save_state(table, state, root)
+    return deleted
+
+
+def archive(engine, tables=tuple(TABLES), days_back=7, root=ARCHIVE_ROOT, today=None):
+    """Archive closed days in the last days_back days that are new or gained rows since archived."""
+    today = today or date.today()
+    for table in tables:
+        state = load_state(table, root)
+        retention = TABLES[table].get("source_retention_days")
+        # Older days are already gone from the source and would archive as empty
+        span = min(days_back, retention) if retention else days_back
+        for offset in range(span, 0, -1):
+            day = today - timedelta(days=offset)
+            entry = state.get(day.isoformat())
+            if entry and (entry["purged"] or entry["rows"] is None
+                          or count_rows(engine, table, day) <= entry["rows"]):
+                continue
+            start = time.monotonic()
+            rows, _ = archive_day(engine, table, day, root)
+            if not rows:
+                # Not recorded, so a later run archives the day if rows turn up
+                print(f"{table} {day}: no rows to archive")
+                continue
+            state[day.isoformat()] = {"rows": rows, "purged": False}
+            save_state(table, state, root)
+            print(f"{table} {day}: archived {rows} rows in {time.monotonic() - start:.1f}s")
+        keep_days = TABLES[table]["keep_days"]
+        if keep_days:
+            deleted = purge_archived(engine, table, state, keep_days, root, today)
+            if deleted:
+                print(f"{table}: deleted {deleted} archived rows older than {keep_days} days from MySQL")
+
+
+def query(table, hostname=None, start=None, end=None, columns=None, root=ARCHIVE_ROOT):
+    """Read archived rows without touching MySQL.
+
+    hostname and the date range prune whole partition directories; the
+    timestamp filter then skips row groups by their min/max statistics.
+    Returns a pyarrow Table.
+    """
+    dataset = ds.dataset(table_dir(table, root), format=ds.ParquetFileFormat(
+                             read_options={"dictionary_columns": [c for c in DICTIONARY_COLUMNS if c != "hostname"]}),
+                         partitioning=READ_PARTITIONING,
+                         exclude_invalid_files=True, ignore_prefixes=["_", "."])
+    condition = None
+    if hostname:
+        condition = ds.field("hostname") == hostname
+    for bound, operator in ((start, "ge"), (end, "lt")):
+        if bound is None:
+            continue
+        day = bound.date().isoformat() if isinstance(bound, datetime) else bound.isoformat()
+        day_filter = ds.field("date") >= day if operator == "ge" else ds.field("date") <= day
+        moment = bound if isinstance(bound, datetime) else datetime.combine(bound, datetime.min.time())
+        time_filter = (ds.field("timestamp") >= pa.scalar(moment, pa.timestamp("ns")) if operator == "ge"
+                       else ds.field("timestamp") < pa.scalar(moment, pa.timestamp("ns")))
+        for part in (day_filter, time_filter):
+            condition = part if condition is None else condition & part
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive closed days of ARP history and health to Parquet.")
+    parser.add_argument('--days-back', type=int, default=7, help="Archive closed days up to this many days back")
+    parser.add_argument('--table', choices=list(TABLES), action='append', help="Only these tables")
+    parser.add_argument('--query', nargs=2, metavar=('TABLE', 'HOSTNAME'), help="Read a host's archived rows")
+    parser.add_argument('--since', help="With --query, first date (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    if args.query:
+        table, hostname = args.query
+        start_time = time.monotonic()
+        since = date.fromisoformat(args.since) if args.since else None
+        result = query(table, hostname, since)
+        print(result.to_pandas().to_string(max_rows=50))
+        print(f"{result.num_rows} rows in {time.monotonic() - start_time:.2f}s", file=sys.stderr)
+        return
+    archive(create_db_engine(), tuple(args.table or TABLES), args.days_back)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,29 @@
 #!/usr/bin/python3.9
 import os
+import re
 import sys
 import time
+import logging
+import argparse
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from colorama import init, Fore, Style
 from cryptography.utils import CryptographyDeprecationWarning
 from netmiko import ConnectHandler
+from capture_diff import compare_captures, print_comparison_summary
+from capture_index import record_capture, latest_captures
+from output_search import index_capture, flush_index
+from api_capture import split_commands, capture_api_commands
+from capture_report import CaptureRun, summarize
+from stream_capture import STREAM_COMMANDS, STREAM_MAX_BYTES, STREAM_TIMEOUT, stream_to_file, CaptureLimitExceeded
 
 # Suppress specific warnings
 warnings.filterwarnings("ignore", category=CryptographyDeprecationWarning)
 
+PANORAMA_INSTANCES = ['A46PANORAMA', 'L17PANORAMA']
+
 # Predefined status commands
 STATUS_COMMANDS = [
     "show clock",
@@ -50,8 +63,8 @@ def read_creds():
         print(f"{Fore.RED}Error: {e}{Style.RESET_ALL}")
         sys.exit(1)
 
-def execute_netmiko_commands(host, user, password, key_file, commands, context):
-    prompt=r">"
+def execute_netmiko_commands(host, user, password, key_file, commands, context, timeout=None, progress=None,
+                             max_bytes=STREAM_MAX_BYTES, report=None):
     device = {
         "device_type": "paloalto_panos",  # Adjust this to match your device type
         "host": host,
@@ -60,57 +73,102 @@ def execute_netmiko_commands(host, user, password, key_file, commands, context):
         "key_file": key_file,
         "password": password
     }
+    # Per-host timeout: every command gets whatever is left of the host's budget
+    deadline = time.monotonic() + timeout if timeout else None
+    report = report or CaptureRun("phc", context)
 
+    captured = {}
     try:
-        with ConnectHandler(**device) as net_connect:
-            if "-v" in sys.argv:
-                print(f"Successfully connected to {host}")
-                time.sleep(1)
+        with report.phase(host, "*", "connect"):
+            net_connect = ConnectHandler(**device)
+        with net_connect:
+            logging.debug(f"Successfully connected to {host}")
             # Send configuration commands 
+            output = ""
             try:
-                if "-v" in sys.argv:
-                    print(f"Trying to connect...")
-                net_connect.send_command("set cli scripting-mode on")
-                net_connect.send_command("set cli pager off")
-                output = net_connect.send_command("show clock")
-                if "-v" in sys.argv:
-                    print("Raw output from configuration commands: ")
-                    print(output)  # Print the raw output
+                with report.phase(host, "*", "setup"):
+                    net_connect.send_command("set cli scripting-mode on")
+                    net_connect.send_command("set cli pager off")
+                    output = net_connect.send_command("show clock")
+                    prompt = net_connect.find_prompt()
+                logging.debug(f"Raw output from configuration commands on {host}:\n{output}")
             except Exception as cmd_exception:
-                print("Error sending configuration commands: ")
-                print(cmd_exception)
-                print("Raw output (if any):")
-                print(output)
-                
-            
+                logging.warning(f"Error sending configuration commands to {host}: {cmd_exception}\n"
+                                f"Raw output (if any):\n{output}")
+                prompt = net_connect.find_prompt()
+
             # Send show commands
-            for command in commands:
-                if "-v" in sys.argv:
-                    print(f"Running command '{command}' ...")
+            for index, command in enumerate(commands, start=1):
+                logging.debug(f"Running command '{command}' on {host} ...")
+                if progress:
+                    progress(host, f"{index}/{len(commands)} {command}")
                 output = ""
-                output = net_connect.send_command(command)
-                if "-v" in sys.argv:
-                    print(f"Received {len(output)} bytes")
-                store_output(host, command, output, context)
-
-            # Pause for a few seconds
-            
-            #time.sleep(2)
+                command_start = time.monotonic()
+                remaining = STREAM_TIMEOUT
+                if deadline:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"host timeout of {timeout}s exceeded")
+                if command in STREAM_COMMANDS:
+                    # Write large outputs to disk as they arrive instead of buffering them in send_command
+                    path = capture_path(host, command, context, extension="txt.gz")
+                    with report.phase(host, command, "send"):
+                        net_connect.write_channel(command + "\n")
+                    stats = {}
+                    wait_start = time.monotonic()
+                    try:
+                        received = stream_to_file(net_connect.read_channel, path, command, prompt,
+                                                  max_bytes, min(remaining, STREAM_TIMEOUT), stats)
+                    except CaptureLimitExceeded as e:
+                        report.record(host, command, status="truncated", transport="ssh-stream")
+                        log_error(host, command, f"{e}, partial output in {path}")
+                        net_connect.write_channel("\x03")
+                        net_connect.read_until_pattern(pattern=re.escape(prompt), read_timeout=30)
+                        continue
+                    finally:
+                        report.add_time(host, command, "wait", time.monotonic() - wait_start - stats.get("write", 0.0))
+                        report.add_time(host, command, "write", stats.get("write", 0.0))
+                    logging.debug(f"Streamed {received} bytes from {host}")
+                    report.record(host, command, bytes=received, transport="ssh-stream")
+                    record_capture(host, command, context, path, duration=time.monotonic() - command_start)
+                    index_capture(host, command, context, path)
+                    captured[command] = path
+                    continue
+                # send_command sends and waits for the prompt in one call
+                with report.phase(host, command, "wait"):
+                    if deadline:
+                        output = net_connect.send_command(command, read_timeout=remaining)
+                    else:
+                        output = net_connect.send_command(command)
+                logging.debug(f"Received {len(output)} bytes from {host}")
+                report.record(host, command, bytes=len(output), transport="ssh")
+                with report.phase(host, command, "write"):
+                    captured[command] = store_output(host, command, output, context,
+                                                     duration=time.monotonic() - command_start)
 
     except Exception as e:
-        log_error(host, "multiple commands", error_message)
+        report.record(host, "*", status="error", error=str(e))
+        log_error(host, "multiple commands", str(e))
         print(f"{Fore.RED}Error{Style.RESET_ALL} executing commands on {Fore.CYAN}{host}{Style.RESET_ALL}: {Fore.RED}{e}{Style.RESET_ALL}")
 
-def store_output(host, command, output, context, error=False):
+    return captured
+
+def capture_path(host, command, context, error=False, extension="txt"):
     timestamp = datetime.now().strftime("%m-%d-%y-%H-%M-%S")
     logs_dir = "output"
     host_dir = os.path.join(logs_dir, host)
     os.makedirs(host_dir, exist_ok=True)
     sanitized_cmd = command.replace(" ", "_")
     suffix = "-ERROR" if error else ""
-    log_file_path = os.path.join(host_dir, f"{sanitized_cmd}-{context}-{timestamp}{suffix}.txt")
+    return os.path.join(host_dir, f"{sanitized_cmd}-{context}-{timestamp}{suffix}.{extension}")
+
+def store_output(host, command, output, context, error=False, extension="txt", duration=None):
+    log_file_path = capture_path(host, command, context, error, extension)
     with open(log_file_path, "w") as log_file:
         log_file.write(output)
+    record_capture(host, command, context, log_file_path, duration=duration, error=error)
+    if not error:
+        index_capture(host, command, context, log_file_path)
     return log_file_path
 
 def log_error(host, command, error_message):
@@ -119,67 +177,206 @@ def log_error(host, command, error_message):
     with open(error_log_path, "a") as error_log:
         error_log.write(f"{timestamp} | {host} | {command} | {error_message}\n")
 
-def find_recent_pre_files(host):
-    host_dir = os.path.join("output", host)
-    if not os.path.exists(host_dir):
-        return []
+def find_recent_pre_files(host, commands):
+    # Newest successful pre capture per command, from the capture index
+    return latest_captures(host, commands, context="pre")
 
-    pre_files = [f for f in os.listdir(host_dir) if "-pre-" in f]
-    pre_files.sort(key=lambda x: os.path.getmtime(os.path.join(host_dir, x)), reverse=True)
-    return pre_files
+def load_hosts(args):
+    hosts = list(args.hosts)
+    if args.host_file:
+        with open(args.host_file, 'r') as host_file:
+            hosts.extend(line.strip() for line in host_file if line.strip() and not line.startswith("#"))
+    if args.filter:
+        # Imported lazily: the Panorama helpers pull in the dashboard dependencies
+        from pan_functions import get_active_pan, get_pan_devices
+        active_pan = get_active_pan(PANORAMA_INSTANCES)
+        if not active_pan:
+            print(f"{Fore.RED}Error: No active Panorama found for the inventory filter.{Style.RESET_ALL}")
+            sys.exit(1)
+        pattern = re.compile(args.filter, re.IGNORECASE)
+        hosts.extend(device['hostname'] for device in get_pan_devices(active_pan)
+                     if pattern.search(device['hostname']))
+    # Drop duplicates but keep the order given
+    return list(dict.fromkeys(hosts))
 
-def compare_outputs(pre_file, post_file):
-    # Implement custom comparison logic for each command
-    # Return "pass" or "fail" with detailed comparison results
-    pass
+class ProgressTable:
+    """Live per-host status table, redrawn in place on a terminal."""
 
-def main():
-    init(autoreset=True)  # Initialize colorama
+    def __init__(self, hosts, live=True):
+        self.lock = threading.Lock()
+        self.status = {host: "queued" for host in hosts}
+        self.started = {}
+        self.drawn_lines = 0
+        # Verbose log lines would be drawn over, so they get the plain per-host lines instead
+        self.tty = live and sys.stdout.isatty()
 
-    if len(sys.argv) < 3 or "-c" not in sys.argv:
-        print(f"Syntax: {sys.argv[0]} [-v] -c context hostname\n\n")
-        sys.exit(1)
+    def update(self, host, status):
+        with self.lock:
+            if host not in self.started:
+                self.started[host] = time.monotonic()
+            self.status[host] = status
+            if not self.tty and status in ("pass", "fail", "ok", "error", "timeout"):
+                done = sum(1 for s in self.status.values() if s in ("pass", "fail", "ok", "error", "timeout"))
+                print(f"[{done}/{len(self.status)}] {host}: {status}")
+            self.redraw()
 
-    verbose = "-v" in sys.argv
-    context_index = sys.argv.index("-c") + 1
+    def redraw(self):
+        if not self.tty:
+            return
+        counts = {}
+        for status in self.status.values():
+            state = status if status in ("queued", "pass", "fail", "ok", "error", "timeout") else "running"
+            counts[state] = counts.get(state, 0) + 1
+        lines = ["  ".join(f"{state}: {count}" for state, count in sorted(counts.items()))]
+        now = time.monotonic()
+        for host, status in self.status.items():
+            if status not in ("queued", "pass", "fail", "ok", "error", "timeout"):
+                lines.append(f"  {host:<20} {now - self.started[host]:6.1f}s  {status}")
+        # Move the cursor back over the previous table and clear it before drawing
+        if self.drawn_lines:
+            sys.stdout.write(f"\x1b[{self.drawn_lines}F\x1b[J")
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+        self.drawn_lines = len(lines)
 
-    if context_index >= len(sys.argv) - 1:
-        print("Error: Context and hostname must follow the -c option.")
-        sys.exit(1)
+def capture_host(host, user, password, key_file, context, timeout, progress, use_api, max_bytes, report):
+    # XML API first for every command that has an op form; SSH for the rest and for API failures
+    captured = {}
+    ssh_commands = STATUS_COMMANDS
+    if use_api and password:
+        api_commands, ssh_commands = split_commands(STATUS_COMMANDS)
+        captured, failed = capture_api_commands(host, user, password, api_commands, context, store_output,
+                                                timeout=timeout, progress=progress, report=report)
+        ssh_commands = [command for command in STATUS_COMMANDS if command in ssh_commands or command in failed]
+    if ssh_commands:
+        captured.update(execute_netmiko_commands(host, user, password, key_file, ssh_commands, context,
+                                                 timeout=timeout, progress=progress, max_bytes=max_bytes,
+                                                 report=report))
+    return captured
 
-    context = sys.argv[context_index].lower()
-    fwname = sys.argv[context_index + 1].strip()
+def run_host(host, user, password, key_file, context, timeout, progress, use_api=True,
+             max_bytes=STREAM_MAX_BYTES, report=None):
+    start = time.monotonic()
+    pre_files = {}
+    if context == "post":
+        pre_files = find_recent_pre_files(host, STATUS_COMMANDS)
+        if not pre_files:
+            return {"host": host, "status": "error", "duration": 0.0, "detail": "no pre-change files"}
 
-    if context not in ["pre", "post"]:
-        print("Error: Context must be 'pre' or 'post'.")
-        sys.exit(1)
+    progress(host, "connecting")
+    captured = capture_host(host, user, password, key_file, context, timeout, progress, use_api, max_bytes,
+                            report or CaptureRun("phc", context))
+    duration = time.monotonic() - start
+    result = {"host": host, "status": "ok", "duration": duration,
+              "detail": f"{len(captured)}/{len(STATUS_COMMANDS)} commands"}
+    if len(captured) < len(STATUS_COMMANDS):
+        result["status"] = "timeout" if timeout and duration >= timeout else "error"
+        return result
 
-    user, password, key_file = read_creds()
+    if context == "post":
+        # Check the age of the most recent pre file
+        pre_file_time = datetime.fromisoformat(max(record["captured_at"] for record in pre_files.values()))
+        if datetime.now() - pre_file_time > timedelta(hours=24):
+            result["detail"] += ", pre capture older than 24h"
 
-    if context == "pre":
-        execute_netmiko_commands(fwname, user, password, key_file, STATUS_COMMANDS, context)
+        # Compared by compare_hosts once every capture is done
+        result["pairs"] = [(command, pre_files[command]["path"], post_file_path)
+                           for command, post_file_path in captured.items() if command in pre_files]
+    return result
 
-    elif context == "post":
-        pre_files = find_recent_pre_files(fwname)
-        if not pre_files:
-            print(f"{Fore.YELLOW}Warning: No pre-change files found for {fwname}.{Style.RESET_ALL}")
-            sys.exit(1)
+def compare_hosts(results, progress=None):
+    """Compare the pre/post pairs of every captured host on one process pool.
 
-        # Check the age of the most recent pre file
-        most_recent_pre_file = pre_files[0]
-        pre_file_path = os.path.join("output", fwname, most_recent_pre_file)
-        pre_file_time = datetime.fromtimestamp(os.path.getmtime(pre_file_path))
-        if datetime.now() - pre_file_time > timedelta(hours=24):
-            print(f"{Fore.YELLOW}Warning: The most recent pre-change file for {fwname} is more than 24 hours old.{Style.RESET_ALL}")
+    Runs from the main thread after the capture threads have finished, so the
+    pool never forks while another thread holds a lock.
+    """
+    pending = [result for result in results if "pairs" in result]
+    if not pending:
+        return
+    flush_index()
+    comparisons = iter(compare_captures([pair for result in pending for pair in result["pairs"]]))
+    for result in pending:
+        result["comparison"] = [next(comparisons) for _ in result.pop("pairs")]
+        failed = [r["command"] for r in result["comparison"] if r["status"] == "fail"]
+        result["status"] = "fail" if failed else "pass"
+        if failed:
+            result["detail"] += f", failed: {', '.join(failed)}"
+        if progress:
+            progress(result["host"], result["status"])
+
+def print_host_summary(results):
+    colors = {"ok": Fore.GREEN, "pass": Fore.GREEN, "fail": Fore.RED, "error": Fore.RED, "timeout": Fore.YELLOW}
+    print(f"\n{'host':<20} {'status':<8} {'duration':>9}  detail")
+    for result in sorted(results, key=lambda r: r["host"]):
+        color = colors.get(result["status"], "")
+        print(f"{result['host']:<20} {color}{result['status']:<8}{Style.RESET_ALL} "
+              f"{result['duration']:8.1f}s  {result['detail']}")
+    bad = sum(1 for r in results if r["status"] not in ("ok", "pass"))
+    print(f"\n{len(results) - bad}/{len(results)} hosts succeeded")
+    return bad == 0
+
+def main():
+    init(autoreset=True)  # Initialize colorama
+
+    parser = argparse.ArgumentParser(description="Pre/post change health capture for one or more firewalls.")
+    parser.add_argument('hosts', nargs='*', help="Firewall hostnames")
+    parser.add_argument('-c', '--context', required=True, type=str.lower, choices=["pre", "post"],
+                        help="Capture context")
+    parser.add_argument('-f', '--host-file', help="File with one hostname per line")
+    parser.add_argument('--filter', help="Regex over Panorama connected-device hostnames")
+    parser.add_argument('-w', '--workers', type=int, default=20, help="Concurrent SSH sessions")
+    parser.add_argument('-t', '--timeout', type=int, default=900, help="Per-host timeout in seconds")
+    parser.add_argument('--max-mb', type=int, default=STREAM_MAX_BYTES // (1024 * 1024),
+                        help="Byte limit (MB) for each streamed capture")
+    parser.add_argument('--ssh-only', action='store_true', help="Capture everything over SSH instead of the XML API")
+    parser.add_argument('--timings', action='store_true', help="Print the per-command timing summary")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Verbose output")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    hosts = load_hosts(args)
+    if not hosts:
+        parser.error("no hosts given; pass hostnames, -f host file or --filter")
+
+    user, password, key_file = read_creds()
+
+    report = CaptureRun("phc", args.context)
+    max_bytes = args.max_mb * 1024 * 1024
 
-        execute_netmiko_commands(fwname, user, password, key_file, STATUS_COMMANDS, context)
+    if len(hosts) == 1:
+        # Single host keeps the original, detailed per-command output
+        result = run_host(hosts[0], user, password, key_file, args.context, args.timeout,
+                          lambda host, status: None, not args.ssh_only, max_bytes, report)
+        compare_hosts([result])
+        if "comparison" in result:
+            print_comparison_summary(hosts[0], result["comparison"], args.verbose)
+        results = [result]
+    else:
+        progress = ProgressTable(hosts, live=not args.verbose)
+        results = []
+        with ThreadPoolExecutor(max_workers=min(args.workers, len(hosts))) as executor:
+            futures = {executor.submit(run_host, host, user, password, key_file, args.context,
+                                       args.timeout, progress.update, not args.ssh_only,
+                                       max_bytes, report): host for host in hosts}
+            for future in as_completed(futures):
+                host = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log_error(host, "run_host", str(e))
+                    result = {"host": host, "status": "error", "duration": 0.0, "detail": str(e)}
+                progress.update(host, "comparing" if "pairs" in result else result["status"])
+                results.append(result)
+        compare_hosts(results, progress.update)
 
-        for command in STATUS_COMMANDS:
-            post_file_path = os.path.join("output", fwname, f"{command.replace(' ', '_')}-{context}-{datetime.now().strftime('%m-%d-%y-%H-%M-%S')}.txt")
-            pre_file = next((f for f in pre_files if command.replace(' ', '_') in f), None)
-            if pre_file:
-                pre_file_path = os.path.join("output", fwname, pre_file)
-                compare_outputs(pre_file_path, post_file_path)
+    succeeded = print_host_summary(results)
+    report_path = report.save()
+    if args.timings:
+        print()
+        summarize([report.report])
+    print(f"Timing report written to {report_path}")
+    sys.exit(0 if succeeded else 2)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+import sys
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from xml.etree import ElementTree as ET
+import numpy as np
+import requests
+import urllib3
+from sqlalchemy import func, select
+from db_connect import create_db_engine, bulk_load
+from health_rollup import ensure_partitions, drop_expired, floor_time
+from schema import Device, ResourceMonitorMinute, ResourceMonitorHour, ResourceMonitorDay
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Without a period the command returns every period it keeps in one response
+RESOURCE_MONITOR_COMMAND = "<show><running><resource-monitor></resource-monitor></running></show>"
+
+# PAN-OS keeps 60 minutes, 24 hours and 7 days of history; polling well inside
+# the minute window means no minute sample is ever missed. Its per-second series
+# only covers the last 60 seconds, so keeping it would take a full fetch from
+# every firewall each minute; it is not stored, and minutes are the finest
+# resolution here.
+RESOLUTIONS = {
+    "minute": {"model": ResourceMonitorMinute, "seconds": 60, "retention_days": 7, "partition": "day"},
+    "hour": {"model": ResourceMonitorHour, "seconds": 3600, "retention_days": 180, "partition": "month"},
+    "day": {"model": ResourceMonitorDay, "seconds": 86400, "retention_days": 1825, "partition": "month"},
+}
+POLL_INTERVAL = 1800
+# Polls start this many seconds into a minute, away from the period boundaries
+POLL_OFFSET = 30
+# Seconds after a boundary during which the device may not have published the
+# period yet (publishing delay plus clock skew between poller and firewall)
+ALIGN_MARGIN = 15
+FETCH_WORKERS = 16
+FETCH_TIMEOUT = 60
+
+CPU_GROUPS = {"cpu-load-average": "cpu_avg", "cpu-load-maximum": "cpu_max"}
+
+
+def metric_name(name):
+    # "packet buffer (maximum)" -> "packet_buffer_max"
+    name = name.strip().lower().replace("(average)", "avg").replace("(maximum)", "max")
+    return "_".join(name.replace("(", " ").replace(")", " ").replace("-", " ").split())
+
+
+def parse_values(text):
+    # Comma-separated, newest sample first
+    if not text or not text.strip():
+        return np.empty(0)
+    return np.array([float(value) if value.strip() else np.nan for value in text.split(",")])
+
+
+def parse_resource_monitor(result):
+    """Return {period: {(dp, metric, core): values}} from a resource-monitor <result>.
+
+    CPU metrics are per core; resource-utilization metrics (packet buffers,
+    descriptors, sessions) are dataplane-wide and get core -1.
+    """
+    series = {}
+    for dp in result.iterfind(".//data-processors/*"):
+        for period in dp:
+            target = series.setdefault(period.tag, {})
+            for group, metric in CPU_GROUPS.items():
+                for entry in period.iterfind(f"{group}/entry"):
+                    target[(dp.tag, metric, int(entry.findtext("coreid", "-1")))] = parse_values(entry.findtext("value"))
+            for entry in period.iterfind("resource-utilization/entry"):
+                target[(dp.tag, metric_name(entry.findtext("name", "")), -1)] = parse_values(entry.findtext("value"))
+    return series
+
+
+def sample_anchor(started_at, fetched_at, seconds, margin=ALIGN_MARGIN):
+    """End of the newest period the device has published, or None if the fetch was too close to a boundary.
+
+    The output has no timestamps, so the samples are placed from the time of the
+    fetch. When a boundary falls between started_at - margin and fetched_at the
+    newest sample may be either side of it, and the fetch cannot be placed.
+    """
+    anchor = floor_time(fetched_at, seconds)
+    if floor_time(started_at - timedelta(seconds=margin), seconds) != anchor:
+        return None
+    return anchor
+
+
+def sample_rows(hostname, series, seconds, anchor, after=None):
+    """Rows for samples newer than `after`.
+
+    Sample i (0 = newest) covers the i-th complete period before anchor (see
+    sample_anchor), and is stamped with the period start.
+    """
+    keys = [key for key, values in series.items() if len(values)]
+    if not keys:
+        return []
+    length = max(len(series[key]) for key in keys)
+    # One (series x samples) matrix, NaN-padded where a series is shorter
+    matrix = np.full((len(keys), length), np.nan)
+    for row, key in enumerate(keys):
+        matrix[row, :len(series[key])] = series[key]
+    anchor = np.datetime64(anchor, "s")
+    timestamps = anchor - np.arange(1, length + 1) * np.timedelta64(seconds, "s")
+    wanted = ~np.isnan(matrix)
+    if after is not None:
+        wanted &= (timestamps > np.datetime64(after, "s"))[np.newaxis, :]
+    rows, columns = np.nonzero(wanted)
+    times = timestamps.tolist()
+    return [{"hostname": hostname, "timestamp": times[column], "dp": keys[row][0], "metric": keys[row][1],
+             "core": keys[row][2], "value": float(matrix[row, column])}
+            for row, column in zip(rows.tolist(), columns.tolist())]
+
+
+def fetch_resource_monitor(device, api_key, timeout=FETCH_TIMEOUT):
+    """Fetch a device's resource-monitor history; returns the <result> element or None."""
+    host = device.mgmt_ip or device.hostname
+    try:
+        response = requests.get(f"https://{host}/api/", params={'type': 'op', 'cmd': RESOURCE_MONITOR_COMMAND},
+                                headers={'X-PAN-KEY': api_key}, verify=False, timeout=timeout)
+        response.raise_for_status()
+        root = ET.fromstring(response.content)
+        if root.get("status") != "success":
+            raise RuntimeError(f"API returned status {root.get('status')}")
+        return root.find("result")
+    except (requests.RequestException, ET.ParseError, RuntimeError) as e:
+        logging.error(f"Resource monitor fetch from {device.hostname} ({host}) failed: {e}")
+        return None
+
+
+def timed_fetch(device, api_key):
+    # The fetch window, taken in the worker, places the samples (see sample_anchor)
+    started_at = datetime.now()
+    result = fetch_resource_monitor(device, api_key)
+    return started_at, result, datetime.now()
+
+
+def last_stored(engine, resolutions=tuple(RESOLUTIONS)):
+    """Return {(resolution, hostname): newest stored timestamp}."""
+    last = {}
+    with engine.connect() as conn:
+        for resolution in resolutions:
+            model = RESOLUTIONS[resolution]["model"]
+            # (hostname, timestamp) leads the primary key, so this is a loose index scan
+            for hostname, newest in conn.execute(select(model.hostname, func.max(model.timestamp))
+                                                 .group_by(model.hostname)):
+                last[(resolution, hostname)] = newest
+    return last
+
+
+def store_samples(conn, resolution, rows):
+    # IGNORE makes a re-sent sample (e.g. after a clock step) a no-op
+    bulk_load(conn, RESOLUTIONS[resolution]["model"].__table__, rows, mode="ignore")
+
+
+def collect(engine, api_key, last, resolutions=tuple(RESOLUTIONS), hosts=None, workers=FETCH_WORKERS):
+    """Fetch every device once and store the samples newer than `last`, which is updated in place."""
+    with engine.connect() as conn:
+        query = select(Device.hostname, Device.mgmt_ip).where(Device.removed_at.is_(None))
+        if hosts:
+            query = query.where(Device.hostname.in_(hosts))
+        devices = conn.execute(query).all()
+
+    stored = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(timed_fetch, device, api_key): device for device in devices}
+        for future in as_completed(futures):
+            device = futures[future]
+            started_at, result, fetched_at = future.result()
+            if result is None:
+                continue
+            series = parse_resource_monitor(result)
+            with engine.begin() as conn:
+                for resolution in resolutions:
+                    seconds = RESOLUTIONS[resolution]["seconds"]
+                    anchor = sample_anchor(started_at, fetched_at, seconds)
+                    if anchor is None:
+                        # Stored rows are never corrected (IGNORE), so a guess could stay wrong;
+                        # the next poll still has these samples
+                        logging.info(f"{device.hostname}: fetch too close to a {resolution} boundary, "
+                                     f"not storing {resolution} samples this poll")
+                        continue
+                    rows = sample_rows(device.hostname, series.get(resolution, {}), seconds, anchor,
+                                       last.get((resolution, device.hostname)))
+                    if not rows:
+                        continue
+                    store_samples(conn, resolution, rows)
+                    last[(resolution, device.hostname)] = max(row["timestamp"] for row in rows)
+                    stored += len(rows)
+    return len(devices), stored
+
+
+def maintain_partitions(engine, resolutions=tuple(RESOLUTIONS)):
+    with engine.begin() as conn:
+        for resolution in resolutions:
+            spec = RESOLUTIONS[resolution]
+            table = spec["model"].__tablename__
+            ensure_partitions(conn, table, spec["partition"])
+            drop_expired(conn, table, spec["retention_days"])
+
+
+def load_history(hostname, resolution, metric, start, end, dp="dp0", engine=None):
+    """Return {core: (timestamps, values)} as NumPy arrays for one host's metric."""
+    model = RESOLUTIONS[resolution]["model"]
+    engine = engine or create_db_engine()
+    with engine.connect() as conn:
+        rows = conn.execute(select(model.core, model.timestamp, model.value)
+                            .where(model.hostname == hostname, model.dp == dp, model.metric == metric,
+                                   model.timestamp >= start, model.timestamp < end)
+                            .order_by(model.core, model.timestamp)).all()
+    history = {}
+    if rows:
+        cores = np.array([row.core for row in rows])
+        timestamps = np.array([row.timestamp for row in rows], dtype="datetime64[s]")
+        values = np.array([row.value for row in rows])
+        for core in np.unique(cores).tolist():
+            mask = cores == core
+            history[core] = (timestamps[mask], values[mask])
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect dataplane resource-monitor history from the firewalls.")
+    parser.add_argument('--loop', action='store_true', help=f"Collect every {POLL_INTERVAL}s")
+    parser.add_argument('--hosts', nargs='*', help="Only these firewalls")
+    parser.add_argument('-r', '--resolution', choices=list(RESOLUTIONS), action='append',
+                        help="Periods to store (default all)")
+    parser.add_argument('-w', '--workers', type=int, default=FETCH_WORKERS, help="Concurrent device fetches")
+    parser.add_argument('--allow-panorama-key', action='store_true',
+                        help="Use the Panorama API key if the firewall key file is missing")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    # Imported lazily: the Panorama helpers pull in the dashboard dependencies
+    from pan_functions import read_firewall_api_key
+    try:
+        api_key = read_firewall_api_key(args.allow_panorama_key)
+    except FileNotFoundError as e:
+        sys.exit(f"{e} Create it, or pass --allow-panorama-key to use the Panorama key.")
+    engine = create_db_engine()
+    resolutions = tuple(args.resolution or RESOLUTIONS)
+    maintain_partitions(engine, resolutions)
+    last = last_stored(engine, resolutions)
+    maintained = datetime.now().date()
+    while True:
+        cycle_start = time.monotonic()
+        devices, stored = collect(engine, api_key, last, resolutions, args.hosts, args.workers)
+        print(f"Polled {devices} devices, stored {stored} new samples in {time.monotonic() - cycle_start:.0f}s")
+        if not args.loop:
+            break
+        if datetime.now().date() != maintained:
+            maintain_partitions(engine, resolutions)
+            maintained = datetime.now().date()
+        delay = max(0, POLL_INTERVAL - (time.monotonic() - cycle_start))
+        time.sleep(delay + (POLL_OFFSET - (time.time() + delay)) % 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+#!/usr/bin/python3
+import sys
+import argparse
+import ipaddress
+from concurrent.futures import ProcessPoolExecutor
+from capture_diff import parse_capture
+from capture_index import latest_for_command
+
+ROUTE_COMMANDS = (
+    "show routing route",
+    "show routing protocol bgp loc-rib",
+    "show routing protocol bgp rib-out",
+)
+
+
+class Node:
+    # Glue nodes created by a split carry value None
+    __slots__ = ("key", "length", "value", "left", "right", "digest")
+
+    def __init__(self, key, length, value=None):
+        self.key = key
+        self.length = length
+        self.value = value
+        self.left = None
+        self.right = None
+        self.digest = None
+
+
+def _bit(key, index, width):
+    return (key >> (width - 1 - index)) & 1
+
+
+def _common(key_a, len_a, key_b, len_b, width):
+    # Number of leading bits two prefixes share, capped at the shorter length
+    limit = min(len_a, len_b)
+    diff = key_a ^ key_b
+    if not diff:
+        return limit
+    return min(width - diff.bit_length(), limit)
+
+
+def _mask(key, length, width):
+    return key & (((1 << length) - 1) << (width - length)) if length else 0
+
+
+class RadixTree:
+    """Path-compressed binary (Patricia) trie over one address family.
+
+    Keys are (network int, prefix length). Each stored prefix holds one value;
+    subtree digests let diff() skip identical branches of two trees.
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self.root = None
+        self.size = 0
+        self.frozen = False
+
+    def _child(self, node, side):
+        return node.right if side else node.left
+
+    def _set_child(self, parent, side, child):
+        if parent is None:
+            self.root = child
+        elif side:
+            parent.right = child
+        else:
+            parent.left = child
+
+    def insert(self, key, length, value):
+        width = self.width
+        key = _mask(key, length, width)
+        self.frozen = False
+        parent, side = None, 0
+        node = self.root
+        while node is not None:
+            common = _common(key, length, node.key, node.length, width)
+            if common == node.length == length:
+                if node.value is None:
+                    self.size += 1
+                node.value = value
+                return
+            if common == node.length:
+                parent, side = node, _bit(key, node.length, width)
+                node = self._child(node, side)
+                continue
+            new = Node(key, length, value)
+            if common == length:
+                # The new prefix covers the existing node
+                self._set_child(new, _bit(node.key, length, width), node)
+                self._set_child(parent, side, new)
+            else:
+                glue = Node(_mask(key, common, width), common)
+                self._set_child(glue, _bit(key, common, width), new)
+                self._set_child(glue, _bit(node.key, common, width), node)
+                self._set_child(parent, side, glue)
+            self.size += 1
+            return
+        self._set_child(parent, side, Node(key, length, value))
+        self.size += 1
+
+    def _walk_towards(self, key, length):
+        # Yields the nodes on the path towards (key, length) that contain it
+        width = self.width
+        node = self.root
+        while node is not None and node.length <= length:
+            if _common(key, length, node.key, node.length, width) < node.length:
+                return
+            yield node
+            if node.length == width:
+                return
+            node = self._child(node, _bit(key, node.length, width))
+
+    def longest_match(self, key, length=None):
+        best = None
+        for node in self._walk_towards(key, self.width if length is None else length):
+            if node.value is not None:
+                best = node
+        return best
+
+    def covering(self, key, length):
+        return [node for node in self._walk_towards(key, length) if node.value is not None]
+
+    def covered(self, key, length):
+        width = self.width
+        key = _mask(key, length, width)
+        node = self.root
+        while node is not None and node.length < length:
+            if _common(key, length, node.key, node.length, width) < node.length:
+                return []
+            node = self._child(node, _bit(key, node.length, width))
+        if node is None or _common(key, length, node.key, node.length, width) < length:
+            return []
+        return list(self._iter(node))
+
+    def _iter(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if node.value is not None:
+                yield node
+            stack.append(node.right)
+            stack.append(node.left)
+
+    def __iter__(self):
+        return self._iter(self.root)
+
+    def __len__(self):
+        return self.size
+
+    def freeze(self):
+        # Bottom-up subtree digests, iteratively (post-order)
+        stack = [(self.root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if node is None:
+                continue
+            if children_done:
+                node.digest = hash((node.key, node.length, node.value,
+                                    node.left.digest if node.left else None,
+                                    node.right.digest if node.right else None))
+            else:
+                stack.append((node, True))
+                stack.append((node.left, False))
+                stack.append((node.right, False))
+        self.frozen = True
+
+    def diff(self, other):
+        """Return (added, removed, changed) lists of (key, length) going from self to other."""
+        for tree in (self, other):
+            if not tree.frozen:
+                tree.freeze()
+        added, removed, changed = [], [], []
+        stack = [(self.root, other.root)]
+        while stack:
+            a, b = stack.pop()
+            if a is None and b is None:
+                continue
+            if a is not None and b is not None and a.key == b.key and a.length == b.length:
+                if a.digest == b.digest:
+                    continue
+                if a.value != b.value:
+                    if a.value is None:
+                        added.append((b.key, b.length))
+                    elif b.value is None:
+                        removed.append((a.key, a.length))
+                    else:
+                        changed.append((a.key, a.length))
+                stack.append((a.left, b.left))
+                stack.append((a.right, b.right))
+                continue
+            # The trees branch differently here; compare the two subtrees as sets
+            left = {(node.key, node.length): node.value for node in self._iter(a)}
+            right = {(node.key, node.length): node.value for node in other._iter(b)}
+            added.extend(right.keys() - left.keys())
+            removed.extend(left.keys() - right.keys())
+            changed.extend(k for k in left.keys() & right.keys() if left[k] != right[k])
+        return added, removed, changed
+
+
+class RouteTable:
+    """One device's routes: a radix tree per (virtual router, address family)."""
+
+    def __init__(self, host=None):
+        self.host = host
+        self.trees = {}
+
+    def tree(self, vr, version):
+        key = (vr, version)
+        if key not in self.trees:
+            self.trees[key] = RadixTree(32 if version == 4 else 128)
+        return self.trees[key]
+
+    def load_records(self, records):
+        # records: {(vr, prefix, nexthop): attrs} as produced by the capture_diff parsers
+        by_prefix = {}
+        for (vr, prefix, nexthop), attrs in records.items():
+            by_prefix.setdefault((vr, prefix), []).append((nexthop, attrs))
+        for (vr, prefix), nexthops in by_prefix.items():
+            try:
+                network = ipaddress.ip_network(prefix, strict=False)
+            except ValueError:
+                continue
+            self.tree(vr, network.version).insert(int(network.network_address), network.prefixlen,
+                                                  tuple(sorted(nexthops)))
+        return self
+
+    def lookup(self, address, vr=None):
+        """Longest-prefix match for an address (or prefix) in every matching VR."""
+        network = ipaddress.ip_network(address, strict=False)
+        results = []
+        for (tree_vr, version), tree in self.trees.items():
+            if version != network.version or (vr and tree_vr != vr):
+                continue
+            node = tree.longest_match(int(network.network_address), network.prefixlen)
+            if node:
+                results.append((tree_vr, format_prefix(node, version), node.value))
+        return results
+
+    def covering(self, prefix, vr=None):
+        return self._query(prefix, vr, "covering")
+
+    def covered(self, prefix, vr=None):
+        return self._query(prefix, vr, "covered")
+
+    def _query(self, prefix, vr, method):
+        network = ipaddress.ip_network(prefix, strict=False)
+        results = []
+        for (tree_vr, version), tree in self.trees.items():
+            if version != network.version or (vr and tree_vr != vr):
+                continue
+            for node in getattr(tree, method)(int(network.network_address), network.prefixlen):
+                results.append((tree_vr, format_prefix(node, version), node.value))
+        return results
+
+    def diff(self, other):
+        """Per (vr, family) diff from this table to other, as prefix strings."""
+        result = {}
+        for key in set(self.trees) | set(other.trees):
+            vr, version = key
+            width = 32 if version == 4 else 128
+            mine = self.trees.get(key) or RadixTree(width)
+            theirs = other.trees.get(key) or RadixTree(width)
+            added, removed, changed = mine.diff(theirs)
+            if added or removed or changed:
+                result[key] = {name: [format_prefix(Node(k, l), version) for k, l in prefixes]
+                               for name, prefixes in (("added", added), ("removed", removed), ("changed", changed))}
+        return result
+
+
+def format_prefix(node, version):
+    address = ipaddress.IPv4Address(node.key) if version == 4 else ipaddress.IPv6Address(node.key)
+    return f"{address}/{node.length}"
+
+
+def load_capture(path, command="show routing route", host=None):
+    return RouteTable(host).load_records(parse_capture(command, path))
+
+
+def diff_captures(pre_file, post_file, command="show routing route"):
+    return load_capture(pre_file, command).diff(load_capture(post_file, command))
+
+
+def _parse_for_fleet(item):
+    host, path, command = item
+    try:
+        return host, parse_capture(command, path)
+    except (OSError, ValueError) as e:
+        return host, e
+
+
+def load_fleet(command="show routing route", hosts=None, max_workers=None):
+    """Build a RouteTable per host from each host's newest indexed capture of command."""
+    records = latest_for_command(command, hosts)
+    items = [(record["host"], record["path"], command) for record in records]
+    tables = {}
+    # Text parsing is the expensive part, so it runs on a process pool; the trees are built here
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for host, parsed in executor.map(_parse_for_fleet, items, chunksize=8):
+            if isinstance(parsed, Exception):
+                print(f"Skipping {host}: {parsed}", file=sys.stderr)
+                continue
+            tables[host] = RouteTable(host).load_records(parsed)
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and diff routing tables from captured outputs.")
+    parser.add_argument('query', choices=["lookup", "covering", "covered", "diff"])
+    parser.add_argument('target', help="Address/prefix for queries, or the pre capture file for diff")
+    parser.add_argument('post_file', nargs='?', help="Post capture file (diff only)")
+    parser.add_argument('--command', default="show routing route", choices=ROUTE_COMMANDS)
+    parser.add_argument('--hosts', nargs='*', help="Limit the fleet to these hosts")
+    parser.add_argument('--vr', help="Only this virtual router")
+    args = parser.parse_args()
+
+    if args.query == "diff":
+        if not args.post_file:
+            parser.error("diff needs a pre and a post capture file")
+        for (vr, version), changes in sorted(diff_captures(args.target, args.post_file, args.command).items()):
+            print(f"{vr} IPv{version}: +{len(changes['added'])} -{len(changes['removed'])} ~{len(changes['changed'])}")
+            for name, sign in (("removed", "-"), ("added", "+"), ("changed", "~")):
+                for prefix in changes[name]:
+                    print(f"  {sign} {prefix}")
+        return
+
+    tables = load_fleet(args.command, args.hosts)
+    for host, table in sorted(tables.items()):
+        for vr, prefix, nexthops in getattr(table, args.query)(args.target, args.vr):
+            print(f"{host:<20} {vr:<12} {prefix:<40} {', '.join(nexthop for nexthop, _ in nexthops)}")
+
+
+if __name__ == "__main__":
+    main()
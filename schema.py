@@ -1,8 +1,11 @@
 import argparse
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Enum
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, DateTime, Boolean, ForeignKey, Enum, Index, DDL, event
+from sqlalchemy import VARBINARY
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from db_connect import create_db_engine
+from address_utils import ip_to_bytes, bytes_to_ip, mac_to_int, int_to_mac
 
 Base = declarative_base()
 
@@ -10,12 +13,94 @@ Base = declarative_base()
 BUEnum = Enum('retail', 'corp', name='bu_enum')
 LifecycleEnum = Enum('prod', 'dev', 'stage', name='lifecycle_enum')
 
+# ARP IPs and MACs are stored as text, or as VARBINARY(16) and 48-bit integers
+# once migrate_arp_keys.py has converted the tables. create_db_engine() reads
+# which from the live arp_entries columns and keeps it on the engine's dialect,
+# so there is no setting to keep in step with the database. Other engines, and
+# new tables, use text.
+def compact_arp_keys(bind):
+    """Whether the engine (or connection) stores packed ARP keys."""
+    return _compact(bind.dialect)
+
+def _compact(dialect):
+    return getattr(dialect, 'compact_arp_keys', False)
+
+class PackedIP(TypeDecorator):
+    """IP address stored as INET6_ATON() bytes; reads back as its canonical string."""
+    impl = VARBINARY(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        return ip_to_bytes(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else bytes_to_ip(value)
+
+class PackedMAC(TypeDecorator):
+    """MAC address stored as a 48-bit integer; reads back as aa:bb:cc:dd:ee:ff."""
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        return mac_to_int(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else int_to_mac(value)
+
+class ArpIP(TypeDecorator):
+    """ARP IP column: text (IPv4 and IPv6), or PackedIP's bytes on converted tables."""
+    impl = String(40)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(PackedIP.impl if _compact(dialect) else String(40))
+
+    def process_bind_param(self, value, dialect):
+        if _compact(dialect):
+            return PackedIP().process_bind_param(value, dialect)
+        return bytes_to_ip(value) if isinstance(value, bytes) else value
+
+    def process_result_value(self, value, dialect):
+        return bytes_to_ip(value) if isinstance(value, (bytes, bytearray)) else value
+
+class ArpMAC(TypeDecorator):
+    """ARP MAC column: text, or PackedMAC's integer on converted tables."""
+    impl = String(17)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(BigInteger() if _compact(dialect) else String(17))
+
+    def process_bind_param(self, value, dialect):
+        if _compact(dialect):
+            return PackedMAC().process_bind_param(value, dialect)
+        return int_to_mac(value) if isinstance(value, int) else value
+
+    def process_result_value(self, value, dialect):
+        return int_to_mac(value) if isinstance(value, int) else value
+
+# Health tables are range-partitioned on TO_DAYS of their time column. MySQL
+# needs that column in every unique key and allows no foreign keys on
+# partitioned tables, so hostname is not a FK here. The tables are created with
+# a single catch-all partition; health_rollup.py adds and drops the real ones.
+def partition_by_day(table, column):
+    event.listen(table, "after_create", DDL(
+        f"ALTER TABLE {table.name} PARTITION BY RANGE (TO_DAYS({column})) "
+        f"(PARTITION pmax VALUES LESS THAN MAXVALUE)").execute_if(dialect="mysql"))
+
 class FirewallHealth(Base):
     __tablename__ = 'firewall_health'
+    __table_args__ = (
+        Index('ix_firewall_health_hostname_timestamp', 'hostname', 'timestamp'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    hostname = Column(String(30), ForeignKey('devices.hostname'), nullable=False)
-    timestamp = Column(DateTime, nullable=False)
+    hostname = Column(String(30), nullable=False)
+    timestamp = Column(DateTime, primary_key=True, nullable=False)
     cpu_usage = Column(Float)
     memory_used = Column(Float)
     memory_free = Column(Float)
@@ -30,14 +115,21 @@ class FirewallHealth(Base):
     packet_loss = Column(Float)
 
     # Establish a relationship with Device
-    device = relationship("Device", back_populates="health_records")
+    device = relationship("Device", back_populates="health_records",
+                          primaryjoin="foreign(FirewallHealth.hostname) == Device.hostname")
+
+partition_by_day(FirewallHealth.__table__, 'timestamp')
+
+# The metric columns of firewall_health, which the rollup tiers aggregate
+HEALTH_METRICS = [column.name for column in FirewallHealth.__table__.columns
+                  if column.name not in ('id', 'hostname', 'timestamp')]
 
 class Device(Base):
     __tablename__ = 'devices'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     hostname = Column(String(30), nullable=False, unique=True)  # Ensure hostname is unique
-    mgmt_ip = Column(String(40), nullable=False)  # Supports IPv4 and IPv6
+    mgmt_ip = Column(String(40))  # Supports IPv4 and IPv6; NULL when Panorama reports none
     serial_number = Column(String(30), nullable=False)
     mac_address = Column(String(17), nullable=False)
     lat_long = Column(String(50))  # Latitude and Longitude as a string
@@ -48,9 +140,12 @@ class Device(Base):
     ha = Column(Boolean, default=False)  # High Availability
     ha_partner = Column(String(30))
     interface_ips = Column(String(255))  # Comma-separated list of IPs
+    content_hash = Column(String(40))  # Hash of the Panorama inventory fields, set by inventory_sync
+    removed_at = Column(DateTime)  # When the device dropped out of the Panorama inventory
 
     # Establish a relationship with FirewallHealth
-    health_records = relationship("FirewallHealth", back_populates="device")
+    health_records = relationship("FirewallHealth", back_populates="device",
+                                  primaryjoin="foreign(FirewallHealth.hostname) == Device.hostname")
 
 class Thresholds(Base):
     __tablename__ = 'thresholds'
@@ -86,8 +181,8 @@ class ARPEntry(Base):
     __tablename__ = 'arp_entries'
     
     device_id = Column(Integer, ForeignKey('devices.id'), primary_key=True)
-    ip_address = Column(String(40), primary_key=True)  # Supports IPv4 and IPv6
-    mac_address = Column(String(17), primary_key=True)
+    ip_address = Column(ArpIP(), primary_key=True)
+    mac_address = Column(ArpMAC(), primary_key=True)
     timestamp = Column(DateTime, nullable=False)
     status = Column(String(10), nullable=False)  # "online" or "offline"
 
@@ -96,13 +191,88 @@ class ARPHistory(Base):
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     device_id = Column(Integer, ForeignKey('devices.id'), nullable=False)
-    ip_address = Column(String(40), nullable=False)
-    mac_address = Column(String(17), nullable=False)
+    ip_address = Column(ArpIP(), nullable=False)
+    mac_address = Column(ArpMAC(), nullable=False)
     timestamp = Column(DateTime, nullable=False)
     status = Column(String(10), nullable=False)  # "online" or "offline"
 
-def setup_database(drop_tables=False):
-    engine = create_db_engine()
+class HealthRollup:
+    # One row per host, metric and bucket; the primary key serves
+    # "metric X for host Y between A and B" directly
+    hostname = Column(String(30), primary_key=True)
+    metric = Column(String(30), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    samples = Column(Integer, nullable=False)
+    min_value = Column(Float)
+    avg_value = Column(Float)
+    max_value = Column(Float)
+    p95_value = Column(Float)
+
+class HealthRollup1m(HealthRollup, Base):
+    __tablename__ = 'health_rollup_1m'
+
+class HealthRollup1h(HealthRollup, Base):
+    __tablename__ = 'health_rollup_1h'
+
+class HealthRollup1d(HealthRollup, Base):
+    __tablename__ = 'health_rollup_1d'
+
+for rollup_table in (HealthRollup1m.__table__, HealthRollup1h.__table__, HealthRollup1d.__table__):
+    partition_by_day(rollup_table, 'bucket')
+
+class ResourceMonitorSample:
+    # Dataplane history from "show running resource-monitor", one table per
+    # resolution like the rollup tiers. One row per sample of a metric, per
+    # core for the CPU metrics (core -1 for dataplane-wide metrics).
+    hostname = Column(String(30), primary_key=True)
+    timestamp = Column(DateTime, primary_key=True)
+    dp = Column(String(8), primary_key=True)
+    metric = Column(String(40), primary_key=True)
+    core = Column(Integer, primary_key=True, autoincrement=False)
+    value = Column(Float, nullable=False)
+
+class ResourceMonitorMinute(ResourceMonitorSample, Base):
+    __tablename__ = 'resource_monitor_minute'
+
+class ResourceMonitorHour(ResourceMonitorSample, Base):
+    __tablename__ = 'resource_monitor_hour'
+
+class ResourceMonitorDay(ResourceMonitorSample, Base):
+    __tablename__ = 'resource_monitor_day'
+
+for resource_table in (ResourceMonitorMinute.__table__, ResourceMonitorHour.__table__, ResourceMonitorDay.__table__):
+    partition_by_day(resource_table, 'timestamp')
+
+class CaptureFile(Base):
+    # One row per capture/log file imported by backfill_importer.py; path, size
+    # and mtime_ns tell a re-run which files are new or rewritten
+    __tablename__ = 'capture_files'
+    __table_args__ = (
+        Index('ix_capture_files_host_command', 'host', 'command', 'captured_at'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    host = Column(String(30), nullable=False)
+    command = Column(String(100), nullable=False)
+    context = Column(String(10))  # "pre"/"post", or None for logs/ files
+    captured_at = Column(DateTime, nullable=False)
+    path = Column(String(255), nullable=False, unique=True)
+    size = Column(BigInteger, nullable=False)
+    mtime_ns = Column(BigInteger, nullable=False)  # st_mtime_ns; a MySQL FLOAT cannot hold st_mtime exactly
+    records = Column(Integer, nullable=False, default=0)
+    error = Column(String(255))  # Why the file could not be parsed
+    imported_at = Column(DateTime, nullable=False)
+
+class CaptureRecord(Base):
+    # The parsed records of a capture, as capture_diff's parsers produce them
+    __tablename__ = 'capture_records'
+
+    capture_id = Column(Integer, ForeignKey('capture_files.id', ondelete='CASCADE'), primary_key=True)
+    record_key = Column(String(255), primary_key=True)
+    value = Column(String(255))
+
+def setup_database(drop_tables=False, engine=None):
+    engine = engine or create_db_engine()
     if drop_tables:
         confirmation = input("Are you sure you want to drop these tables? This can't be undone!! (yes/no): ")
         if confirmation.lower() != 'yes':
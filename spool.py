@@ -0,0 +1,293 @@
+#!/usr/bin/python3
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime
+from sqlalchemy import DateTime, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import SQLAlchemyError, DisconnectionError, InterfaceError, OperationalError
+from schema import Base
+
+SPOOL_PATH = os.path.join("spool", "collector_spool.db")
+BATCH_SIZE = 5000
+# Payload bytes per MySQL transaction; one arp_poll item is a whole ARP table,
+# so the item count alone says little about the size of a batch
+BATCH_BYTES = 8 * 1024 * 1024
+# Failures of the same oldest item before its batch is retried item by item,
+# and then before that item is moved to the quarantine table
+QUARANTINE_AFTER = 3
+# Errors that mean MySQL is unreachable rather than a payload it rejects
+OUTAGE_ERRORS = (OperationalError, InterfaceError, DisconnectionError)
+IDLE_SLEEP = 1.0
+MAX_BACKOFF = 60.0
+STATS_INTERVAL = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quarantine (
+    id INTEGER PRIMARY KEY,
+    target TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    error TEXT,
+    quarantined REAL NOT NULL
+);
+"""
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    raise TypeError(f"Cannot spool {type(value).__name__}")
+
+
+class Spool:
+    """Durable local queue in SQLite (WAL) that collectors write to at disk speed.
+
+    Each item is a target name plus a JSON payload; a Forwarder drains items to
+    MySQL in id order and deletes them only after the MySQL commit, so a crash
+    on either side resumes from the oldest unforwarded item (at-least-once).
+    """
+
+    def __init__(self, path=SPOOL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL survives a process crash; only an OS crash can lose the last commits
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def put(self, target, payload):
+        self.put_many(target, [payload])
+
+    def put_many(self, target, payloads):
+        now = time.time()
+        rows = [(target, json.dumps(payload, default=_encode), now) for payload in payloads]
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT INTO spool (target, payload, created) VALUES (?, ?, ?)", rows)
+
+    def peek(self, limit=BATCH_SIZE, max_bytes=None):
+        """Oldest items in id order, stopping once max_bytes of payload is reached (always at least one)."""
+        with self.lock:
+            cursor = self.conn.execute("SELECT id, target, payload FROM spool ORDER BY id LIMIT ?", (limit,))
+            if max_bytes is None:
+                return cursor.fetchall()
+            items = []
+            size = 0
+            for item in cursor:
+                if items and size + len(item[2]) > max_bytes:
+                    break
+                items.append(item)
+                size += len(item[2])
+            cursor.close()
+            return items
+
+    def ack(self, last_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+
+    def quarantine(self, item_id, error):
+        # Moved aside rather than dropped, so the payload can be inspected and replayed
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO quarantine (id, target, payload, created, error, quarantined) "
+                              "SELECT id, target, payload, created, ?, ? FROM spool WHERE id = ?",
+                              (str(error), time.time(), item_id))
+            self.conn.execute("DELETE FROM spool WHERE id = ?", (item_id,))
+
+    def quarantined(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM quarantine").fetchone()[0]
+
+    def depth(self):
+        """Return (items waiting, age in seconds of the oldest item)."""
+        with self.lock:
+            count, oldest = self.conn.execute("SELECT COUNT(*), MIN(created) FROM spool").fetchone()
+        return count, (time.time() - oldest) if oldest else 0.0
+
+    def depth_by_target(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT target, COUNT(*) FROM spool GROUP BY target").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def table_handler(table):
+    # Default handler: a target named after a table is a bulk insert of its rows
+    datetime_columns = [column.name for column in table.columns if isinstance(column.type, DateTime)]
+
+    def handle(session, payloads):
+        for row in payloads:
+            for column in datetime_columns:
+                if isinstance(row.get(column), str):
+                    row[column] = datetime.fromisoformat(row[column])
+        session.execute(insert(table), payloads)
+    return handle
+
+
+class Forwarder(threading.Thread):
+    """Drains a Spool to MySQL in large batches, backing off while the database is unavailable.
+
+    A batch that keeps failing for any other reason is retried one item per
+    transaction, and an item that still fails is quarantined so it cannot
+    block the spool.
+    """
+
+    def __init__(self, spool, engine, handlers=None, batch_size=BATCH_SIZE, batch_bytes=BATCH_BYTES):
+        super().__init__(name="spool-forwarder", daemon=True)
+        self.spool = spool
+        self.Session = sessionmaker(bind=engine)
+        self.handlers = dict(handlers or {})
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        # Items up to this id are forwarded one per transaction while a bad payload is isolated
+        self.isolate_until = 0
+        self.failed_id = None
+        self.failures = 0
+        self.stopping = threading.Event()
+        self.forwarded = 0
+        self.last_batch_seconds = 0.0
+        self.last_error = None
+
+    def handler(self, target):
+        if target not in self.handlers:
+            if target not in Base.metadata.tables:
+                raise ValueError(f"No spool handler for '{target}'")
+            self.handlers[target] = table_handler(Base.metadata.tables[target])
+        return self.handlers[target]
+
+    def forward_batch(self):
+        """Forward one batch; returns the number of items forwarded (0 when the spool is empty)."""
+        items = self.spool.peek(self.batch_size, self.batch_bytes)
+        if not items:
+            return 0
+        if items[0][0] <= self.isolate_until:
+            items = items[:1]
+        # Consecutive items for the same target go out together, keeping spool order
+        groups = []
+        for item_id, target, payload in items:
+            try:
+                handler = self.handler(target)
+            except ValueError as e:
+                # An item nobody can forward would block the spool forever
+                logging.error(f"Dropping spooled item {item_id}: {e}")
+                continue
+            if not groups or groups[-1][0] != target:
+                groups.append((target, handler, []))
+            groups[-1][2].append(json.loads(payload))
+
+        start = time.monotonic()
+        session = self.Session()
+        try:
+            for target, handler, payloads in groups:
+                handler(session, payloads)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        self.spool.ack(items[-1][0])
+        self.last_batch_seconds = time.monotonic() - start
+        self.forwarded += len(items)
+        return len(items)
+
+    def drain(self):
+        total = 0
+        while True:
+            count = self.forward_batch()
+            if not count:
+                return total
+            total += count
+
+    def run(self):
+        backoff = IDLE_SLEEP
+        last_stats = time.monotonic()
+        while not self.stopping.is_set():
+            try:
+                count = self.forward_batch()
+                self.last_error = None
+                self.failures = 0
+                backoff = IDLE_SLEEP
+            except Exception as e:
+                # Items stay spooled; retry with exponential backoff
+                self.last_error = str(e)
+                if isinstance(e, OUTAGE_ERRORS):
+                    logging.warning(f"Spool forwarding failed, retrying in {backoff:.0f}s: {e}")
+                else:
+                    logging.exception(f"Spool forwarding failed, retrying in {backoff:.0f}s")
+                    self.payload_failed(e)
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            if time.monotonic() - last_stats >= STATS_INTERVAL:
+                last_stats = time.monotonic()
+                depth, age = self.spool.depth()
+                logging.info(f"Spool depth {depth} (oldest {age:.0f}s), forwarded {self.forwarded}, "
+                             f"last batch {self.last_batch_seconds:.2f}s")
+            if count < self.batch_size:
+                self.stopping.wait(IDLE_SLEEP)
+
+    def payload_failed(self, error):
+        items = self.spool.peek(self.batch_size, self.batch_bytes)
+        if not items:
+            return
+        head = items[0][0]
+        self.failures = self.failures + 1 if head == self.failed_id else 1
+        self.failed_id = head
+        if self.failures < QUARANTINE_AFTER:
+            return
+        self.failures = 0
+        if head > self.isolate_until and len(items) > 1:
+            # Find which payload in the batch is bad
+            self.isolate_until = items[-1][0]
+            logging.warning(f"Forwarding spooled items {head}-{self.isolate_until} one at a time")
+        else:
+            logging.error(f"Quarantining spooled item {head} after {QUARANTINE_AFTER} failures: {error}")
+            self.spool.quarantine(head, error)
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or drain the collector spool.")
+    parser.add_argument('--path', default=SPOOL_PATH, help="Spool database file")
+    parser.add_argument('--drain', action='store_true', help="Forward everything spooled to MySQL and exit")
+    args = parser.parse_args()
+
+    spool = Spool(args.path)
+    depth, age = spool.depth()
+    print(f"Spool depth: {depth} items, oldest {age:.0f}s")
+    for target, count in sorted(spool.depth_by_target().items()):
+        print(f"  {target:<25} {count}")
+    quarantined = spool.quarantined()
+    if quarantined:
+        print(f"Quarantined: {quarantined} items that failed to forward (see the quarantine table)")
+    if args.drain and depth:
+        from db_connect import create_db_engine
+        from arp_poller import SPOOL_HANDLERS
+        forwarder = Forwarder(spool, create_db_engine(), SPOOL_HANDLERS)
+        try:
+            print(f"Forwarded {forwarder.drain()} items")
+        except SQLAlchemyError as e:
+            print(f"Forwarding failed: {e}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
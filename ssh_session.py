@@ -0,0 +1,133 @@
+import re
+import time
+import socket
+import paramiko
+from stream_capture import stream_to_file, CaptureLimitExceeded, STREAM_MAX_BYTES, STREAM_TIMEOUT
+
+PROMPT_RE = re.compile(r"[\w.\-@()]+[>#] ?$")
+RECV_SIZE = 65535
+# Characters at the end of the output checked for the prompt
+PROMPT_TAIL = 256
+
+
+class CommandTimeout(Exception):
+    pass
+
+
+class PanSSHSession:
+    """One authenticated SSH transport and interactive shell per firewall.
+
+    Pager and scripting mode are set once when the shell opens, so every
+    command sent afterwards runs on the same channel with the same settings.
+    """
+
+    def __init__(self, host, user, password=None, key_file=None, connect_timeout=30, command_timeout=300):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.key_file = key_file
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.client = None
+        self.channel = None
+        self.prompt = None
+        self.timings = {}
+
+    def open(self):
+        start = time.monotonic()
+        self.client = paramiko.SSHClient()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        if self.key_file:
+            self.client.connect(self.host, username=self.user, key_filename=self.key_file,
+                                timeout=self.connect_timeout)
+        else:
+            self.client.connect(self.host, username=self.user, password=self.password,
+                                timeout=self.connect_timeout, look_for_keys=False, allow_agent=False)
+        self.client.get_transport().set_keepalive(30)
+        self.channel = self.client.invoke_shell(width=511, height=0)
+        self.channel.settimeout(1.0)
+
+        # Learn the exact prompt from the login banner, then configure the CLI once
+        banner = self._read_until(lambda buffer: PROMPT_RE.search(buffer.rstrip("\r\n ") + " "),
+                                  self.connect_timeout)
+        self.prompt = banner.rstrip().splitlines()[-1].strip()
+        self.timings["connect"] = time.monotonic() - start
+        start = time.monotonic()
+        self.run("set cli pager off")
+        self.run("set cli scripting-mode on")
+        self.timings["setup"] = time.monotonic() - start
+        return self
+
+    def close(self):
+        if self.client:
+            self.client.close()
+        self.client = None
+        self.channel = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _recv(self):
+        try:
+            data = self.channel.recv(RECV_SIZE)
+        except socket.timeout:
+            return ""
+        if not data:
+            raise EOFError(f"SSH channel to {self.host} closed")
+        return data.decode(errors="replace")
+
+    def _at_prompt(self, buffer):
+        return buffer.rstrip().endswith(self.prompt)
+
+    def _read_until(self, done, timeout):
+        # Chunks are joined once at the end and done() only sees the tail, so
+        # large outputs (routes, sessions) are not rescanned on every chunk
+        chunks = []
+        tail = ""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            chunk = self._recv()
+            if not chunk:
+                continue
+            chunks.append(chunk)
+            tail = (tail + chunk)[-PROMPT_TAIL:]
+            if done(tail):
+                return "".join(chunks)
+        raise CommandTimeout(f"Timed out after {timeout}s waiting for prompt on {self.host}")
+
+    def run(self, command, timeout=None):
+        """Send one command and return (output, latency_seconds)."""
+        timeout = timeout or self.command_timeout
+        start = time.monotonic()
+        self.channel.send(command + "\n")
+        try:
+            buffer = self._read_until(self._at_prompt, timeout)
+        except CommandTimeout:
+            # Interrupt the command and resync on the prompt so the next command starts clean
+            self.channel.send("\x03")
+            self._read_until(self._at_prompt, 10)
+            raise
+        latency = time.monotonic() - start
+
+        # Strip the echoed command and the trailing prompt
+        lines = buffer.replace("\r", "").split("\n")
+        if lines and lines[0].strip().endswith(command):
+            lines = lines[1:]
+        if lines and lines[-1].strip().endswith(self.prompt):
+            lines = lines[:-1]
+        return "\n".join(lines), latency
+
+    def stream(self, command, path, max_bytes=STREAM_MAX_BYTES, timeout=STREAM_TIMEOUT, stats=None):
+        """Send one command and stream its output into a gzip file; returns (bytes, latency_seconds)."""
+        start = time.monotonic()
+        self.channel.send(command + "\n")
+        try:
+            received = stream_to_file(self._recv, path, command, self.prompt, max_bytes, timeout, stats)
+        except CaptureLimitExceeded:
+            self.channel.send("\x03")
+            self._read_until(self._at_prompt, 10)
+            raise
+        return received, time.monotonic() - start
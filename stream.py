@@ -15,11 +15,35 @@ print("Current working directory:", os.getcwd())
 print("Python path:", sys.path)
 
 from logging_setup import xml_logger, main_logger
+import time
+from datetime import datetime
+import arp_index
 
 # Use the loggers in your code
 xml_logger.debug("This is a test log message for XML processing.")
 main_logger.debug("This is a test log message for main processing.")
 
+def display_arp_lookup():
+    # Answers come from the ARP poller's in-memory index snapshot, not MySQL
+    index = arp_index.current()
+    if index is None:
+        st.warning("No ARP index snapshot yet; it is written after each arp_poller.py cycle.")
+        return
+    st.caption(f"{len(index)} entries, updated {datetime.fromtimestamp(index.built_at):%Y-%m-%d %H:%M:%S}")
+    query = st.text_input("IP, CIDR prefix, MAC or OUI", placeholder="10.20.30.40, 10.20.0.0/16, 00:1b:17")
+    online_only = st.checkbox("Online only")
+    if not query:
+        return
+    start = time.perf_counter()
+    try:
+        results = index.lookup(query, online_only=online_only)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    st.write(f"{len(results)} entries in {(time.perf_counter() - start) * 1e6:.0f} µs")
+    if results:
+        st.dataframe(results, use_container_width=True)
+
 def main():
     st.set_page_config(page_title="Publix Network Monitoring", layout="wide")
 
@@ -76,7 +100,7 @@ def main():
             
         with PAtabs[2]:
             st.header("ARP Table")
-            st.write("Palo ARP information goes here.")
+            display_arp_lookup()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
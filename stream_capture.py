@@ -0,0 +1,83 @@
+import gzip
+import time
+
+# Commands whose output can run to hundreds of MB on a busy store; these are
+# written to disk as they arrive instead of being buffered into one string.
+STREAM_COMMANDS = (
+    "show session all",
+    "show log system receive_time in last-24-hrs",
+    "show arp all",
+    "show routing route",
+    "show routing protocol bgp loc-rib",
+    "show routing protocol bgp rib-out",
+)
+
+STREAM_MAX_BYTES = 1024 * 1024 * 1024
+STREAM_TIMEOUT = 900
+IDLE_SLEEP = 0.05
+
+
+class CaptureLimitExceeded(Exception):
+    pass
+
+
+def stream_to_file(read_chunk, path, command, prompt, max_bytes=STREAM_MAX_BYTES, timeout=STREAM_TIMEOUT,
+                   stats=None):
+    """Copy a command's output from an SSH channel into a gzip file chunk by chunk.
+
+    read_chunk() returns whatever text is available ("" if nothing yet). Only a
+    tail the length of the prompt is held back so the trailing prompt can be
+    recognised and dropped; memory use is independent of the output size.
+    Returns the number of bytes received. On a byte or time limit the partial
+    output is kept, a marker is appended and CaptureLimitExceeded is raised.
+    If a stats dict is given, the seconds spent compressing/writing are added
+    under "write".
+    """
+    received = 0
+    echo_pending = True
+    tail = ""
+    hold = len(prompt) + 8
+    deadline = time.monotonic() + timeout
+    write_time = 0.0
+
+    out = gzip.open(path, "wt", compresslevel=6)
+    try:
+        while True:
+            chunk = read_chunk()
+            if not chunk:
+                if time.monotonic() > deadline:
+                    # The held-back tail is real output too
+                    out.write(tail + f"\n*** capture truncated: no prompt after {timeout}s ***\n")
+                    raise CaptureLimitExceeded(f"'{command}' exceeded the {timeout}s time limit")
+                time.sleep(IDLE_SLEEP)
+                continue
+
+            received += len(chunk)
+            tail += chunk.replace("\r", "")
+            if echo_pending:
+                # Drop the echoed command line before anything is written
+                if "\n" not in tail:
+                    continue
+                tail = tail.split("\n", 1)[1]
+                echo_pending = False
+
+            if tail.rstrip().endswith(prompt):
+                out.write(tail.rstrip()[:-len(prompt)].rstrip("\n"))
+                return received
+            if received > max_bytes:
+                out.write(tail + f"\n*** capture truncated at {max_bytes} bytes ***\n")
+                raise CaptureLimitExceeded(f"'{command}' exceeded the {max_bytes} byte limit")
+            if time.monotonic() > deadline:
+                out.write(tail + f"\n*** capture truncated after {timeout}s ***\n")
+                raise CaptureLimitExceeded(f"'{command}' exceeded the {timeout}s time limit")
+
+            if len(tail) > hold:
+                write_start = time.monotonic()
+                out.write(tail[:-hold])
+                write_time += time.monotonic() - write_start
+                tail = tail[-hold:]
+    finally:
+        write_start = time.monotonic()
+        out.close()
+        if stats is not None:
+            stats["write"] = stats.get("write", 0.0) + write_time + time.monotonic() - write_start
@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+import time
+import logging
+import argparse
+from datetime import datetime
+import numpy as np
+from sqlalchemy import select, text
+from db_connect import create_db_engine
+from schema import Thresholds, HEALTH_METRICS
+
+# A breach clears only once the value is back inside the bound by this
+# fraction of the bound, so a metric hovering at the limit does not flap
+HYSTERESIS = 0.05
+REFRESH_INTERVAL = 300
+
+# firewall_health metric -> prefix of its <prefix>_high/<prefix>_low columns in thresholds
+THRESHOLD_COLUMNS = {
+    "cpu_usage": "cpu",
+    "memory_used": "memory_used",
+    "memory_free": "memory_free",
+    "disk_usage": "disk_usage",
+    "network_bandwidth": "network_bandwidth",
+    "packet_rate": "packet_rate",
+    "concurrent_connections": "concurrent_connections",
+    "new_connections_per_sec": "new_connections_per_sec",
+    "vpn_sessions": "vpn_sessions",
+    "firewall_drops": "firewall_drops",
+    "icmp_latency": "icmp_latency",
+    "packet_loss": "packet_loss",
+}
+
+
+def threshold_columns(metrics):
+    """Return [(high column, low column)] for metrics, failing on a metric the thresholds table cannot bound."""
+    columns = []
+    for metric in metrics:
+        prefix = THRESHOLD_COLUMNS.get(metric)
+        if prefix is None:
+            raise ValueError(f"Health metric '{metric}' has no threshold columns; add it to THRESHOLD_COLUMNS")
+        high, low = f"{prefix}_high", f"{prefix}_low"
+        if high not in Thresholds.__table__.c or low not in Thresholds.__table__.c:
+            raise ValueError(f"thresholds table has no {high}/{low} columns for health metric '{metric}'")
+        columns.append((high, low))
+    return columns
+
+
+class ThresholdEngine:
+    """Evaluates batches of firewall_health rows against the thresholds table.
+
+    Thresholds live in two (devices x metrics) float matrices, NaN where no
+    bound is set, and breach state in two boolean matrices of the same shape.
+    A batch is checked with a handful of array comparisons regardless of size.
+    """
+
+    def __init__(self, engine=None, metrics=HEALTH_METRICS, hysteresis=HYSTERESIS, refresh_interval=REFRESH_INTERVAL):
+        self.engine = engine
+        self.metrics = list(metrics)
+        self.columns = threshold_columns(self.metrics)
+        self.hysteresis = hysteresis
+        self.refresh_interval = refresh_interval
+        self.host_index = {}
+        self.hostnames = np.array([], dtype=object)
+        self.high = np.empty((0, len(self.metrics)))
+        self.low = np.empty((0, len(self.metrics)))
+        self.high_active = np.zeros((0, len(self.metrics)), dtype=bool)
+        self.low_active = np.zeros((0, len(self.metrics)), dtype=bool)
+        self.signature = None
+        self.loaded_at = 0.0
+
+    def load(self, rows):
+        """Build the matrices from thresholds rows (dicts or mappings), keeping breach state of known hosts."""
+        rows = sorted(rows, key=lambda row: row["hostname"])
+        signature = hash(tuple(tuple(row[column] for pair in self.columns for column in pair)
+                               + (row["hostname"],) for row in rows))
+        self.loaded_at = time.monotonic()
+        if signature == self.signature:
+            return False
+
+        hostnames = [row["hostname"] for row in rows]
+        high = np.array([[row[column] for column, _ in self.columns] for row in rows], dtype=float)
+        low = np.array([[row[column] for _, column in self.columns] for row in rows], dtype=float)
+        high = high.reshape(len(rows), len(self.metrics))
+        low = low.reshape(len(rows), len(self.metrics))
+
+        high_active = np.zeros(high.shape, dtype=bool)
+        low_active = np.zeros(low.shape, dtype=bool)
+        # Carry over open breaches for hosts that are still present
+        old = [self.host_index.get(hostname, -1) for hostname in hostnames]
+        keep = np.array([index >= 0 for index in old], dtype=bool)
+        if keep.any():
+            old_rows = np.array([index for index in old if index >= 0])
+            high_active[keep] = self.high_active[old_rows]
+            low_active[keep] = self.low_active[old_rows]
+
+        self.host_index = {hostname: index for index, hostname in enumerate(hostnames)}
+        self.hostnames = np.array(hostnames, dtype=object)
+        self.high, self.low = high, low
+        self.high_active, self.low_active = high_active, low_active
+        self.signature = signature
+        logging.info(f"Loaded thresholds for {len(hostnames)} devices")
+        return True
+
+    def refresh(self, force=False):
+        # The table is small; re-reading it and comparing a signature is cheaper
+        # than tracking changes, and the matrices are only rebuilt when it differs
+        if not force and time.monotonic() - self.loaded_at < self.refresh_interval:
+            return False
+        self.engine = self.engine or create_db_engine()
+        with self.engine.connect() as conn:
+            rows = [row._mapping for row in conn.execute(select(Thresholds.__table__))]
+        return self.load(rows)
+
+    def evaluate(self, health_rows, now=None):
+        """Check a batch of firewall_health rows and return breach/clear events in time order."""
+        if self.engine is not None or self.signature is None:
+            self.refresh()
+        indexes = []
+        values = []
+        timestamps = []
+        # Rows of one host must be applied oldest first for the breach state to be right
+        for row in sorted(health_rows, key=lambda row: (row["hostname"], row.get("timestamp") or datetime.min)):
+            index = self.host_index.get(row["hostname"])
+            if index is None:
+                continue
+            indexes.append(index)
+            values.append([row.get(metric) for metric in self.metrics])
+            timestamps.append(row.get("timestamp"))
+        if not indexes:
+            return []
+        return self.evaluate_arrays(np.array(indexes), np.array(values, dtype=float), now,
+                                    np.array(timestamps, dtype=object))
+
+    def evaluate_arrays(self, indexes, values, now=None, timestamps=None):
+        """Vectorized core: indexes is (k,) device rows, values is (k, metrics) with NaN for missing.
+
+        Rows of the same device are applied in the order given: the batch is split
+        into rounds holding each device's n-th row, and each round is one step.
+        Events carry the timestamp of the row that caused them (timestamps is an
+        optional (k,) object array), or now for rows without one, and are
+        returned sorted by it.
+        """
+        now = now or datetime.now()
+        if timestamps is None:
+            timestamps = np.full(len(indexes), None, dtype=object)
+        order = np.argsort(indexes, kind="stable")
+        sorted_indexes = indexes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_indexes[1:] != sorted_indexes[:-1]])
+        occurrence = np.empty(len(indexes), dtype=int)
+        occurrence[order] = np.arange(len(indexes)) - np.repeat(starts, np.diff(np.r_[starts, len(indexes)]))
+        events = []
+        for step in range(occurrence.max() + 1 if len(indexes) else 0):
+            mask = occurrence == step
+            events.extend(self._evaluate_step(indexes[mask], values[mask], timestamps[mask], now))
+        # Stable, so events of one row keep their order
+        return sorted(events, key=lambda event: event["timestamp"])
+
+    def _evaluate_step(self, indexes, values, timestamps, now):
+        # indexes holds each device at most once
+        high = self.high[indexes]
+        low = self.low[indexes]
+        # NaN compares False, so missing values and unset bounds never change state
+        above = values > high
+        below = values < low
+        high_clear = values <= high - np.abs(high) * self.hysteresis
+        low_clear = values >= low + np.abs(low) * self.hysteresis
+
+        events = []
+        for active, breach, clear, bound, direction in ((self.high_active, above, high_clear, high, "high"),
+                                                        (self.low_active, below, low_clear, low, "low")):
+            previous = active[indexes]
+            new_breach = breach & ~previous
+            cleared = previous & clear
+            active[indexes] = (previous | breach) & ~clear
+            for kind, mask in (("breach", new_breach), ("clear", cleared)):
+                for row, column in zip(*np.nonzero(mask)):
+                    events.append({
+                        "hostname": self.hostnames[indexes[row]],
+                        "metric": self.metrics[column],
+                        "event": kind,
+                        "direction": direction,
+                        "value": float(values[row, column]),
+                        "threshold": float(bound[row, column]),
+                        "timestamp": timestamps[row] or now,
+                    })
+        return events
+
+    def active_breaches(self):
+        result = []
+        for active, direction in ((self.high_active, "high"), (self.low_active, "low")):
+            for row, column in zip(*np.nonzero(active)):
+                result.append((self.hostnames[row], self.metrics[column], direction))
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the latest health rows against the thresholds table.")
+    parser.add_argument('-m', '--minutes', type=int, default=10, help="Evaluate rows from the last MINUTES")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    engine = create_db_engine()
+    threshold_engine = ThresholdEngine(engine)
+    with engine.connect() as conn:
+        rows = [dict(row._mapping) for row in conn.execute(text(
+            "SELECT * FROM firewall_health WHERE timestamp >= NOW() - INTERVAL :minutes MINUTE ORDER BY timestamp"),
+            {"minutes": args.minutes})]
+    start = time.monotonic()
+    events = threshold_engine.evaluate(rows)
+    print(f"Evaluated {len(rows)} rows in {(time.monotonic() - start) * 1000:.1f} ms")
+    for event in events:
+        print(f"{event['hostname']:<20} {event['metric']:<25} {event['event']:<7} {event['direction']:<5} "
+              f"{event['value']} (threshold {event['threshold']})")
+
+
+if __name__ == "__main__":
+    main()
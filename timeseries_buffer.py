@@ -0,0 +1,131 @@
+import threading
+import numpy as np
+
+
+class TimeSeriesBuffer:
+    """Fixed-size per-host history of several metrics in preallocated NumPy ring buffers.
+
+    Each host gets a times array (epoch seconds) and a (capacity x metrics)
+    values array, allocated on its first sample; appends overwrite the oldest
+    slot, so memory is fixed however long the buffer runs.
+    """
+
+    def __init__(self, metrics, capacity):
+        self.metrics = list(metrics)
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.times = {}
+        self.values = {}
+        self.head = {}
+        self.count = {}
+
+    def hosts(self):
+        with self.lock:
+            return list(self.times)
+
+    def append(self, host, timestamp, values):
+        """Add one sample; values is a dict by metric name (missing -> NaN) or a sequence in metric order."""
+        if isinstance(values, dict):
+            values = [values.get(metric, np.nan) for metric in self.metrics]
+        with self.lock:
+            if host not in self.times:
+                self.times[host] = np.full(self.capacity, np.nan)
+                self.values[host] = np.full((self.capacity, len(self.metrics)), np.nan)
+                self.head[host] = 0
+                self.count[host] = 0
+            slot = self.head[host]
+            self.times[host][slot] = timestamp
+            self.values[host][slot] = values
+            self.head[host] = (slot + 1) % self.capacity
+            self.count[host] = min(self.count[host] + 1, self.capacity)
+
+    def _ordered(self, host):
+        # Slot order oldest -> newest
+        count, head = self.count[host], self.head[host]
+        if count < self.capacity:
+            return np.arange(count)
+        return (np.arange(count) + head) % self.capacity
+
+    def window(self, host, seconds=None, now=None):
+        """Return copies (times, values) of the host's samples from the last `seconds`, oldest first."""
+        with self.lock:
+            if host not in self.times:
+                return np.empty(0), np.empty((0, len(self.metrics)))
+            order = self._ordered(host)
+            times = self.times[host][order]
+            values = self.values[host][order]
+        if seconds is not None and len(times):
+            cutoff = (now if now is not None else times[-1]) - seconds
+            start = np.searchsorted(times, cutoff, "left")
+            times, values = times[start:], values[start:]
+        return times, values
+
+    def latest(self, host):
+        with self.lock:
+            if not self.count.get(host):
+                return None
+            slot = (self.head[host] - 1) % self.capacity
+            return dict(zip(self.metrics, self.values[host][slot].tolist()))
+
+    def series(self, host, metric, seconds=None):
+        times, values = self.window(host, seconds)
+        return times, values[:, self.metrics.index(metric)]
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the shape of y(x)."""
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+    # First and last points are always kept; the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, length - 1, threshold - 1).astype(int)
+    indices = np.empty(threshold, dtype=int)
+    indices[0], indices[-1] = 0, length - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The next bucket's average is the third corner of the triangle
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else length
+        next_x = x[next_start:next_end].mean()
+        next_y = np.nanmean(y[next_start:next_end]) if np.isfinite(y[next_start:next_end]).any() else y[previous]
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + (int(np.nanargmax(areas)) if np.isfinite(areas).any() else 0)
+        indices[bucket + 1] = previous
+    return indices
+
+
+def minmax_indices(y, buckets):
+    """Indices of each bucket's min and max, in order; cheaper than LTTB and keeps every spike."""
+    length = len(y)
+    if buckets * 2 >= length:
+        return np.arange(length)
+    edges = np.linspace(0, length, buckets + 1).astype(int)
+    filled = np.where(np.isnan(y), np.nanmean(y) if np.isfinite(y).any() else 0.0, y)
+    # Position of min/max within each bucket via reduceat on the bucketed values
+    lows = np.minimum.reduceat(filled, edges[:-1])
+    highs = np.maximum.reduceat(filled, edges[:-1])
+    bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+    low_index = np.flatnonzero(filled == lows[bucket_of])
+    high_index = np.flatnonzero(filled == highs[bucket_of])
+    # Keep the first min and first max per bucket
+    low_index = low_index[np.unique(bucket_of[low_index], return_index=True)[1]]
+    high_index = high_index[np.unique(bucket_of[high_index], return_index=True)[1]]
+    return np.unique(np.concatenate([low_index, high_index]))
+
+
+def downsample(times, values, max_points, method="lttb"):
+    """Reduce (times, values) to about max_points for plotting; values may be 1-D or (n x series).
+
+    With several series, each gets an equal share of the points and the union of
+    the kept indices is returned, so every series keeps its own peaks.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(times) <= max_points:
+        return times, values
+    columns = values.reshape(len(times), -1)
+    share = max(3, max_points // columns.shape[1])
+    keep = np.unique(np.concatenate([
+        lttb(times, columns[:, column], share) if method == "lttb" else minmax_indices(columns[:, column], share // 2)
+        for column in range(columns.shape[1])]))
+    return times[keep], values[keep]